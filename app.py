@@ -1,406 +1,337 @@
 import os
-import xml.etree.ElementTree as ET
-import requests
-import qrcode
-import subprocess
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory
+from flask import Flask, render_template, request, url_for, jsonify, Response, stream_with_context
+import click
+import contextlib
+import sys
+import json
 from werkzeug.utils import secure_filename
-import re
-import shlex
-import tempfile
-from urllib.parse import unquote, urlparse, parse_qs
+import jobs
+from jobs import JobQueue, RenderWorkerPool
+import encoder_profiles
+import instrumentation
+import pipeline
+import sqlite_store
+from pipeline import APP_DIR, GENERATED_FOLDER, artifacts, ffmpeg_tools, media_files, plate_images, qr_images, render_outputs, run_conversion, run_batch_conversion
+from delivery import OutputDelivery
+from layout import LayoutError, UnknownLayoutError, available_layouts
+from storage import ArtifactStore
 
 # Flask App Initialization
 app = Flask(__name__)
 
-# Configuration
-APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Configuration: pipeline settings (ffmpeg, caches, storage, QR, encoder profile) are read by pipeline.py
+# and mirrored here; the web app adds its upload limits, the job queue and output delivery
+app.config.update(pipeline.config)
 UPLOAD_FOLDER = os.path.join(APP_DIR, 'uploads')
-GENERATED_FOLDER = os.path.join(APP_DIR, 'generated')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['GENERATED_FOLDER'] = GENERATED_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 30 * 1024 * 1024  # 30 MB limit for VAST XML
+app.config['ALLOWED_EXTENSIONS'] = {'xml', 'txt'}
 
-# Ensure upload and generated directories exist
+# Render job queue: jobs live in SQLite so they survive worker restarts, and each process runs a
+# bounded pool of render workers sized per CPU core (RENDER_WORKERS)
+app.config['JOB_DB_PATH'] = os.environ.get('JOB_DB_PATH', os.path.join(GENERATED_FOLDER, 'jobs.sqlite3'))
+# Finished jobs are deleted this long after they finish; by then storage GC has usually removed their outputs
+app.config['JOB_RETENTION_SECONDS'] = int(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+
+# Output delivery: none | x-accel-redirect (nginx) | x-sendfile (Apache/lighttpd) for files of at least DELIVERY_OFFLOAD_MIN_BYTES
+app.config['DELIVERY_OFFLOAD'] = os.environ.get('DELIVERY_OFFLOAD', 'none')
+app.config['DELIVERY_ACCEL_PREFIX'] = os.environ.get('DELIVERY_ACCEL_PREFIX', '/protected-generated/')
+app.config['DELIVERY_OFFLOAD_MIN_BYTES'] = int(os.environ.get('DELIVERY_OFFLOAD_MIN_BYTES', 1024 * 1024))
+
+# Uploaded VAST files are kept in their own workspace store, collected sooner than renders
+app.config['UPLOADS_DB_PATH'] = os.environ.get('UPLOADS_DB_PATH', os.path.join(GENERATED_FOLDER, 'uploads.sqlite3'))
+app.config['UPLOADS_MAX_BYTES'] = int(os.environ.get('UPLOADS_MAX_BYTES', 1024 * 1024 * 1024))
+app.config['UPLOADS_MAX_AGE'] = int(os.environ.get('UPLOADS_MAX_AGE', 24 * 3600))
+
+# Ensure the upload directory exists (pipeline creates the generated one)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(GENERATED_FOLDER, exist_ok=True)
-
-def get_ffmpeg_path():
-    ffmpeg_executable_path = ''
-    print(f"[DEBUG Pathing - LOCAL] get_ffmpeg_path invoked. APP_DIR: {APP_DIR}", flush=True)
-
-    local_mac_ffmpeg_path = '/opt/homebrew/bin/ffmpeg'
-    print(f"[DEBUG Pathing - LOCAL] Checking for local macOS Homebrew ffmpeg at: {local_mac_ffmpeg_path}", flush=True)
-    if os.path.exists(local_mac_ffmpeg_path) and os.access(local_mac_ffmpeg_path, os.X_OK):
-        print(f"[DEBUG Pathing - LOCAL] Using local macOS ffmpeg (Homebrew): {local_mac_ffmpeg_path}", flush=True)
-        ffmpeg_executable_path = local_mac_ffmpeg_path
-    else:
-        print(f"[DEBUG Pathing - LOCAL] Local macOS Homebrew ffmpeg not found or not executable at: {local_mac_ffmpeg_path}. Attempting fallback to PATH.", flush=True)
-
-    if not ffmpeg_executable_path:
-        # Fallback: 'ffmpeg' from system PATH
-        print(f"[DEBUG Pathing - LOCAL] Trying 'ffmpeg' from system PATH.", flush=True)
-        ffmpeg_executable_path = 'ffmpeg'
-    
-    # Validate the chosen ffmpeg path by trying to run it
-    if ffmpeg_executable_path: 
-        try:
-            print(f"[DEBUG Pathing - LOCAL] Attempting to get version from: {ffmpeg_executable_path}", flush=True)
-            process = subprocess.run([ffmpeg_executable_path, '-version'], capture_output=True, text=True, timeout=5, check=False)
-            print(f"[DEBUG Pathing - LOCAL] {ffmpeg_executable_path} -version RC: {process.returncode}", flush=True)
-            if process.stdout or process.stderr: 
-                 print(f"[DEBUG Pathing - LOCAL] {ffmpeg_executable_path} -version STDOUT snippet: {process.stdout[:200]}", flush=True)
-                 print(f"[DEBUG Pathing - LOCAL] {ffmpeg_executable_path} -version STDERR snippet: {process.stderr[:200]}", flush=True)
-                 # Consider valid if it runs and produces output, even if RC is not 0 for -version
-            else: 
-                print(f"[ERROR Pathing - LOCAL] {ffmpeg_executable_path} -version produced no output. Path may be invalid or ffmpeg corrupted.", flush=True)
-                ffmpeg_executable_path = '' # Invalidate path
-        except subprocess.TimeoutExpired:
-            print(f"[ERROR Pathing - LOCAL] Timeout when trying {ffmpeg_executable_path} -version. Path: {ffmpeg_executable_path}", flush=True)
-            ffmpeg_executable_path = '' 
-        except Exception as e_version:
-            print(f"[ERROR Pathing - LOCAL] Exception while trying {ffmpeg_executable_path} -version: {e_version}. Path: {ffmpeg_executable_path}", flush=True)
-            ffmpeg_executable_path = ''
-
-    if not ffmpeg_executable_path:
-        print("[ERROR Pathing - LOCAL] FFmpeg path could not be determined or validated. Please ensure ffmpeg is installed and in your PATH, or at /opt/homebrew/bin/ffmpeg.", flush=True)
-        return None 
-
-    print(f"[DEBUG Pathing - LOCAL] Final ffmpeg path determined: {ffmpeg_executable_path}", flush=True)
-    return ffmpeg_executable_path
+
+# Probe at startup so the first conversion doesn't pay for it. Its log lines go to stderr because this
+# runs on import, before `flask batch` reserves stdout for JSON lines
+with contextlib.redirect_stdout(sys.stderr):
+    ffmpeg_tools.get()
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-def extract_brand_name(ad_title):
-    if not ad_title:
-        return "Default Brand"
-    match_omd = re.search(r"_OMD_([^_]+)_", ad_title, re.IGNORECASE)
-    if match_omd:
-        return match_omd.group(1)
-    parts = ad_title.split('_')
-    if len(parts) > 1:
-        if len(parts[1]) > 2: 
-            return parts[1]
-    potential_brands = [p for p in parts if len(p) > 3 and p[0].isupper()]
-    if potential_brands:
-        return potential_brands[0]
-    return ad_title.split('(')[0].strip()
-
-def extract_click_url(clickthrough_url):
-    if not clickthrough_url: return None
+def run_conversion_job(job, report_progress):
+    result = run_conversion(job['payload'], report_progress, workspace=artifacts.workspace(job['id']))
+    # The stored result names the ffmpeg log instead of holding it; the result page reads it back from disk
+    if result.get('ffmpeg_log_filename'):
+        result.pop('ffmpeg_log_content', None)
+    return result
+
+def stored_log(context):
+    # The ffmpeg log of a finished job, while storage GC hasn't collected it
+    log_filename = context.get('ffmpeg_log_filename')
+    log_filepath = artifacts.path(log_filename) if log_filename else None
+    if log_filepath and 'ffmpeg_log_content' not in context and os.path.exists(log_filepath):
+        with open(log_filepath, 'r') as log_f:
+            return log_f.read()
+    return context.get('ffmpeg_log_content')
+
+job_queue = JobQueue(app.config['JOB_DB_PATH'], retention_seconds=app.config['JOB_RETENTION_SECONDS'])
+uploads = ArtifactStore(app.config['UPLOAD_FOLDER'], app.config['UPLOADS_DB_PATH'], app.config['UPLOADS_MAX_BYTES'],
+                        app.config['UPLOADS_MAX_AGE'], grace_seconds=app.config['STORAGE_GRACE_SECONDS'],
+                        gc_interval=app.config['STORAGE_GC_INTERVAL'])
+output_delivery = OutputDelivery(app.config['GENERATED_FOLDER'], index=artifacts, offload=app.config['DELIVERY_OFFLOAD'],
+                                 accel_prefix=app.config['DELIVERY_ACCEL_PREFIX'],
+                                 offload_min_bytes=app.config['DELIVERY_OFFLOAD_MIN_BYTES'])
+render_pool = RenderWorkerPool(job_queue, run_conversion_job, app.config['RENDER_WORKERS'])
+
+@app.before_request
+def ensure_render_workers():
+    if request.endpoint != 'static':
+        render_pool.start()
+        artifacts.start()
+        uploads.start()
+
+@app.context_processor
+def inject_encoder_profiles():
+    return {'encoder_profiles': encoder_profiles.PROFILES, 'default_encoder_profile': app.config['ENCODER_PROFILE']}
+
+def wants_json():
+    best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return best == 'application/json' and request.accept_mimetypes[best] > request.accept_mimetypes['text/html']
+
+def conversion_payload_from_request():
+    # Returns (payload, error): the raw VAST input and render options, or the message for a 400. Fetching and
+    # parsing the VAST happens on a render worker; the options are checked here, before an upload is stored
+    body = request.get_json(silent=True) if request.is_json else {}
+    if not isinstance(body, dict):
+        return None, "The JSON body must be an object."
+    values = {}
+    for field in ('vast_input', 'profile', 'layout'):
+        value = request.form.get(field, '').strip()
+        if not value and body.get(field) is not None:
+            if not isinstance(body[field], str):
+                return None, f"'{field}' must be a string."
+            value = body[field].strip()
+        values[field] = value
+    options = {option: values[option] for option in ('profile', 'layout') if values[option]}
+    # A variant set (see pipeline.plan_variants) is JSON-only
+    if 'variants' in body:
+        options['variants'] = body['variants']
+
+    vast_file = request.files.get('vast_file')
+    has_upload = vast_file and vast_file.filename != '' and allowed_file(vast_file.filename)
+    if not has_upload and not values['vast_input']:
+        return None, "No VAST content provided or file type not allowed."
+    options_error = conversion_options_error(options)
+    if options_error:
+        return None, options_error
+    if has_upload:
+        # Each upload gets its own workspace so same-named files never overwrite each other
+        upload_path = f"{uploads.workspace()}/{secure_filename(vast_file.filename) or 'vast.xml'}"
+        vast_file.save(uploads.path(upload_path))
+        uploads.add(upload_path, 'upload')
+        with open(uploads.path(upload_path), 'r', encoding='utf-8') as f:
+            return dict(options, vast_content=f.read()), None
+    return dict(options, vast_input=values['vast_input']), None
+
+def conversion_options_error(options):
+    # Unknown profiles, layouts or variant specs are rejected up front, like /batch does, instead of failing in a worker
     try:
-        parsed = urlparse(clickthrough_url)
-        query_params = parse_qs(parsed.query)
-        click_url_list = query_params.get('click', [])
-        if click_url_list:
-            click_url = click_url_list[0]
-            return unquote(click_url)
-        for key in ['u', 'url', 'redirect_url', 'destination_url', 'finalUrl', 'targetUrl', 'goto']:
-            dest_url_list = query_params.get(key, [])
-            if dest_url_list:
-                return unquote(dest_url_list[0])
-    except Exception as e:
-        print(f"Error parsing or extracting click URL from {clickthrough_url}: {e}", flush=True)
+        profile = encoder_profiles.get_profile(options.get('profile') or app.config['ENCODER_PROFILE'])
+        layout = pipeline.load_layout(options.get('layout'))
+        if 'variants' in options:
+            pipeline.plan_variants(options['variants'], profile, layout)
+    except (encoder_profiles.UnknownProfileError, UnknownLayoutError, LayoutError, pipeline.VariantError) as e:
+        return str(e)
     return None
 
-def resolve_final_url(url, max_redirects=10, timeout_seconds=10):
-    if not url or not (url.startswith('http://') or url.startswith('https://')):
-        print(f"Invalid URL for resolution: {url}", flush=True)
-        return url
-    session = requests.Session()
-    session.max_redirects = max_redirects
-    try:
-        response = session.get(url, allow_redirects=True, timeout=timeout_seconds)
-        return response.url
-    except requests.exceptions.Timeout:
-        print(f"Timeout ({timeout_seconds}s) resolving URL {url}", flush=True)
-        return url
-    except requests.RequestException as e:
-        print(f"Failed to resolve URL {url}: {e}", flush=True)
-        return url
-
-def get_final_destination(clickthrough_url):
-    if not clickthrough_url:
-        return clickthrough_url
-    print(f"Original ClickThrough: {clickthrough_url}", flush=True)
-    intermediate_url = extract_click_url(clickthrough_url)
-    
-    if intermediate_url:
-        print(f"Extracted intermediate URL: {intermediate_url}", flush=True)
-        final_url = resolve_final_url(intermediate_url)
-        if final_url and final_url != intermediate_url:
-            print(f"Resolved final URL: {final_url}", flush=True)
-            return final_url
-        else:
-            print(f"Failed to resolve intermediate URL or no change, returning intermediate: {intermediate_url}", flush=True)
-            return intermediate_url
-    else:
-        print(f"No intermediate URL extracted, trying to resolve original: {clickthrough_url}", flush=True)
-        final_url = resolve_final_url(clickthrough_url)
-        if final_url and final_url != clickthrough_url:
-            print(f"Resolved original to final URL: {final_url}", flush=True)
-            return final_url
-        else:
-            print(f"Failed to resolve or no change from original, returning original: {clickthrough_url}", flush=True)
-            return clickthrough_url
+def enqueue_conversion(payload):
+    job_id = job_queue.enqueue(payload)
+    render_pool.notify()
+    return job_id
+
+def job_urls(job_id):
+    return {
+        'status_url': url_for('job_status', job_id=job_id),
+        'result_url': url_for('job_result', job_id=job_id),
+    }
+
+def result_context(result):
+    # Stored results hold file names only; URLs are built here because workers run outside a request
+    context = dict(result)
+    qr_filename = context.pop('qr_filename', None)
+    output_filename = context.get('output_filename')
+    if qr_filename:
+        context['qr_code_url'] = url_for('generated_file', filename=qr_filename)
+    if output_filename and not context.get('error'):
+        context['video_url'] = url_for('generated_file', filename=output_filename)
+        context['download_url'] = url_for('generated_file', filename=output_filename)
+    if context.get('variants'):
+        context['variants'] = [result_context(variant) for variant in context['variants']]
+    return context
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    print("########## FUNCTION START - CLEAN LOCAL APP.PY ##########", flush=True)
     if request.method == 'POST':
-        print("########## POST REQUEST RECEIVED (CLEAN LOCAL) ##########", flush=True)
-        vast_content = ""
-        vast_input = request.form.get('vast_input', '').strip()
-        vast_file = request.files.get('vast_file')
-
-        if vast_file and vast_file.filename != '' and allowed_file(vast_file.filename):
-            filename = secure_filename(vast_file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            vast_file.save(filepath)
-            with open(filepath, 'r', encoding='utf-8') as f:
-                vast_content = f.read()
-        elif vast_input:
-            if vast_input.startswith(('http://', 'https://')):
-                try:
-                    response = requests.get(vast_input, timeout=10)
-                    response.raise_for_status()
-                    vast_content = response.text
-                except requests.RequestException as e:
-                    return render_template('index.html', error=f"Error fetching VAST URL: {e}")
-            else:
-                vast_content = vast_input 
-
-        if not vast_content:
-            return render_template('index.html', error="No VAST content provided or file type not allowed.")
-
-        try:
-            root = ET.fromstring(vast_content)
-            ad_title_element = root.find('.//AdTitle')
-            ad_title = ad_title_element.text.strip() if ad_title_element is not None and ad_title_element.text else "Untitled Ad"
-            brand_name = extract_brand_name(ad_title)
-
-            media_file_url = None
-            for mf_element in root.findall('.//MediaFile'):
-                if mf_element.get('type') == 'video/mp4' and mf_element.text:
-                    media_file_url = mf_element.text.strip()
-                    break
-            if not media_file_url:
-                return render_template('index.html', error="Could not find a suitable MP4 MediaFile in VAST.", vast_content_snippet=vast_content[:1000])
-
-            clickthrough_url_element = root.find('.//ClickThrough')
-            raw_clickthrough_url = clickthrough_url_element.text.strip() if clickthrough_url_element is not None and clickthrough_url_element.text else None
-
-            if not raw_clickthrough_url:
-                click_tracking_elements = root.findall('.//ClickTracking')
-                if click_tracking_elements:
-                    raw_clickthrough_url = click_tracking_elements[0].text.strip() if click_tracking_elements[0].text else None
-                    print(f"Found ClickTracking as fallback: {raw_clickthrough_url}", flush=True)
-
-            if not raw_clickthrough_url:
-                 return render_template('index.html', error="Could not find ClickThrough or ClickTracking URL in VAST.", ad_title=ad_title, brand_name=brand_name, media_file_url=media_file_url, vast_content_snippet=vast_content[:1000])
-
-            final_resolved_url = get_final_destination(raw_clickthrough_url)
-
-            qr_filename = "qrcode.png"
-            qr_filepath = os.path.join(app.config['GENERATED_FOLDER'], qr_filename)
-            qr_img = qrcode.make(raw_clickthrough_url)
-            qr_img.save(qr_filepath)
-            
-            output_filename = f"output_{secure_filename(brand_name)}_{os.urandom(4).hex()}.mp4"
-            output_filepath = os.path.join(app.config['GENERATED_FOLDER'], output_filename)
-            ffmpeg_log_filepath = os.path.join(app.config['GENERATED_FOLDER'], f"{output_filename}.log")
-            
-            background_image_path = os.path.join(APP_DIR, 'static/images/background-kerv.jpg')
-            font_path = "Arial" # Using Arial, common on macOS
-
-            def escape_ffmpeg_text(text):
-                return text.replace("'", "\\\\\\'").replace(":", "\\\\:").replace("%", "\\\\%")
-            
-            url_for_display_text = final_resolved_url if final_resolved_url and final_resolved_url != raw_clickthrough_url else raw_clickthrough_url
-            decoded_for_video_display = unquote(url_for_display_text)
-            text_to_draw_for_url = decoded_for_video_display.replace('https://','').replace('http://','')
-            if len(text_to_draw_for_url) > 70:
-                text_to_draw_for_url = text_to_draw_for_url[:67] + "..."
-            simplified_url_for_display = text_to_draw_for_url
-
-            video_framerate = "23.98"
-            cta_text = "SCAN QR CODE FOR MORE."
-
-            filter_complex_str = (
-                "[0:v]scale=1920:1080[base_bg];"
-                "[1:v]scale=530:530[scaled_qr];"
-                "[2:v]scale=1164:654[scaled_ad_video];"
-                "[base_bg][scaled_ad_video]overlay=x=80:y=163[video_on_bg];"
-                "[video_on_bg][scaled_qr]overlay=x=1317:y=163:shortest=1[with_qr];"
-                f"[with_qr]"
-                f"drawtext=fontfile='{font_path}':text='{escape_ffmpeg_text(brand_name)}':fontcolor=white:fontsize=45:x=80:y=857,"
-                f"drawtext=fontfile='{font_path}':text='{escape_ffmpeg_text(simplified_url_for_display)}':fontcolor=white:fontsize=30:x=80:y=917,"
-                f"drawtext=fontfile='{font_path}':text='{escape_ffmpeg_text(cta_text)}':fontcolor=white:fontsize=38:x=1332:y=723[final_output]"
-            )
-
-            filter_script_file = tempfile.NamedTemporaryFile(delete=False, mode='w', suffix='.txt', dir=app.config['GENERATED_FOLDER'])
-            filter_script_file.write(filter_complex_str)
-            filter_script_filepath = filter_script_file.name
-            filter_script_file.close()
-            print(f"Filter script path: {filter_script_filepath}", flush=True)
-            print(f"Filter script content:\\n{filter_complex_str}", flush=True)
-
-            ffmpeg_path = get_ffmpeg_path()
-            if not ffmpeg_path:
-                os.remove(filter_script_filepath)
-                return render_template('index.html', error="FFmpeg not found or not validated. Please ensure it is installed and accessible via /opt/homebrew/bin/ffmpeg or your system PATH.",
-                                       ad_title=ad_title, brand_name=brand_name, media_file_url=media_file_url, raw_clickthrough_url=raw_clickthrough_url,
-                                       final_resolved_url=final_resolved_url, qr_code_url=url_for('generated_file', filename=qr_filename), vast_content_snippet=vast_content[:1000])
-
-            ffmpeg_command = [
-                ffmpeg_path, '-y',
-                '-loglevel', 'debug',
-                '-loop', '1', '-r', video_framerate, '-i', background_image_path,
-                '-loop', '1', '-r', video_framerate, '-i', qr_filepath,
-                '-i', media_file_url,
-                '-filter_complex_script', filter_script_filepath,
-                '-map', '[final_output]',
-                '-map', '2:a?',
-                '-c:v', 'libx264', '-preset', 'fast', '-crf', '23',
-                '-c:a', 'aac', '-b:a', '192k',
-                '-pix_fmt', 'yuv420p',
-                '-r', video_framerate, '-shortest', '-movflags', '+faststart',
-                output_filepath
-            ]
-            ffmpeg_command_str = ' '.join(shlex.quote(str(arg)) for arg in ffmpeg_command)
-            print(f"FFMPEG Command: {ffmpeg_command_str}", flush=True)
-            
-            os.makedirs(os.path.dirname(ffmpeg_log_filepath), exist_ok=True)
-            process = None
-            ffmpeg_log_content = ""
-            stdout_ffmpeg = ""
-            stderr_ffmpeg = ""
-
-            try:
-                with open(ffmpeg_log_filepath, 'w') as log_file_handle:
-                    process = subprocess.Popen(
-                        ffmpeg_command,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        errors='replace'
-                    )
-                    stdout_ffmpeg, stderr_ffmpeg = process.communicate(timeout=120)
-                    
-                    log_file_handle.write(f"FFMPEG COMMAND: {ffmpeg_command_str}\\n")
-                    log_file_handle.write(f"FFMPEG process.returncode: {process.returncode}\\n")
-                    log_file_handle.write(f"FFMPEG STDOUT:\\n{stdout_ffmpeg}\\n")
-                    log_file_handle.write(f"FFMPEG STDERR:\\n{stderr_ffmpeg}\\n")
-
-                if os.path.exists(ffmpeg_log_filepath):
-                    with open(ffmpeg_log_filepath, 'r') as log_f_display:
-                        ffmpeg_log_content = log_f_display.read()
-
-                base_context = {
-                    'ad_title': ad_title,
-                    'brand_name': brand_name,
-                    'media_file_url': media_file_url,
-                    'raw_clickthrough_url': raw_clickthrough_url,
-                    'final_resolved_url': final_resolved_url,
-                    'qr_code_url': url_for('generated_file', filename=qr_filename),
-                    'ffmpeg_command_str': ffmpeg_command_str,
-                    'ffmpeg_log_content': ffmpeg_log_content,
-                    'vast_content_snippet': vast_content[:1000] # For debugging in template if needed
-                }
-
-                if process.returncode == 0:
-                    return render_template('index.html', 
-                                           video_url=url_for('generated_file', filename=output_filename), 
-                                           download_url=url_for('generated_file', filename=output_filename),
-                                           output_filename=output_filename,
-                                           **base_context)
-                else:
-                    detailed_error = f"FFmpeg processing failed. RC: {process.returncode}."
-                    # STDOUT and STDERR are already in ffmpeg_log_content from the file read
-                    return render_template('index.html', error=detailed_error, ffmpeg_stderr=stderr_ffmpeg, **base_context)
-            except subprocess.TimeoutExpired:
-                if process: 
-                    process.kill()
-                    # Try to get any final output
-                    stdout_timeout, stderr_timeout = process.communicate() 
-                    stdout_ffmpeg += "\nTIMEOUT OCCURRED - Partial STDOUT from timeout:\n" + stdout_timeout
-                    stderr_ffmpeg += "\nTIMEOUT OCCURRED - Partial STDERR from timeout:\n" + stderr_timeout
-                    # Update log file with timeout info if possible
-                    if os.path.exists(ffmpeg_log_filepath):
-                        with open(ffmpeg_log_filepath, 'a') as log_file_handle: # Append timeout info
-                            log_file_handle.write("\n\n--- TIMEOUT OCCURRED ---\n")
-                            log_file_handle.write(f"Partial STDOUT after kill:\n{stdout_timeout}")
-                            log_file_handle.write(f"Partial STDERR after kill:\n{stderr_timeout}")
-                
-                # Re-read log content after potential append
-                if os.path.exists(ffmpeg_log_filepath):
-                    with open(ffmpeg_log_filepath, 'r') as log_f_timeout_display:
-                        ffmpeg_log_content = log_f_timeout_display.read()
-
-                error_message = "FFmpeg processing timed out after 120 seconds."
-                base_context_timeout = {
-                    'ad_title': ad_title, 'brand_name': brand_name, 'media_file_url': media_file_url,
-                    'raw_clickthrough_url': raw_clickthrough_url, 'final_resolved_url': final_resolved_url,
-                    'qr_code_url': url_for('generated_file', filename=qr_filename), 'ffmpeg_command_str': ffmpeg_command_str,
-                    'ffmpeg_log_content': ffmpeg_log_content, 'vast_content_snippet': vast_content[:1000]
-                }
-                return render_template('index.html', error=error_message, ffmpeg_stderr=stderr_ffmpeg, **base_context_timeout)
-            except Exception as e_ffmpeg:
-                error_message = f"An unexpected error occurred during FFmpeg subprocess: {str(e_ffmpeg)}"
-                # Re-read log content if it exists
-                if os.path.exists(ffmpeg_log_filepath):
-                    with open(ffmpeg_log_filepath, 'r') as log_f_ex_display:
-                        ffmpeg_log_content = log_f_ex_display.read()
-                else:
-                    ffmpeg_log_content = "FFmpeg log file not found or not created before exception."
-                
-                base_context_exception = {
-                    'ad_title': ad_title, 'brand_name': brand_name, 'media_file_url': media_file_url,
-                    'raw_clickthrough_url': raw_clickthrough_url, 'final_resolved_url': final_resolved_url,
-                    'qr_code_url': url_for('generated_file', filename=qr_filename), 
-                    'ffmpeg_command_str': ffmpeg_command_str if 'ffmpeg_command_str' in locals() else "FFmpeg command not prepared.",
-                    'ffmpeg_log_content': ffmpeg_log_content, 'vast_content_snippet': vast_content[:1000]
-                }
-                return render_template('index.html', error=error_message, ffmpeg_stderr=str(e_ffmpeg), **base_context_exception)
-            finally:
-                if os.path.exists(filter_script_filepath):
-                    try:
-                        os.remove(filter_script_filepath)
-                    except OSError as e_remove:
-                        print(f"Error removing temp filter script {filter_script_filepath}: {e_remove}", flush=True)
-
-        except ET.ParseError as e_xml:
-            return render_template('index.html', error=f"Invalid XML content in VAST tag: {e_xml}", vast_content_snippet=vast_content[:1000])
-        except Exception as e_main:
-            import traceback
-            tb_str = traceback.format_exc()
-            print(tb_str, flush=True)
-            # Try to pass any VAST related data if it was extracted before the error
-            context_on_general_error = {
-                'error': f"An unexpected error occurred: {e_main} traceback: {tb_str[:1000]}",
-                'ad_title': ad_title if 'ad_title' in locals() else None,
-                'brand_name': brand_name if 'brand_name' in locals() else None,
-                'media_file_url': media_file_url if 'media_file_url' in locals() else None,
-                'raw_clickthrough_url': raw_clickthrough_url if 'raw_clickthrough_url' in locals() else None,
-                'final_resolved_url': final_resolved_url if 'final_resolved_url' in locals() else None,
-                'qr_code_url': url_for('generated_file', filename=qr_filename) if 'qr_code_url' in locals() else None,
-                'vast_content_snippet': vast_content[:1000] if 'vast_content' in locals() else "VAST content not available."
-            }
-            return render_template('index.html', **context_on_general_error)
+        payload, error = conversion_payload_from_request()
+        if error:
+            return render_template('index.html', error=error), 400
+        job_id = enqueue_conversion(payload)
+        return render_template('index.html', job_id=job_id, **job_urls(job_id))
 
     return render_template('index.html')
 
-@app.route('/generated/<filename>')
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    payload, error = conversion_payload_from_request()
+    if error:
+        return jsonify(error=error), 400
+    job_id = enqueue_conversion(payload)
+    urls = job_urls(job_id)
+    return jsonify(job_id=job_id, status='queued', **urls), 202, {'Location': urls['status_url']}
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error="Job not found."), 404
+    return jsonify(dict(jobs.job_status(job), **job_urls(job_id)))
+
+@app.route('/jobs/<job_id>/timings')
+def job_timings(job_id):
+    # Per-stage wall-clock seconds for a finished job, plus the encoder's final fps/speed
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error="Job not found."), 404
+    result = job['result'] or {}
+    return jsonify(id=job_id, status=job['status'], timings=result.get('timings'), encode_stats=result.get('encode_stats'))
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        if wants_json():
+            return jsonify(error="Job not found."), 404
+        return render_template('index.html', error="Conversion job not found."), 404
+
+    if job['status'] not in (jobs.STATUS_DONE, jobs.STATUS_FAILED):
+        if wants_json():
+            return jsonify(dict(jobs.job_status(job), **job_urls(job_id))), 202
+        return render_template('index.html', job_id=job_id, **job_urls(job_id)), 202
+
+    context = result_context(job['result'] or {'error': job['error']})
+    if wants_json():
+        context.pop('ffmpeg_log_content', None)
+        return jsonify(dict(jobs.job_status(job), result=context))
+    context['ffmpeg_log_content'] = stored_log(context)
+    return render_template('index.html', **context)
+
+@app.route('/batch', methods=['POST'])
+def batch_convert():
+    # Streams one JSON line per ad as renders finish, then the summary manifest
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify(error="The JSON body must be an object."), 400
+    if not isinstance(body.get('sources') or [], list) or not all(isinstance(source, str) for source in body.get('sources') or []):
+        return jsonify(error="'sources' must be a list of strings."), 400
+    for field in ('profile', 'layout'):
+        if body.get(field) is not None and not isinstance(body[field], str):
+            return jsonify(error=f"'{field}' must be a string."), 400
+    sources = list(body.get('sources') or [])
+    sources += [line for line in request.form.get('vast_inputs', '').splitlines() if line.strip()]
+    for vast_file in request.files.getlist('vast_files'):
+        if vast_file and vast_file.filename != '' and allowed_file(vast_file.filename):
+            sources.append(vast_file.read().decode('utf-8'))
+    if not sources:
+        return jsonify(error="No VAST sources provided."), 400
+    profile_name = body.get('profile') or request.form.get('profile')
+    try:
+        encoder_profiles.get_profile(profile_name or app.config['ENCODER_PROFILE'])
+    except encoder_profiles.UnknownProfileError as e:
+        return jsonify(error=str(e)), 400
+    layout_name = body.get('layout') or request.form.get('layout')
+    try:
+        pipeline.load_layout(layout_name)
+    except (UnknownLayoutError, LayoutError) as e:
+        return jsonify(error=str(e)), 400
+
+    def generate():
+        for event in run_batch_conversion(sources, profile_name=profile_name, layout_name=layout_name):
+            if event.get('output_filename') and event['status'] == 'done':
+                event['video_url'] = url_for('generated_file', filename=event['output_filename'])
+            if event.get('manifest_filename'):
+                event['manifest_url'] = url_for('generated_file', filename=event['manifest_filename'])
+            yield json.dumps(event) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.cli.command('batch')
+@click.argument('sources', nargs=-1)
+@click.option('--list', 'list_file', type=click.File('r'), help='File with one VAST URL or path per line ("-" for stdin).')
+@click.option('--workers', type=int, default=None, help='Render processes to run in parallel.')
+@click.option('--profile', type=click.Choice(sorted(encoder_profiles.PROFILES)), default=None, help='Encoder profile (default: ENCODER_PROFILE).')
+@click.option('--layout', default=None, help='Layout template name (default: LAYOUT).')
+def batch_command(sources, list_file, workers, profile, layout):
+    """Convert many VAST tags (URLs, files or ad pods) and print one JSON line per ad."""
+    sources = list(sources)
+    if list_file:
+        sources += [line.strip() for line in list_file if line.strip() and not line.startswith('#')]
+    if not sources:
+        raise click.UsageError("No VAST sources given.")
+    try:
+        pipeline.load_layout(layout)
+    except (UnknownLayoutError, LayoutError) as e:
+        raise click.UsageError(str(e))
+    # Pipeline logging goes to stderr so stdout stays machine-readable JSON lines
+    real_stdout = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        for event in run_batch_conversion(sources, workers, profile, layout):
+            click.echo(json.dumps(event), file=real_stdout)
+
+@app.route('/capabilities')
+def capabilities():
+    return jsonify(dict(ffmpeg_tools.describe(), ffmpeg_threads=app.config['FFMPEG_THREADS'],
+                        render_workers=app.config['RENDER_WORKERS']))
+
+@app.route('/profiles')
+def list_profiles():
+    return jsonify(default=app.config['ENCODER_PROFILE'], profiles=encoder_profiles.PROFILES)
+
+@app.route('/layouts')
+def list_layouts():
+    return jsonify(default=app.config['LAYOUT'], layouts=available_layouts(app.config['LAYOUTS_DIR']))
+
+@app.route('/metrics')
+def metrics():
+    cache_stats = render_outputs.stats()
+    job_counts = job_queue.counts()
+    body = pipeline.stage_metrics.render()
+    body += instrumentation.prometheus_metric('vast2ctv_jobs', 'gauge', 'Conversion jobs by status.', [
+        ({'status': status}, job_counts.get(status, 0))
+        for status in (jobs.STATUS_QUEUED, jobs.STATUS_RUNNING, jobs.STATUS_DONE, jobs.STATUS_FAILED)
+    ])
+    for name in ('hits', 'misses', 'evictions'):
+        body += instrumentation.prometheus_metric(f'vast2ctv_render_cache_{name}_total', 'counter',
+                                                  f'Render cache {name}.', [({}, cache_stats[name])])
+    body += instrumentation.prometheus_metric('vast2ctv_render_cache_bytes', 'gauge', 'Bytes of cached renders on disk.',
+                                              [({}, cache_stats['bytes'])])
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/render-cache/stats')
+def render_cache_stats():
+    return jsonify(render_outputs.stats())
+
+@app.route('/storage/stats')
+def storage_stats():
+    # The quotas only cover workspaces; the shared caches and SQLite files beside them have their own bounds
+    databases = {key[:-len('_DB_PATH')].lower(): sqlite_store.disk_usage(path)
+                 for key, path in app.config.items() if key.endswith('_DB_PATH')}
+    return jsonify(generated=artifacts.stats(), uploads=uploads.stats(), media=media_files.stats(), qr_codes=qr_images.stats(),
+                   plates=plate_images.stats(), database_bytes=databases)
+
+@app.route('/generated/<path:filename>')
 def generated_file(filename):
-    safe_generated_folder = os.path.abspath(app.config['GENERATED_FOLDER'])
-    file_path = os.path.abspath(os.path.join(safe_generated_folder, filename))
-    if not file_path.startswith(safe_generated_folder):
-        print(f"[SECURITY] Attempt to access file outside generated folder: {file_path} (based on {filename})", flush=True)
-        return "Invalid path", 400
-    print(f"Serving generated file from: {app.config['GENERATED_FOLDER']} for filename: {filename}", flush=True)
-    return send_from_directory(app.config['GENERATED_FOLDER'], filename)
+    response = output_delivery.serve(filename)
+    if response is None:
+        print(f"[DELIVERY] Refusing or missing generated file: {filename}", flush=True)
+        return "File not found", 404
+    return response
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5001))
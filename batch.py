@@ -0,0 +1,197 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import requests
+
+# Keys of a render result that are too large to stream back per ad
+_HEAVY_RESULT_KEYS = ('ffmpeg_log_content', 'ffmpeg_stderr', 'vast_content_snippet')
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def load_source(source, timeout_seconds=10):
+    # A batch source is a VAST URL, a path to a VAST file, or raw VAST XML
+    source = source.strip()
+    if source.startswith(('http://', 'https://')):
+        response = requests.get(source, timeout=timeout_seconds)
+        response.raise_for_status()
+        return response.text
+    if source.startswith('<'):
+        return source
+    with open(source, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def split_vast_ads(vast_content):
+    # Splits a multi-<Ad> document (an ad pod) into standalone single-ad VAST documents.
+    # Returns [(ad_id, sequence, vast_content)]; single-ad documents come back unchanged.
+    root = ET.fromstring(vast_content)
+    # '{*}' matches <Ad> with or without a namespace, so VAST 4 (xmlns="http://www.iab.com/VAST") pods split too
+    ads = root.findall('{*}Ad')
+    if len(ads) <= 1:
+        ad = ads[0] if ads else None
+        return [(ad.get('id') if ad is not None else None, ad.get('sequence') if ad is not None else None, vast_content)]
+    documents = []
+    for ad in ads:
+        single = ET.Element(root.tag, dict(root.attrib))
+        single.append(ad)
+        documents.append((ad.get('id'), ad.get('sequence'), ET.tostring(single, encoding='unicode')))
+    return documents
+
+
+def _init_render_process(stdout_to_stderr):
+    # Pool processes start with fresh standard streams; CLI callers reserve stdout for JSON lines and
+    # send log output to stderr, so the render processes do the same
+    if stdout_to_stderr:
+        sys.stdout = sys.stderr
+
+
+def _slim(result):
+    return {key: value for key, value in result.items() if key not in _HEAVY_RESULT_KEYS}
+
+
+def run_batch(sources, parse_fn, resolve_many_fn, qr_fn, render_fn, workers=None, manifest_dir=None, load_fn=load_source,
+              preflight_fn=None):
+    """Converts every ad found in `sources`, yielding one event dict per ad and a final manifest event.
+
+    Work is shared between duplicates: each distinct source is fetched once, each distinct document is
+    parsed once, each distinct creative is preflighted once (`preflight_fn(media_file_url)` returns the
+    rejection context or None), each distinct click URL is resolved and turned into a QR code once, and ads
+    with the same creative, click URL and brand are rendered once. Renders fan out across a process pool.
+    """
+    batch_id = uuid.uuid4().hex[:12]
+    started_at = time.time()
+    items = []
+    results = {}
+
+    def emit(item, status, **fields):
+        event = dict({'type': 'result', 'batch_id': batch_id, 'index': item['index'], 'source': item['source'],
+                      'ad_id': item['ad_id'], 'sequence': item['sequence'], 'status': status}, **fields)
+        results[item['index']] = event
+        return event
+
+    # Fetch each distinct source once, in parallel; URL fetches are network bound
+    unique_sources = list(dict.fromkeys(source.strip() for source in sources if source and source.strip()))
+    contents = {}
+    with ThreadPoolExecutor(max_workers=min(16, max(1, len(unique_sources)))) as pool:
+        futures = {pool.submit(load_fn, source): source for source in unique_sources}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                contents[source] = (future.result(), None)
+            except Exception as e:
+                contents[source] = (None, f"Error loading VAST source: {e}")
+
+    pending_errors = []
+    for source in unique_sources:
+        vast_content, error = contents[source]
+        label = source if len(source) < 200 else f"{source[:197]}..."
+        if error is None:
+            try:
+                documents = split_vast_ads(vast_content)
+            except ET.ParseError as e_xml:
+                error = f"Invalid XML content in VAST tag: {e_xml}"
+        if error is not None:
+            item = {'index': len(items), 'source': label, 'ad_id': None, 'sequence': None}
+            items.append(item)
+            pending_errors.append((item, error))
+            continue
+        for ad_id, sequence, document in documents:
+            items.append({'index': len(items), 'source': label, 'ad_id': ad_id, 'sequence': sequence, 'document': document})
+
+    for item, error in pending_errors:
+        yield emit(item, 'failed', error=error)
+
+    # Parse each distinct document once; identical ads in different pods share the result
+    ads_by_document = {}
+    for item in items:
+        document = item.pop('document', None)
+        if document is None:
+            continue
+        document_key = _digest(document)
+        if document_key not in ads_by_document:
+            try:
+                ads_by_document[document_key] = parse_fn(document)
+            except ET.ParseError as e_xml:
+                ads_by_document[document_key] = {'error': f"Invalid XML content in VAST tag: {e_xml}"}
+        ad = ads_by_document[document_key]
+        if ad.get('error'):
+            yield emit(item, 'failed', **_slim(ad))
+        else:
+            item['ad'] = ad
+
+    # Ads with the same creative, click URL and brand produce the same video, so render them once
+    groups = {}
+    for item in items:
+        ad = item.get('ad')
+        if ad is not None:
+            identity = (ad['media_file_url'], ad['raw_clickthrough_url'], ad['brand_name'])
+            groups.setdefault(identity, []).append(item)
+
+    if preflight_fn and groups:
+        # Rejected creatives fail here, before any click URL is resolved or QR code drawn for them
+        media_urls = list(dict.fromkeys(identity[0] for identity in groups))
+        with ThreadPoolExecutor(max_workers=min(16, len(media_urls))) as pool:
+            rejections = dict(zip(media_urls, pool.map(preflight_fn, media_urls)))
+        for identity in [identity for identity in groups if rejections[identity[0]]]:
+            for item in groups.pop(identity):
+                yield emit(item, 'failed', **_slim(dict(item['ad'], **rejections[identity[0]])))
+
+    click_urls = list(dict.fromkeys(identity[1] for identity in groups))
+    resolved_urls = resolve_many_fn(click_urls) if click_urls else {}
+    qr_filenames = {url: qr_fn(url, f"qrcode_{_digest(url)[:16]}.png") for url in click_urls}
+
+    if groups:
+        # Not fork: the web app calls this from a threaded process (render workers, heartbeat, GC), and a child
+        # forked while another thread holds a sqlite, logging or cache lock can deadlock on it
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('forkserver'),
+                                 initializer=_init_render_process, initargs=(sys.stdout is sys.stderr,)) as pool:
+            futures = {}
+            for identity, group in groups.items():
+                click_url = identity[1]
+                future = pool.submit(render_fn, group[0]['ad'], None, resolved_urls[click_url], qr_filenames[click_url])
+                futures[future] = group
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'error': f"Render process failed: {e}"}
+                status = 'failed' if result.get('error') else 'done'
+                first = group[0]
+                yield emit(first, status, **_slim(result))
+                for duplicate in group[1:]:
+                    yield emit(duplicate, status, duplicate_of=first['index'], **_slim(result))
+
+    ordered = [results[index] for index in sorted(results)]
+    manifest = {
+        'type': 'manifest',
+        'batch_id': batch_id,
+        'created_at': started_at,
+        'summary': {
+            'ads': len(ordered),
+            'done': sum(1 for event in ordered if event['status'] == 'done'),
+            'failed': sum(1 for event in ordered if event['status'] == 'failed'),
+            'sources': len(unique_sources),
+            'unique_documents': len(ads_by_document),
+            'unique_click_urls': len(click_urls),
+            'renders': len(groups),
+            'elapsed_seconds': round(time.time() - started_at, 3),
+        },
+        'results': ordered,
+    }
+    if manifest_dir:
+        manifest['manifest_filename'] = f"batch_{batch_id}.json"
+        with open(os.path.join(manifest_dir, manifest['manifest_filename']), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    print(f"[BATCH] {batch_id}: {manifest['summary']}", flush=True)
+    yield manifest
@@ -0,0 +1,139 @@
+"""Compares encode throughput of the legacy per-frame filter graph with the pre-rendered plate graph.
+
+    python benchmarks/bench_compositing.py --duration 15
+    python benchmarks/bench_compositing.py --video-codec rawvideo   # compositing cost only, no x264
+
+The legacy graph loops and scales the background and QR images and runs three drawtext filters on every
+frame. The plate graph overlays a single pre-rendered RGBA image on the padded ad video.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import qrcode  # noqa: E402
+
+import compositor  # noqa: E402
+import layout  # noqa: E402
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKGROUND = os.path.join(APP_DIR, 'static/images/background-kerv.jpg')
+FRAMERATE = '23.98'
+BRAND = 'Acme'
+URL_TEXT = 'www.example.com/spring-sale?utm_source=ctv'
+CTA = 'SCAN QR CODE FOR MORE.'
+
+
+def make_source(ffmpeg, path, duration, size):
+    subprocess.run([
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate=30",
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(duration), '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', path
+    ], check=True)
+
+
+def legacy_graph(drawtext):
+    graph = (
+        "[0:v]scale=1920:1080[base_bg];"
+        "[1:v]scale=530:530[scaled_qr];"
+        "[2:v]scale=1164:654[scaled_ad_video];"
+        "[base_bg][scaled_ad_video]overlay=x=80:y=163[video_on_bg];"
+        "[video_on_bg][scaled_qr]overlay=x=1317:y=163:shortest=1"
+    )
+    if not drawtext:
+        return graph + "[final_output]"
+    return graph + (
+        "[with_qr];[with_qr]"
+        f"drawtext=fontfile='Arial':text='{BRAND}':fontcolor=white:fontsize=45:x=80:y=857,"
+        f"drawtext=fontfile='Arial':text='{URL_TEXT}':fontcolor=white:fontsize=30:x=80:y=917,"
+        f"drawtext=fontfile='Arial':text='{CTA}':fontcolor=white:fontsize=38:x=1332:y=723[final_output]"
+    )
+
+
+def encoder_args(video_codec):
+    if video_codec == 'rawvideo':
+        return ['-c:v', 'rawvideo', '-pix_fmt', 'yuv420p', '-an']
+    return ['-c:v', 'libx264', '-preset', 'fast', '-crf', '23', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '192k']
+
+
+def run_encode(ffmpeg, inputs, graph, audio_map, video_codec, duration):
+    command = [ffmpeg, '-y', *inputs, '-filter_complex', graph, '-map', '[final_output]']
+    if video_codec != 'rawvideo':
+        command += ['-map', audio_map]
+    # The legacy graph only ends through -shortest on the audio stream, so cap video-only runs explicitly
+    command += [*encoder_args(video_codec), '-r', FRAMERATE, '-shortest', '-t', str(duration), '-f', 'null', '-']
+    started = time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True, errors='replace')
+    elapsed = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({process.returncode}):\n{process.stderr[-2000:]}")
+    frames = re.findall(r"frame=\s*(\d+)", process.stderr)
+    frame_count = int(frames[-1]) if frames else 0
+    return {'seconds': round(elapsed, 3), 'frames': frame_count, 'fps': round(frame_count / elapsed, 2) if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg') or 'ffmpeg')
+    parser.add_argument('--duration', type=float, default=10.0, help='Length of the synthetic ad in seconds.')
+    parser.add_argument('--source-size', default='1280x720')
+    parser.add_argument('--video-codec', choices=['libx264', 'rawvideo'], default='libx264')
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--no-drawtext', action='store_true', help='Drop drawtext from the legacy graph (for ffmpeg builds without libfreetype).')
+    parser.add_argument('--output', help='Write the JSON results to this file as well as stdout.')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_compositing_')
+    try:
+        source = os.path.join(work_dir, 'ad.mp4')
+        make_source(args.ffmpeg, source, args.duration, args.source_size)
+        qr_path = os.path.join(work_dir, 'qrcode.png')
+        qrcode.make(f"https://{URL_TEXT}").save(qr_path)
+
+        started = time.perf_counter()
+        lbar = layout.get_layout('lbar')
+        plate = compositor.render_plate(lbar, qr_path, {'brand': BRAND, 'url': URL_TEXT, 'cta': CTA}, work_dir)
+        plate_seconds = time.perf_counter() - started
+
+        legacy_inputs = ['-loop', '1', '-r', FRAMERATE, '-i', BACKGROUND, '-loop', '1', '-r', FRAMERATE, '-i', qr_path, '-i', source]
+        plate_inputs = ['-i', source, '-i', plate]
+
+        results = {'legacy': [], 'plate': []}
+        for _ in range(args.runs):
+            results['legacy'].append(run_encode(args.ffmpeg, legacy_inputs, legacy_graph(not args.no_drawtext), '2:a?', args.video_codec, args.duration))
+            results['plate'].append(run_encode(args.ffmpeg, plate_inputs, layout.compile_filter_graph(lbar, lbar.frame_size), '0:a?', args.video_codec, args.duration))
+
+        best_legacy = max(run['fps'] for run in results['legacy'])
+        best_plate = max(run['fps'] for run in results['plate'])
+        report = {
+            'benchmark': 'compositing',
+            'duration': args.duration,
+            'source_size': args.source_size,
+            'video_codec': args.video_codec,
+            'legacy_drawtext': not args.no_drawtext,
+            'cpu_count': os.cpu_count(),
+            'plate_render_seconds': round(plate_seconds, 3),
+            'runs': results,
+            'legacy_fps': best_legacy,
+            'plate_fps': best_plate,
+            'speedup': round(best_plate / best_legacy, 2) if best_legacy else None,
+        }
+        text = json.dumps(report, indent=2)
+        print(text)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
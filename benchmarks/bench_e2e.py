@@ -0,0 +1,501 @@
+"""End-to-end benchmark of the web app against synthetic VAST tags and media served from a local stub server.
+
+    python benchmarks/bench_e2e.py --output baseline.json
+    python benchmarks/bench_e2e.py --compare baseline.json          # exits 1 on a regression
+    python benchmarks/bench_e2e.py --duration 2 --pod-ads 200 --requests 500 --concurrency 16
+
+Fixtures are generated into a temporary directory on every run: short test videos made with ffmpeg's
+testsrc2 (each creative in a 1280x720 and a 1920x1080 rendition), an inline tag, a chain of --wrapper-depth
+namespaced VAST 4 wrappers, a pod of --pod-ads ads over --creatives creatives, and the same pod as a
+namespaced VAST 4 document. A stub HTTP server serves them, together with a /click redirect endpoint for
+click-through resolution, so nothing leaves the machine. The app runs on a real threaded server with
+GENERATED_FOLDER pointed at the temp directory, so every run starts with cold caches.
+
+Phases:
+  conversions  each scenario is posted to index() --repeat times and polled to completion. Per-stage
+               timings come from the job result; the first run is cold and later runs hit the render cache.
+  batch        both pods go through pipeline.run_batch_conversion with --batch-workers processes; every ad
+               of each pod must come back as its own result.
+  throughput   --requests requests at --concurrency against index() (GET, and POST which enqueues a job)
+               and generated_file() (full download, conditional 304 and a 64 KiB Range).
+
+The report also has peak RSS for this process and for the largest child (ffmpeg). --compare checks the
+headline metrics against an earlier report and flags changes beyond --threshold.
+"""
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+import requests  # noqa: E402
+
+RENDITIONS = ((1280, 720, 2500), (1920, 1080, 5000))
+VAST4_ROOT = '<VAST xmlns="http://www.iab.com/VAST" version="4.1">'
+STAGES = ('fetch_vast', 'parse_vast', 'preflight', 'download_media', 'resolve_click_url', 'generate_qr',
+          'render_plate', 'encode', 'total')
+
+
+# Fixtures
+
+def make_video(ffmpeg, path, duration, size, frequency):
+    # The tone differs per creative so every creative hashes differently in the media cache
+    subprocess.run([
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={size[0]}x{size[1]}:rate=30",
+        '-f', 'lavfi', '-i', f"sine=frequency={frequency}:sample_rate=48000",
+        '-t', str(duration), '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '30', '-c:a', 'aac', '-shortest', path
+    ], check=True)
+
+
+def inline_ad(base_url, ad_id, creative, sequence=None):
+    sequence_attribute = f' sequence="{sequence}"' if sequence is not None else ''
+    media_files = ''.join(
+        f'<MediaFile delivery="progressive" type="video/mp4" width="{width}" height="{height}" bitrate="{bitrate}">'
+        f'<![CDATA[{base_url}/creative_{creative}_{height}p.mp4]]></MediaFile>'
+        for width, height, bitrate in RENDITIONS
+    )
+    events = ''.join(f'<Tracking event="{event}"><![CDATA[{base_url}/track?e={event}]]></Tracking>'
+                     for event in ('start', 'firstQuartile', 'midpoint', 'thirdQuartile', 'complete'))
+    click = f"{base_url}/click?to={quote(f'/landing/{creative}', safe='')}"
+    return (
+        f'<Ad id="{ad_id}"{sequence_attribute}><InLine><AdSystem>Bench</AdSystem>'
+        f'<AdTitle>Campaign_Brand{creative}_Bench</AdTitle>'
+        f'<Impression><![CDATA[{base_url}/impression?ad={ad_id}]]></Impression>'
+        f'<Creatives><Creative><Linear><Duration>00:00:05</Duration><TrackingEvents>{events}</TrackingEvents>'
+        f'<VideoClicks><ClickThrough><![CDATA[{click}]]></ClickThrough></VideoClicks>'
+        f'<MediaFiles>{media_files}</MediaFiles></Linear></Creative></Creatives></InLine></Ad>'
+    )
+
+
+def wrapper_ad(base_url, ad_id, target):
+    return (
+        f'<Ad id="{ad_id}"><Wrapper><AdSystem>Bench</AdSystem>'
+        f'<VASTAdTagURI><![CDATA[{base_url}/{target}]]></VASTAdTagURI>'
+        f'<Impression><![CDATA[{base_url}/impression?wrapper={ad_id}]]></Impression>'
+        f'<Creatives><Creative><Linear><TrackingEvents>'
+        f'<Tracking event="start"><![CDATA[{base_url}/track?wrapper={ad_id}]]></Tracking>'
+        f'</TrackingEvents></Linear></Creative></Creatives></Wrapper></Ad>'
+    )
+
+
+def write_fixtures(ffmpeg, directory, base_url, args):
+    started = time.perf_counter()
+    for creative in range(args.creatives):
+        for width, height, _ in RENDITIONS:
+            make_video(ffmpeg, os.path.join(directory, f"creative_{creative}_{height}p.mp4"), args.duration,
+                       (width, height), 440 + 110 * creative)
+
+    def write(name, ads, root='<VAST version="3.0">'):
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write(f'{root}{ads}</VAST>')
+
+    write('inline.xml', inline_ad(base_url, 'inline', 0))
+    # The chain ends in a different creative so it isn't served from the inline scenario's render
+    write('wrapped_inline.xml', inline_ad(base_url, 'wrapped', 1 % args.creatives))
+    target = 'wrapped_inline.xml'
+    for depth in range(args.wrapper_depth, 0, -1):
+        # Namespaced VAST 4 wrappers around a VAST 3 inline, as ad servers mixing versions send them
+        write(f"wrapper_{depth}.xml", wrapper_ad(base_url, f"wrapper{depth}", target), root=VAST4_ROOT)
+        target = f"wrapper_{depth}.xml"
+    pod = ''.join(inline_ad(base_url, f"pod{index}", index % args.creatives, sequence=index + 1) for index in range(args.pod_ads))
+    write('pod.xml', pod)
+    write('pod_vast4.xml', pod, root=VAST4_ROOT)
+    return {
+        'seconds': round(time.perf_counter() - started, 3),
+        'scenarios': {'inline': 'inline.xml', 'wrapper_chain': target, 'pod': 'pod.xml'},
+        'pod_bytes': os.path.getsize(os.path.join(directory, 'pod.xml')),
+    }
+
+
+class StubHandler(SimpleHTTPRequestHandler):
+    """Static fixtures plus /click (302 to ?to=), /landing/*, /impression and /track (200, empty)."""
+
+    def _route(self, head):
+        path = urlparse(self.path)
+        with self.server.lock:
+            self.server.counts[path.path] = self.server.counts.get(path.path, 0) + 1
+        if path.path == '/click':
+            self.send_response(302)
+            self.send_header('Location', parse_qs(path.query).get('to', ['/landing/'])[0])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif path.path.startswith(('/landing/', '/impression', '/track')):
+            body = b'<html><body>landing</body></html>'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+        elif head:
+            super().do_HEAD()
+        else:
+            super().do_GET()
+
+    def do_GET(self):
+        self._route(head=False)
+
+    def do_HEAD(self):
+        self._route(head=True)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(directory):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(StubHandler, directory=directory))
+    server.daemon_threads = True
+    server.counts = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name='bench-stub', daemon=True).start()
+    return server
+
+
+def start_app_server(app):
+    from werkzeug.serving import make_server
+    # Werkzeug's per-request access log would otherwise dominate stderr during the throughput phase
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return server
+
+
+# Measurements
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'median': round(statistics.median(values), 4),
+        'p95': round(percentile(values, 0.95), 4),
+        'max': round(max(values), 4),
+    }
+
+
+def wait_for_job(session, app_url, job_id, timeout_seconds):
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        status = session.get(f"{app_url}/jobs/{job_id}").json()
+        if status['status'] in ('done', 'failed'):
+            return session.get(f"{app_url}/jobs/{job_id}/result", headers={'Accept': 'application/json'}).json()
+        time.sleep(0.05)
+    raise RuntimeError(f"job {job_id} did not finish within {timeout_seconds}s")
+
+
+def post_index(session, app_url, vast_url):
+    # index() answers with the HTML page; the job id is read back out of it
+    response = session.post(f"{app_url}/", data={'vast_input': vast_url})
+    response.raise_for_status()
+    match = re.search(r"Job ID:</strong>\s*([0-9a-f]+)", response.text)
+    if not match:
+        raise RuntimeError(f"index() returned no job id (HTTP {response.status_code})")
+    return match.group(1)
+
+
+def run_conversions(app_url, stub_url, scenarios, repeat, timeout_seconds):
+    session = requests.Session()
+    report = {}
+    for name, fixture in scenarios.items():
+        runs = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            job = wait_for_job(session, app_url, post_index(session, app_url, f"{stub_url}/{fixture}"), timeout_seconds)
+            result = job.get('result') or {}
+            stats = result.get('encode_stats') or {}
+            runs.append({
+                'status': job['status'],
+                'error': result.get('error'),
+                'wall_seconds': round(time.perf_counter() - started, 3),
+                'render_cache': result.get('render_cache'),
+                'timings': result.get('timings') or {},
+                'encode_frames': stats.get('frame'),
+                'encode_fps': round(stats['frame'] / stats['elapsed'], 2) if stats.get('frame') and stats.get('elapsed') else None,
+                'output_filename': result.get('output_filename'),
+            })
+        report[name] = {
+            'runs': runs,
+            'cold': runs[0],
+            'warm_wall_seconds': summarize([run['wall_seconds'] for run in runs[1:]]),
+            'stages': {stage: summarize([run['timings'][stage] for run in runs if stage in run['timings']])
+                       for stage in STAGES if any(stage in run['timings'] for run in runs)},
+        }
+    return report
+
+
+def run_batch(pipeline, vast_parser, fixtures_dir, pod_name, stub_url, workers):
+    with open(os.path.join(fixtures_dir, pod_name), 'r', encoding='utf-8') as f:
+        pod = f.read()
+    # Best of five: a single parse of a modest pod is well under a millisecond
+    parse_seconds = None
+    for _ in range(5):
+        started = time.perf_counter()
+        ads = len(vast_parser.parse_vast(pod).ads)
+        elapsed = time.perf_counter() - started
+        parse_seconds = elapsed if parse_seconds is None else min(parse_seconds, elapsed)
+    started = time.perf_counter()
+    manifest = None
+    for event in pipeline.run_batch_conversion([f"{stub_url}/{pod_name}"], workers=workers):
+        if event['type'] == 'manifest':
+            manifest = event
+    if manifest['summary']['ads'] != ads:
+        raise RuntimeError(f"{pod_name}: the batch split {ads} ads into {manifest['summary']['ads']} results")
+    return {
+        'ads': ads,
+        'parse_seconds': round(parse_seconds, 4),
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'summary': manifest['summary'],
+    }
+
+
+def load_test(name, request, total, concurrency):
+    local = threading.local()
+    latencies = []
+    statuses = {}
+    errors = []
+    lock = threading.Lock()
+
+    def one(_):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = request(session)
+        except requests.RequestException as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # An untimed warm-up round opens the connections, so their setup isn't measured
+        list(pool.map(one, range(concurrency)))
+        latencies.clear()
+        statuses.clear()
+        errors.clear()
+        started = time.perf_counter()
+        list(pool.map(one, range(total)))
+    seconds = time.perf_counter() - started
+    return {
+        'endpoint': name,
+        'requests': total,
+        'concurrency': concurrency,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(latencies) / seconds, 1) if seconds else None,
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'latency_p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'errors': len(errors),
+    }
+
+
+def run_throughput(app_url, stub_url, output_filename, job_queue, args):
+    video_url = f"{app_url}/generated/{output_filename}"
+    head = requests.head(video_url)
+    etag = head.headers.get('ETag')
+
+    def get_index(session):
+        return session.get(f"{app_url}/").status_code
+
+    def post_index_request(session):
+        return session.post(f"{app_url}/", data={'vast_input': f"{stub_url}/inline.xml"}).status_code
+
+    def get_video(session):
+        with session.get(video_url, stream=True) as response:
+            for _ in response.iter_content(256 * 1024):
+                pass
+            return response.status_code
+
+    def get_video_conditional(session):
+        return session.get(video_url, headers={'If-None-Match': etag}).status_code
+
+    def get_video_range(session):
+        return session.get(video_url, headers={'Range': 'bytes=0-65535'}).status_code
+
+    report = {'video_bytes': int(head.headers.get('Content-Length', 0))}
+    report['index_get'] = load_test('index GET', get_index, args.requests, args.concurrency)
+    report['index_post'] = load_test('index POST', post_index_request, args.post_requests, args.concurrency)
+    # The posted jobs are render cache hits; let them finish so they don't compete with the file requests
+    started = time.perf_counter()
+    while any(job_queue.counts().get(status) for status in ('queued', 'running')):
+        time.sleep(0.1)
+    report['index_post']['jobs_drain_seconds'] = round(time.perf_counter() - started, 3)
+    report['generated_file_full'] = load_test('generated_file full', get_video, args.requests, args.concurrency)
+    report['generated_file_304'] = load_test('generated_file If-None-Match', get_video_conditional, args.requests, args.concurrency)
+    report['generated_file_range'] = load_test('generated_file Range', get_video_range, args.requests, args.concurrency)
+    return report
+
+
+def peak_rss():
+    # ru_maxrss is in KiB on Linux and bytes on macOS; the children figure is the largest single child
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'self_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        'largest_child_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+# Regression comparison
+
+def headline_metrics(report):
+    # name -> (value, higher_is_better)
+    metrics = {}
+    for name, scenario in report['conversions'].items():
+        metrics[f"conversions.{name}.cold_seconds"] = (scenario['cold']['wall_seconds'], False)
+        if scenario['cold']['encode_fps']:
+            metrics[f"conversions.{name}.encode_fps"] = (scenario['cold']['encode_fps'], True)
+        if scenario['warm_wall_seconds']:
+            metrics[f"conversions.{name}.warm_seconds"] = (scenario['warm_wall_seconds']['median'], False)
+    metrics['batch.wall_seconds'] = (report['batch']['wall_seconds'], False)
+    metrics['batch.parse_seconds'] = (report['batch']['parse_seconds'], False)
+    for name, result in report['throughput'].items():
+        if isinstance(result, dict):
+            metrics[f"throughput.{name}.requests_per_second"] = (result['requests_per_second'], True)
+            metrics[f"throughput.{name}.latency_p95_ms"] = (result['latency_p95_ms'], False)
+    metrics['peak_rss.self_bytes'] = (report['peak_rss']['self_bytes'], False)
+    metrics['peak_rss.largest_child_bytes'] = (report['peak_rss']['largest_child_bytes'], False)
+    return metrics
+
+
+def compare(report, baseline, threshold):
+    current = headline_metrics(report)
+    previous = headline_metrics(baseline)
+    comparison = {}
+    for name, (value, higher_is_better) in current.items():
+        if name not in previous or not previous[name][0] or value is None:
+            continue
+        ratio = value / previous[name][0]
+        change = ratio - 1 if higher_is_better else 1 - ratio
+        comparison[name] = {
+            'baseline': previous[name][0],
+            'current': value,
+            'ratio': round(ratio, 3),
+            'verdict': 'regression' if change < -threshold else 'improvement' if change > threshold else 'same',
+        }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg') or 'ffmpeg')
+    parser.add_argument('--duration', type=float, default=4, help='Seconds of each synthetic creative.')
+    parser.add_argument('--creatives', type=int, default=3)
+    parser.add_argument('--wrapper-depth', type=int, default=3)
+    parser.add_argument('--pod-ads', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3, help='Conversions per scenario; the first one is cold.')
+    parser.add_argument('--batch-workers', type=int, default=None)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per throughput test.')
+    parser.add_argument('--post-requests', type=int, default=30, help='Requests for the index POST test (each enqueues a job).')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--job-timeout', type=float, default=600)
+    parser.add_argument('--output', help='Write the JSON results to this file as well as stdout.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Earlier report to compare the headline metrics against.')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative change counted as a regression.')
+    parser.add_argument('--keep', action='store_true', help='Keep the fixture and output directory.')
+    args = parser.parse_args()
+    if args.wrapper_depth < 1 or args.creatives < 1 or args.repeat < 1 or args.pod_ads < 1:
+        parser.error("--wrapper-depth, --creatives, --repeat and --pod-ads must be at least 1")
+
+    work_dir = tempfile.mkdtemp(prefix='bench_e2e_')
+    fixtures_dir = os.path.join(work_dir, 'fixtures')
+    os.makedirs(fixtures_dir)
+    # Read by pipeline on import: every cache, database and workspace lives in the temp directory
+    os.environ['GENERATED_FOLDER'] = os.path.join(work_dir, 'generated')
+    os.environ['FFMPEG_PATH'] = args.ffmpeg
+    real_stdout = sys.stdout
+    try:
+        # The app logs every stage to stdout; only the report goes there
+        with contextlib.redirect_stdout(sys.stderr):
+            stub = start_stub_server(fixtures_dir)
+            stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+            fixtures = write_fixtures(args.ffmpeg, fixtures_dir, stub_url, args)
+
+            import app as web
+            import pipeline
+            import vast_parser
+            server = start_app_server(web.app)
+            app_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+            conversions = run_conversions(app_url, stub_url, fixtures['scenarios'], args.repeat, args.job_timeout)
+            batch = run_batch(pipeline, vast_parser, fixtures_dir, 'pod.xml', stub_url, args.batch_workers)
+            # Same ads, so this mostly checks the namespaced pod is split and served from the render cache
+            batch['vast4'] = run_batch(pipeline, vast_parser, fixtures_dir, 'pod_vast4.xml', stub_url, args.batch_workers)
+            output_filename = next((run['output_filename'] for scenario in conversions.values()
+                                    for run in scenario['runs'] if run['output_filename']), None)
+            if output_filename is None:
+                raise RuntimeError(f"no conversion succeeded: {conversions['inline']['cold']['error']}")
+            throughput = run_throughput(app_url, stub_url, output_filename, web.job_queue, args)
+            server.shutdown()
+            stub.shutdown()
+
+        report = {
+            'benchmark': 'e2e',
+            'created_at': time.time(),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'ffmpeg': (pipeline.ffmpeg_tools.get() or {}).get('version'),
+                'render_workers': pipeline.config['RENDER_WORKERS'],
+                'ffmpeg_threads': pipeline.config['FFMPEG_THREADS'],
+            },
+            'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'keep')},
+            'fixtures': fixtures,
+            'conversions': conversions,
+            'batch': batch,
+            'throughput': throughput,
+            'stub_requests': dict(sorted(stub.counts.items())),
+            'peak_rss': peak_rss(),
+        }
+        regressions = []
+        if args.compare:
+            with open(args.compare, 'r') as f:
+                report['comparison'] = compare(report, json.load(f), args.threshold)
+            regressions = [name for name, entry in report['comparison'].items() if entry['verdict'] == 'regression']
+        text = json.dumps(report, indent=2)
+        print(text, file=real_stdout)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+    finally:
+        if args.keep:
+            print(f"Fixtures and outputs kept in {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Compares wall-clock time of the single-process encode with the segment-parallel encode.
+
+    python benchmarks/bench_segmented.py --duration 45
+    python benchmarks/bench_segmented.py --duration 60 --segments 8 --profile ctv_720p
+
+Both paths composite the same pre-rendered plate with the same filter graph and profile settings; the
+segmented path splits the timeline into GOP-aligned segments encoded by parallel ffmpeg processes and
+concatenates them with stream copy. Output frame counts are reported so the two can be checked against each other.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import qrcode  # noqa: E402
+
+import compositor  # noqa: E402
+import encoder_profiles  # noqa: E402
+import ffmpeg_runner  # noqa: E402
+import layout  # noqa: E402
+import segmented_encode  # noqa: E402
+
+
+
+def make_source(ffmpeg, path, duration, size):
+    subprocess.run([
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate=30",
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(duration), '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '30', '-c:a', 'aac', '-ac', '2', '-shortest', path
+    ], check=True)
+
+
+def count_frames(ffmpeg, path):
+    process = subprocess.run([ffmpeg, '-hide_banner', '-i', path, '-map', '0:v', '-f', 'null', '-'],
+                             capture_output=True, text=True, errors='replace')
+    frames = re.findall(r"frame=\s*(\d+)", process.stderr)
+    return int(frames[-1]) if frames else None
+
+
+def run_single(ffmpeg, source, plate, graph, profile, source_info, output, log, threads):
+    command = [ffmpeg, '-y', '-loglevel', 'info', *ffmpeg_runner.progress_args(), '-i', source, '-i', plate,
+               '-filter_complex', graph, '-map', '[final_output]', '-map', '0:a?',
+               *encoder_profiles.encoder_args(profile, source_info), '-threads', str(threads), output]
+    return ffmpeg_runner.run_ffmpeg(command, log, timeout_seconds=3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg') or 'ffmpeg')
+    parser.add_argument('--duration', type=float, default=30.0, help='Length of the synthetic ad in seconds.')
+    parser.add_argument('--source-size', default='1920x1080')
+    parser.add_argument('--profile', default=encoder_profiles.DEFAULT_PROFILE, choices=sorted(encoder_profiles.PROFILES))
+    parser.add_argument('--segments', type=int, default=os.cpu_count() or 1, help='Parallel segments (default: CPU count).')
+    parser.add_argument('--min-segment-seconds', type=float, default=5.0)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='-threads for the single-process encode.')
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON results to this file as well as stdout.')
+    args = parser.parse_args()
+
+    profile = encoder_profiles.get_profile(args.profile)
+    work_dir = tempfile.mkdtemp(prefix='bench_segmented_')
+    try:
+        source = os.path.join(work_dir, 'ad.mp4')
+        make_source(args.ffmpeg, source, args.duration, args.source_size)
+        source_info = encoder_profiles.probe_media(args.ffmpeg, source)
+        qr_path = os.path.join(work_dir, 'qrcode.png')
+        qrcode.make('https://www.example.com/spring-sale').save(qr_path)
+        lbar = layout.get_layout('lbar')
+        plate = compositor.render_plate(lbar, qr_path, {'brand': 'Acme', 'url': 'www.example.com/spring-sale'},
+                                        work_dir, profile['size'])
+        graph = layout.compile_filter_graph(lbar, tuple(profile['size']))
+        plan = segmented_encode.plan_segments(source_info['duration'], profile, args.segments, args.min_segment_seconds)
+        threads_per_segment = max(1, args.threads // len(plan))
+
+        results = {'single': [], 'segmented': []}
+        for run_index in range(args.runs):
+            single_output = os.path.join(work_dir, f"single_{run_index}.mp4")
+            started = time.perf_counter()
+            run = run_single(args.ffmpeg, source, plate, graph, profile, source_info, single_output,
+                             os.path.join(work_dir, 'single.log'), args.threads)
+            if run['returncode'] != 0:
+                raise RuntimeError(f"single-process encode failed:\n{run['stderr_tail']}")
+            results['single'].append({'seconds': round(time.perf_counter() - started, 3),
+                                      'frames': count_frames(args.ffmpeg, single_output)})
+
+            segmented_output = os.path.join(work_dir, f"segmented_{run_index}.mp4")
+            started = time.perf_counter()
+            run = segmented_encode.run_segmented(args.ffmpeg, source, plate, graph, profile, source_info,
+                                                 segmented_output, os.path.join(work_dir, 'segmented.log'), len(plan),
+                                                 threads_per_segment=threads_per_segment, timeout_seconds=3600,
+                                                 work_dir=work_dir, min_segment_seconds=args.min_segment_seconds)
+            if run['returncode'] != 0:
+                raise RuntimeError(f"segmented encode failed:\n{run['stderr_tail']}")
+            results['segmented'].append({'seconds': round(time.perf_counter() - started, 3),
+                                         'frames': count_frames(args.ffmpeg, segmented_output)})
+
+        best_single = min(run['seconds'] for run in results['single'])
+        best_segmented = min(run['seconds'] for run in results['segmented'])
+        report = {
+            'benchmark': 'segmented_encode',
+            'duration': args.duration,
+            'source_size': args.source_size,
+            'profile': args.profile,
+            'cpu_count': os.cpu_count(),
+            'segments': len(plan),
+            'threads_per_segment': threads_per_segment,
+            'single_threads': args.threads,
+            'runs': results,
+            'single_seconds': best_single,
+            'segmented_seconds': best_segmented,
+            'speedup': round(best_single / best_segmented, 2) if best_segmented else None,
+        }
+        text = json.dumps(report, indent=2)
+        print(text)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Compares encoding a variant set as separate ffmpeg runs with the single-decode split graph.
+
+    python benchmarks/bench_variants.py --duration 15
+    python benchmarks/bench_variants.py --profiles ctv_1080p,ctv_720p,low_bandwidth --ctas 2
+
+Each variant is an encoder profile, optionally with its own CTA text. The separate path runs one ffmpeg
+per variant, each decoding the source again; the split path decodes once and encodes every variant in one
+process with layout.compile_variant_graph. Wall-clock and CPU seconds (user + system of the ffmpeg
+children) are reported for both.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import qrcode  # noqa: E402
+
+import compositor  # noqa: E402
+import encoder_profiles  # noqa: E402
+import layout  # noqa: E402
+
+
+def make_source(ffmpeg, path, duration, size):
+    subprocess.run([
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate=30",
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(duration), '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-ac', '2', '-shortest', path
+    ], check=True)
+
+
+def child_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def timed_run(command):
+    cpu_started, started = child_cpu_seconds(), time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True, errors='replace')
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({process.returncode}):\n{process.stderr[-2000:]}")
+    return time.perf_counter() - started, child_cpu_seconds() - cpu_started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg') or 'ffmpeg')
+    parser.add_argument('--duration', type=float, default=10.0, help='Length of the synthetic ad in seconds.')
+    parser.add_argument('--source-size', default='1920x1080')
+    parser.add_argument('--profiles', default='ctv_1080p,ctv_720p', help='Comma-separated encoder profiles, one variant each.')
+    parser.add_argument('--ctas', type=int, default=1, help='Extra CTA-text variants of the first profile.')
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON results to this file as well as stdout.')
+    args = parser.parse_args()
+
+    profiles = [encoder_profiles.get_profile(name) for name in args.profiles.split(',')]
+    profiles += [profiles[0]] * args.ctas
+    ctas = [None] * (len(profiles) - args.ctas) + [f"OFFER {index + 1}: SCAN NOW." for index in range(args.ctas)]
+    work_dir = tempfile.mkdtemp(prefix='bench_variants_')
+    try:
+        source = os.path.join(work_dir, 'ad.mp4')
+        make_source(args.ffmpeg, source, args.duration, args.source_size)
+        source_info = encoder_profiles.probe_media(args.ffmpeg, source)
+        qr_path = os.path.join(work_dir, 'qrcode.png')
+        qrcode.make('https://www.example.com/spring-sale').save(qr_path)
+        lbar = layout.get_layout('lbar')
+        plates = []
+        for profile, cta in zip(profiles, ctas):
+            texts = {'brand': 'Acme', 'url': 'www.example.com/spring-sale'}
+            if cta:
+                texts['cta'] = cta
+            plates.append(compositor.render_plate(lbar, qr_path, texts, work_dir, profile['size']))
+
+        def outputs(index, profile, label):
+            return [*encoder_profiles.encoder_args(profile, source_info), os.path.join(work_dir, f"{label}_{index}.mp4")]
+
+        results = {'separate': [], 'split': []}
+        for _ in range(args.runs):
+            wall = cpu = 0.0
+            for index, (profile, plate) in enumerate(zip(profiles, plates)):
+                graph = layout.compile_filter_graph(lbar, tuple(profile['size']))
+                seconds, cpu_seconds = timed_run([args.ffmpeg, '-y', '-loglevel', 'error', '-i', source, '-i', plate,
+                                                  '-filter_complex', graph, '-map', '[final_output]', '-map', '0:a?',
+                                                  *outputs(index, profile, 'separate')])
+                wall, cpu = wall + seconds, cpu + cpu_seconds
+            results['separate'].append({'seconds': round(wall, 3), 'cpu_seconds': round(cpu, 3)})
+
+            graph = layout.compile_variant_graph(tuple((lbar, tuple(profile['size']), True, None) for profile in profiles))
+            command = [args.ffmpeg, '-y', '-loglevel', 'error', '-i', source]
+            for plate in plates:
+                command += ['-i', plate]
+            command += ['-filter_complex', graph]
+            for index, profile in enumerate(profiles):
+                command += ['-map', f"[variant_{index}]", '-map', '0:a?', *outputs(index, profile, 'split')]
+            seconds, cpu_seconds = timed_run(command)
+            results['split'].append({'seconds': round(seconds, 3), 'cpu_seconds': round(cpu_seconds, 3)})
+
+        best_separate = min(results['separate'], key=lambda run: run['cpu_seconds'])
+        best_split = min(results['split'], key=lambda run: run['cpu_seconds'])
+        report = {
+            'benchmark': 'variants',
+            'duration': args.duration,
+            'source_size': args.source_size,
+            'variants': [profile['name'] + (f" ({cta})" if cta else '') for profile, cta in zip(profiles, ctas)],
+            'cpu_count': os.cpu_count(),
+            'runs': results,
+            'separate_cpu_seconds': best_separate['cpu_seconds'],
+            'split_cpu_seconds': best_split['cpu_seconds'],
+            'cpu_saving': round(1 - best_split['cpu_seconds'] / best_separate['cpu_seconds'], 3) if best_separate['cpu_seconds'] else None,
+            'speedup': round(best_separate['seconds'] / best_split['seconds'], 2) if best_split['seconds'] else None,
+        }
+        text = json.dumps(report, indent=2)
+        print(text)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + "\n")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
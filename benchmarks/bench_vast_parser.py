@@ -0,0 +1,130 @@
+"""Compares the streaming VAST parser with the legacy whole-tree parse plus `.//` scans.
+
+    python benchmarks/bench_vast_parser.py
+    python benchmarks/bench_vast_parser.py --iterations 5000 --large-ads 2000
+
+Every tag in benchmarks/vast_corpus/ is parsed --iterations times by both paths. A synthetic document with
+--large-ads ads (each with a full set of tracking events) is then parsed once by each path, and again under
+tracemalloc to compare peak memory on the kind of oversized pods that approach MAX_CONTENT_LENGTH. The
+streaming parser is timed both reading only the first ad (as the converter does) and reading every ad
+into full VastAd models.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vast_parser  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vast_corpus')
+
+
+def legacy_extract(vast_content):
+    # What parse_vast_ad did before vast_parser: build the whole tree, then scan it once per field
+    root = ET.fromstring(vast_content)
+    ad_title = root.find('.//AdTitle')
+    media_files = [(mf.text or '').strip() for mf in root.findall('.//MediaFile') if mf.get('type') == 'video/mp4']
+    click_through = root.find('.//ClickThrough')
+    click_trackings = [(ct.text or '').strip() for ct in root.findall('.//ClickTracking')]
+    return ad_title, media_files, click_through, click_trackings
+
+
+def streaming_extract(vast_content):
+    # What parse_vast_ad does now: stop after the first ad
+    document = vast_parser.parse_vast(vast_content, max_ads=1)
+    ad = document.ads[0] if document.ads else None
+    return ad and (ad.ad_title, ad.mp4_media_files(), ad.click_through, ad.click_trackings)
+
+
+def streaming_all(vast_content):
+    # Every ad of a pod, as batch conversion needs them
+    return vast_parser.parse_vast(vast_content).ads
+
+
+def large_document(ads):
+    events = ''.join(f'<Tracking event="{event}"><![CDATA[https://ads.example.com/track?e={event}&ad={{index}}]]></Tracking>'
+                     for event in ('creativeView', 'start', 'firstQuartile', 'midpoint', 'thirdQuartile', 'complete'))
+    ad_template = (
+        '<Ad id="{index}" sequence="{index}"><InLine><AdSystem>Bench</AdSystem><AdTitle>Campaign_Bench_{index}</AdTitle>'
+        '<Impression><![CDATA[https://ads.example.com/impression?ad={index}]]></Impression>'
+        '<Creatives><Creative><Linear><Duration>00:00:15</Duration>'
+        f'<TrackingEvents>{events}</TrackingEvents>'
+        '<VideoClicks><ClickThrough><![CDATA[https://www.example.com/landing?ad={index}]]></ClickThrough></VideoClicks>'
+        '<MediaFiles>'
+        '<MediaFile delivery="progressive" type="video/mp4" width="1280" height="720" bitrate="2500"><![CDATA[https://cdn.example.com/{index}_720p.mp4]]></MediaFile>'
+        '<MediaFile delivery="progressive" type="video/mp4" width="1920" height="1080" bitrate="5000"><![CDATA[https://cdn.example.com/{index}_1080p.mp4]]></MediaFile>'
+        '</MediaFiles></Linear></Creative></Creatives></InLine></Ad>'
+    )
+    return '<VAST version="3.0">' + ''.join(ad_template.format(index=index) for index in range(ads)) + '</VAST>'
+
+
+def time_per_call(function, argument, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return (time.perf_counter() - started) / iterations
+
+
+def peak_memory(function, argument):
+    tracemalloc.start()
+    function(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--large-ads', type=int, default=1000, help='Ads in the synthetic memory test document.')
+    parser.add_argument('--output', help='Write the JSON results to this file as well as stdout.')
+    args = parser.parse_args()
+
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.xml'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            vast_content = f.read()
+        legacy = time_per_call(legacy_extract, vast_content, args.iterations)
+        streaming = time_per_call(streaming_extract, vast_content, args.iterations)
+        document = vast_parser.parse_vast(vast_content)
+        corpus[os.path.basename(path)] = {
+            'bytes': len(vast_content.encode('utf-8')),
+            'version': document.version,
+            'ads': len(document.ads),
+            'media_files': sum(len(ad.media_files) for ad in document.ads),
+            'legacy_us': round(legacy * 1e6, 1),
+            'streaming_us': round(streaming * 1e6, 1),
+        }
+
+    large = large_document(args.large_ads)
+    large_bytes = large.encode('utf-8')
+    report = {
+        'benchmark': 'vast_parser',
+        'iterations': args.iterations,
+        'corpus': corpus,
+        'large_document': {
+            'ads': args.large_ads,
+            'bytes': len(large_bytes),
+            'legacy_seconds': round(time_per_call(legacy_extract, large, 1), 4),
+            'streaming_first_ad_seconds': round(time_per_call(streaming_extract, large, 1), 4),
+            'streaming_all_ads_seconds': round(time_per_call(streaming_all, large, 1), 4),
+            # Peak allocations while parsing, not counting the input text itself
+            'legacy_peak_bytes': peak_memory(legacy_extract, large),
+            'streaming_all_ads_peak_bytes': peak_memory(streaming_all, large),
+        },
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+
+
+if __name__ == '__main__':
+    main()
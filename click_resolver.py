@@ -0,0 +1,125 @@
+from contextlib import closing
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import sqlite_store
+
+# HEAD answers that mean "this server doesn't do HEAD properly", so the GET fallback is worth trying
+_HEAD_FALLBACK_STATUSES = {400, 403, 404, 405, 500, 501, 502, 503}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resolved_urls (
+    url TEXT PRIMARY KEY,
+    final_url TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class ClickResolver:
+    """Resolves click-through URLs to their final landing page.
+
+    Uses one connection-pooled session, tries HEAD first and falls back to a streamed GET whose body is
+    never read. Results are cached in memory and in SQLite with a TTL; failures are not cached.
+    """
+
+    def __init__(self, db_path, ttl_seconds=6 * 3600, max_redirects=10, timeout_seconds=10, max_workers=16,
+                 memory_entries=4096, session=None):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.timeout_seconds = timeout_seconds
+        self.max_workers = max_workers
+        self.memory_entries = memory_entries
+        self.session = session or requests.Session()
+        if session is None:
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        self.session.max_redirects = max_redirects
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        sqlite_store.initialize(db_path, _SCHEMA)
+
+    def _connect(self):
+        return sqlite_store.connect(self.db_path)
+
+    def _cached(self, url):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(url)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(url)
+                    return entry[1]
+                del self._memory[url]
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT final_url, expires_at FROM resolved_urls WHERE url = ?", (url,)).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        self._remember(url, row[0], row[1])
+        return row[0]
+
+    def _remember(self, url, final_url, expires_at):
+        with self._lock:
+            self._memory[url] = (expires_at, final_url)
+            self._memory.move_to_end(url)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _store(self, url, final_url):
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(url, final_url, expires_at)
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("INSERT OR REPLACE INTO resolved_urls (url, final_url, expires_at) VALUES (?, ?, ?)",
+                             (url, final_url, expires_at))
+                conn.execute("DELETE FROM resolved_urls WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            print(f"[CLICK RESOLVER] Could not persist {url}: {e}", flush=True)
+
+    def _follow(self, url):
+        try:
+            response = self.session.head(url, allow_redirects=True, timeout=self.timeout_seconds)
+            response.close()
+            if response.status_code not in _HEAD_FALLBACK_STATUSES:
+                return response.url
+            print(f"HEAD {url} returned {response.status_code}, retrying with GET", flush=True)
+        except requests.exceptions.Timeout:
+            raise
+        except requests.RequestException as e:
+            print(f"HEAD {url} failed ({e}), retrying with GET", flush=True)
+        # stream=True stops requests from downloading the landing page; we only need the final URL
+        with self.session.get(url, allow_redirects=True, timeout=self.timeout_seconds, stream=True) as response:
+            return response.url
+
+    def resolve(self, url):
+        if not url or not (url.startswith('http://') or url.startswith('https://')):
+            print(f"Invalid URL for resolution: {url}", flush=True)
+            return url
+        cached = self._cached(url)
+        if cached is not None:
+            return cached
+        try:
+            final_url = self._follow(url)
+        except requests.exceptions.Timeout:
+            print(f"Timeout ({self.timeout_seconds}s) resolving URL {url}", flush=True)
+            return url
+        except requests.RequestException as e:
+            print(f"Failed to resolve URL {url}: {e}", flush=True)
+            return url
+        self._store(url, final_url)
+        return final_url
+
+    def resolve_many(self, urls):
+        # Resolves a batch concurrently; returns {url: final_url} with each distinct URL fetched once
+        unique_urls = list(dict.fromkeys(url for url in urls if url))
+        if not unique_urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique_urls))) as pool:
+            return dict(zip(unique_urls, pool.map(self.resolve, unique_urls)))
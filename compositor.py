@@ -0,0 +1,180 @@
+from contextlib import closing
+import glob
+import hashlib
+import os
+import threading
+import time
+from functools import lru_cache
+
+import sqlite_store
+
+# Pillow is imported inside the drawing functions, so plate keys can be computed (e.g. by the render cache
+# lookup) without paying for the import.
+#
+# What goes where on the frame is described by a layout template (see layout.py); this module draws a
+# layout's static layers (background, QR code and text) into one plate image per render.
+
+# Bump when the drawing code changes so previously cached plates are not reused
+PLATE_VERSION = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plates (
+    filename TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plates_last_access ON plates (last_access);
+"""
+
+
+@lru_cache(maxsize=None)
+def load_font(fonts, size):
+    from PIL import ImageFont
+    for candidate in fonts:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    print(f"[COMPOSITOR] No TrueType font found from {fonts}; using Pillow's default font", flush=True)
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=8)
+def _background(background_path, mtime, frame_size):
+    # Decoding and resizing the 1920x1080 background is the slowest part of a plate; reuse it per process
+    from PIL import Image
+    return Image.open(background_path).convert('RGBA').resize(frame_size, Image.LANCZOS)
+
+
+def plate_key(layout, qr_path, texts, output_size=None):
+    output_size = tuple(output_size or layout.frame_size)
+    digest = hashlib.sha256()
+    digest.update(layout.digest.encode('utf-8'))
+    if layout.background_image:
+        stat = os.stat(layout.background_image)
+        digest.update(f"{os.path.basename(layout.background_image)}:{stat.st_size}:{int(stat.st_mtime)}".encode('utf-8'))
+    # The QR image is regenerated per job, so it is identified by content rather than by file stat
+    with open(qr_path, 'rb') as f:
+        digest.update(hashlib.sha256(f.read()).digest())
+    for box, text in layout.texts(texts):
+        digest.update(b'\0' + f"{box['name']}={text}".encode('utf-8'))
+    for text in (f"{output_size[0]}x{output_size[1]}", str(PLATE_VERSION)):
+        digest.update(b'\0' + text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def render_plate(layout, qr_path, texts, cache_dir, output_size=None):
+    """Renders every static layer of a layout into one RGBA PNG and returns its path.
+
+    `texts` maps text box names to this render's text (e.g. brand and url); boxes not given fall back to the
+    layout's static text. The video slot is left fully transparent, so ffmpeg only has to pad the scaled ad
+    video to the frame size and overlay this plate once per frame. Plates are cached on disk by layout, QR,
+    text and output size.
+    """
+    output_size = tuple(output_size or layout.frame_size)
+    key = plate_key(layout, qr_path, texts, output_size)
+    plate_path = os.path.join(cache_dir, f"plate_{key[:24]}.png")
+    if os.path.exists(plate_path):
+        return plate_path
+
+    from PIL import Image, ImageDraw
+    if layout.background_image:
+        plate = _background(layout.background_image, os.path.getmtime(layout.background_image), layout.frame_size).copy()
+    else:
+        plate = Image.new('RGBA', layout.frame_size, layout.background_color)
+    qr_x, qr_y, qr_size = layout.qr_box
+    with Image.open(qr_path) as qr_image:
+        qr_image = qr_image.convert('RGBA')
+        if qr_image.size != (qr_size, qr_size):
+            qr_image = qr_image.resize((qr_size, qr_size), Image.NEAREST)
+        plate.paste(qr_image, (qr_x, qr_y))
+
+    draw = ImageDraw.Draw(plate)
+    for box, text in layout.texts(texts):
+        # 'la' (the default) anchors at the ascender line, which is where drawtext's y coordinate put the text
+        draw.text(box['position'], text, font=load_font(box['fonts'], box['size']), fill=box['color'], anchor=box['anchor'])
+
+    # The layout is drawn at its own frame size; other output profiles get a resized copy of the plate
+    if output_size != layout.frame_size:
+        plate = plate.resize(output_size, Image.LANCZOS)
+    video_x, video_y, video_width, video_height = layout.scaled_video_box(output_size)
+    plate.paste((0, 0, 0, 0), (video_x, video_y, video_x + video_width, video_y + video_height))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temp name and rename so concurrent jobs never read a half-written plate
+    temp_path = f"{plate_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    plate.save(temp_path, format='PNG', compress_level=1)
+    os.replace(temp_path, plate_path)
+    return plate_path
+
+
+class PlateCache:
+    """Size-bounded LRU of rendered plates in one directory.
+
+    get() draws a plate with render_plate() (or finds it already on disk) and records it in a SQLite index,
+    then deletes the least recently used plates until the directory is under max_bytes. Plates used within
+    grace_seconds are never deleted, so the plates of renders that are still encoding stay on disk even
+    when the cache is briefly over its limit.
+    """
+
+    def __init__(self, directory, db_path, max_bytes, grace_seconds=3600):
+        self.directory = directory
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        os.makedirs(directory, exist_ok=True)
+        sqlite_store.initialize(db_path, _SCHEMA)
+        with closing(self._connect()) as conn:
+            if conn.execute("SELECT COUNT(*) FROM plates").fetchone()[0] == 0:
+                self._adopt(conn)
+
+    def _connect(self):
+        return sqlite_store.connect(self.db_path)
+
+    def _adopt(self, conn):
+        # Plates written before the index existed are indexed by mtime, so they age out like the rest
+        for path in glob.glob(os.path.join(self.directory, 'plate_*.png')):
+            stat = os.stat(path)
+            conn.execute("INSERT OR IGNORE INTO plates (filename, size, created_at, last_access) VALUES (?, ?, ?, ?)",
+                         (os.path.basename(path), stat.st_size, stat.st_mtime, stat.st_mtime))
+
+    def get(self, layout, qr_path, texts, output_size=None):
+        """Returns the path of the plate for these inputs (see render_plate), drawing it on a miss."""
+        path = render_plate(layout, qr_path, texts, self.directory, output_size)
+        filename = os.path.basename(path)
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO plates (filename, size, created_at, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(filename) DO UPDATE SET last_access = excluded.last_access",
+                (filename, os.path.getsize(path), now, now)
+            )
+        self.evict()
+        return path
+
+    def evict(self):
+        removed = 0
+        with closing(self._connect()) as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM plates").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            for filename, size in conn.execute("SELECT filename, size FROM plates WHERE last_access < ? ORDER BY last_access",
+                                               (time.time() - self.grace_seconds,)).fetchall():
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM plates WHERE filename = ?", (filename,))
+                total -= size
+                removed += 1
+        if removed:
+            print(f"[COMPOSITOR] Evicted {removed} plate(s) to stay under {self.max_bytes} bytes", flush=True)
+        return removed
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM plates").fetchone()
+        return {'entries': entries, 'bytes': total, 'max_bytes': self.max_bytes}
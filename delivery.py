@@ -0,0 +1,102 @@
+import mimetypes
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from flask import Response, request, send_file
+
+from media_ingest import file_sha256
+
+OFFLOAD_NONE = 'none'
+OFFLOAD_X_ACCEL = 'x-accel-redirect'
+OFFLOAD_X_SENDFILE = 'x-sendfile'
+OFFLOAD_MODES = (OFFLOAD_NONE, OFFLOAD_X_ACCEL, OFFLOAD_X_SENDFILE)
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+class OutputDelivery:
+    """Serves files from the generated folder with content-hash ETags, cache headers and Range support.
+
+    With an index (a storage.ArtifactStore), only indexed artifacts are served and each hit counts as an
+    access for garbage collection; without one, any plain file name directly in the directory is served.
+    Files whose names match immutable_pattern (renders get a random name and are never rewritten) are
+    served as cacheable for a year; anything else (the QR image, logs, manifests) must be revalidated,
+    which costs a 304. Files of at least offload_min_bytes can be handed to the front-end server with
+    X-Accel-Redirect (nginx) or X-Sendfile (Apache/lighttpd) so workers don't stream video bytes.
+    """
+
+    def __init__(self, directory, index=None, offload=OFFLOAD_NONE, accel_prefix='/protected-generated/', offload_min_bytes=1024 * 1024,
+                 immutable_pattern=r'^output_.*\.mp4$', max_etags=4096):
+        if offload not in OFFLOAD_MODES:
+            raise ValueError(f"Unknown delivery offload mode {offload!r}; expected one of {', '.join(OFFLOAD_MODES)}")
+        self.directory = os.path.abspath(directory)
+        self.index = index
+        self.offload = offload
+        self.accel_prefix = accel_prefix.rstrip('/') + '/'
+        self.offload_min_bytes = offload_min_bytes
+        self.immutable_pattern = re.compile(immutable_pattern)
+        self.max_etags = max_etags
+        # (path, size, mtime_ns) -> sha256, so each file is hashed once per process
+        self._etags = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, filename):
+        if self.index is not None:
+            if self.index.lookup(filename) is None:
+                return None
+            path = self.index.path(filename)
+            if path is None or not os.path.isfile(path):
+                return None
+            self.index.touch(filename)
+            return path
+        # Without an index, only plain names directly inside the folder
+        if not filename or filename != os.path.basename(filename) or filename.startswith('.'):
+            return None
+        path = os.path.join(self.directory, filename)
+        return path if os.path.isfile(path) else None
+
+    def etag(self, path, stat=None):
+        stat = stat or os.stat(path)
+        identity = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if identity in self._etags:
+                self._etags.move_to_end(identity)
+                return self._etags[identity]
+        sha256 = file_sha256(path)
+        with self._lock:
+            self._etags[identity] = sha256
+            while len(self._etags) > self.max_etags:
+                self._etags.popitem(last=False)
+        return sha256
+
+    def cache_control(self, filename):
+        return IMMUTABLE_CACHE_CONTROL if self.immutable_pattern.match(os.path.basename(filename)) else REVALIDATE_CACHE_CONTROL
+
+    def serve(self, filename):
+        """Builds the response for GET/HEAD of filename, or returns None if there is no such file."""
+        path = self.resolve(filename)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        etag = self.etag(path, stat)
+
+        if self.offload != OFFLOAD_NONE and stat.st_size >= self.offload_min_bytes:
+            response = Response(status=200, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            if self.offload == OFFLOAD_X_ACCEL:
+                # nginx serves the internal location itself, including Range requests
+                response.headers['X-Accel-Redirect'] = f"{self.accel_prefix}{filename}"
+            else:
+                response.headers['X-Sendfile'] = path
+            response.set_etag(etag)
+            response.last_modified = stat.st_mtime
+            # Revalidations are answered here without involving the front-end server
+            response = response.make_conditional(request)
+        else:
+            # send_file answers If-None-Match / If-Modified-Since with 304 and Range / If-Range with 206
+            response = send_file(path, conditional=True, etag=etag, last_modified=stat.st_mtime)
+        response.headers['Cache-Control'] = self.cache_control(filename)
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
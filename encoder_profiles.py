@@ -0,0 +1,196 @@
+import os
+import re
+import subprocess
+from functools import lru_cache
+
+# Named CTV output profiles. Every profile keeps a fixed keyframe interval (no scene-cut keyframes) so
+# renders segment cleanly for SSAI stitching, and caps the video bitrate with VBV so peaks stay deliverable.
+PROFILES = {
+    'ctv_1080p': {
+        'description': 'Generic CTV 1080p (default)',
+        'size': (1920, 1080), 'fps': '23.98', 'gop_seconds': 2,
+        'video_codec': 'libx264', 'preset': 'fast', 'crf': 23, 'h264_profile': 'high', 'level': '4.1',
+        'maxrate': '10M', 'bufsize': '20M',
+        'audio_codec': 'aac', 'audio_bitrate': '192k', 'audio_sample_rate': 48000, 'audio_channels': 2,
+    },
+    'ctv_720p': {
+        'description': 'Generic CTV 720p',
+        'size': (1280, 720), 'fps': '23.98', 'gop_seconds': 2,
+        'video_codec': 'libx264', 'preset': 'fast', 'crf': 23, 'h264_profile': 'high', 'level': '4.0',
+        'maxrate': '5M', 'bufsize': '10M',
+        'audio_codec': 'aac', 'audio_bitrate': '192k', 'audio_sample_rate': 48000, 'audio_channels': 2,
+    },
+    'low_bandwidth': {
+        'description': '720p for constrained SSAI pipelines',
+        'size': (1280, 720), 'fps': '23.98', 'gop_seconds': 2,
+        'video_codec': 'libx264', 'preset': 'fast', 'crf': 25, 'h264_profile': 'main', 'level': '3.1',
+        'maxrate': '2500k', 'bufsize': '5M',
+        'audio_codec': 'aac', 'audio_bitrate': '128k', 'audio_sample_rate': 48000, 'audio_channels': 2,
+    },
+}
+# Platform names for callers that pick a profile by platform. They have no settings of their own yet, so they
+# are aliases of ctv_1080p; give one its own entry above once a platform needs different constraints.
+for _name, _platform in (('roku', 'Roku'), ('fire_tv', 'Fire TV')):
+    PROFILES[_name] = dict(PROFILES['ctv_1080p'], description=f"{_platform} 1080p (same settings as ctv_1080p)")
+DEFAULT_PROFILE = 'ctv_1080p'
+
+_CHANNEL_LAYOUTS = {'mono': 1, 'stereo': 2, '2.1': 3, 'quad': 4, '5.0': 5, '5.1': 6, '5.1(side)': 6, '7.1': 8}
+
+
+class UnknownProfileError(Exception):
+    pass
+
+
+def get_profile(name=None):
+    name = name or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise UnknownProfileError(f"Unknown encoder profile '{name}'. Available profiles: {', '.join(sorted(PROFILES))}")
+    return dict(PROFILES[name], name=name)
+
+
+def media_file_candidates(media_files):
+    # Every usable MP4 MediaFile (vast_parser.MediaFile models), in document order, with the size hints VAST gives us
+    return [{
+        'url': media_file.url,
+        'width': media_file.width,
+        'height': media_file.height,
+        'bitrate': media_file.bitrate or media_file.max_bitrate,
+        'index': media_file.index,
+    } for media_file in media_files if media_file.type == 'video/mp4' and media_file.url]
+
+
+def select_media_file(candidates, target_size):
+    """Picks the smallest MediaFile that still covers target_size (width, height), so ffmpeg decodes as few
+    pixels as possible without upscaling. Falls back to the largest one if none is big enough, and to
+    document order when the VAST gives no dimensions at all."""
+    if not candidates:
+        return None
+    sized = [c for c in candidates if c['width'] and c['height']]
+    if not sized:
+        return candidates[0]
+    target_width, target_height = target_size
+    covering = [c for c in sized if c['width'] >= target_width and c['height'] >= target_height]
+    if covering:
+        return min(covering, key=lambda c: (c['width'] * c['height'], c['bitrate'] or 0, c['index']))
+    return max(sized, key=lambda c: (c['width'] * c['height'], c['bitrate'] or 0, -c['index']))
+
+
+@lru_cache(maxsize=256)
+def _probe(ffmpeg_path, media_path, size, mtime):
+    return _read_layout(ffmpeg_path, media_path, 30)
+
+
+def _read_layout(ffmpeg_path, source, timeout_seconds):
+    try:
+        process = subprocess.run([ffmpeg_path, '-hide_banner', '-i', source], capture_output=True,
+                                 text=True, errors='replace', timeout=timeout_seconds)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"[ENCODER PROFILES] Could not probe {source}: {e}", flush=True)
+        return None
+    info = {'video': None, 'audio': None, 'duration': None}
+    # `ffmpeg -i` with no output exits non-zero but still prints the stream layout on stderr
+    for line in process.stderr.splitlines():
+        line = line.strip()
+        duration = re.match(r"Duration: (\d+):(\d+):([\d.]+)", line)
+        if duration and info['duration'] is None:
+            hours, minutes, seconds = duration.groups()
+            info['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        elif line.startswith('Stream #') and info['video'] is None and ': Video: ' in line:
+            match = re.search(r"Video: (\w+).*?, (\d{2,5})x(\d{2,5})", line)
+            fps = re.search(r"([\d.]+) fps", line)
+            if match:
+                info['video'] = {'codec': match.group(1), 'width': int(match.group(2)), 'height': int(match.group(3)),
+                                 'fps': float(fps.group(1)) if fps else None}
+        elif line.startswith('Stream #') and info['audio'] is None and ': Audio: ' in line:
+            match = re.search(r"Audio: (\w+).*?, (\d+) Hz, ([^,]+)", line)
+            bitrate = re.search(r"(\d+) kb/s", line)
+            if match:
+                info['audio'] = {'codec': match.group(1), 'sample_rate': int(match.group(2)),
+                                 'channels': _CHANNEL_LAYOUTS.get(match.group(3).strip()),
+                                 'bitrate': int(bitrate.group(1)) * 1000 if bitrate else None}
+    return info
+
+
+def probe_media(ffmpeg_path, media_path):
+    # Stream layout of a local media file, cached per file version; None when ffmpeg can't read it
+    if not ffmpeg_path or not media_path or not os.path.isfile(media_path):
+        return None
+    stat = os.stat(media_path)
+    return _probe(ffmpeg_path, media_path, stat.st_size, stat.st_mtime)
+
+
+def probe_url(ffmpeg_path, url, timeout_seconds=10):
+    # Stream layout of a remote MediaFile, read by ffmpeg itself: only the container header is fetched (with
+    # ranged reads when the index sits at the end), so a creative can be checked before it is downloaded
+    if not ffmpeg_path or not url.startswith(('http://', 'https://')):
+        return None
+    return _read_layout(ffmpeg_path, url, timeout_seconds)
+
+
+def _bits(rate):
+    rate = str(rate).lower()
+    multiplier = {'k': 1000, 'm': 1000 * 1000}.get(rate[-1:], 1)
+    return int(float(rate.rstrip('km')) * multiplier)
+
+
+def audio_matches(profile, source):
+    # AAC at the target rate/layout and within the bitrate cap can be muxed as-is instead of re-encoded
+    audio = (source or {}).get('audio')
+    if not audio:
+        return False
+    return (audio['codec'] == profile['audio_codec']
+            and audio['sample_rate'] == profile['audio_sample_rate']
+            and audio['channels'] == profile['audio_channels']
+            and audio['bitrate'] is not None and audio['bitrate'] <= _bits(profile['audio_bitrate']))
+
+
+def video_matches(target_size, source):
+    video = (source or {}).get('video')
+    return bool(video) and (video['width'], video['height']) == tuple(target_size)
+
+
+def frame_rate_filter(profile, source):
+    # A source faster than the profile is dropped to the output rate before it is scaled and composited,
+    # so the filters only process frames that are kept; slower or unknown rates are left to -r
+    video = (source or {}).get('video')
+    if not video or not video.get('fps') or video['fps'] <= float(profile['fps']) + 0.01:
+        return None
+    return profile['fps']
+
+
+def audio_map(source, input_index=0):
+    # The audio stream to encode: the first one when the probe found audio, none when it found none, and
+    # whatever exists when the source wasn't probed
+    if source is None:
+        return ['-map', f"{input_index}:a?"]
+    return ['-map', f"{input_index}:a:0"] if source.get('audio') else []
+
+
+def gop_frames(profile):
+    return max(1, round(float(profile['fps']) * profile['gop_seconds']))
+
+
+def video_args(profile):
+    gop = gop_frames(profile)
+    return [
+        '-c:v', profile['video_codec'], '-preset', profile['preset'], '-crf', str(profile['crf']),
+        '-profile:v', profile['h264_profile'], '-level:v', profile['level'],
+        '-maxrate', profile['maxrate'], '-bufsize', profile['bufsize'],
+        '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+        '-pix_fmt', 'yuv420p', '-r', profile['fps'],
+    ]
+
+
+def audio_args(profile, source=None):
+    if source is not None and not source.get('audio'):
+        return ['-an']
+    if audio_matches(profile, source):
+        return ['-c:a', 'copy']
+    return ['-c:a', profile['audio_codec'], '-b:a', profile['audio_bitrate'],
+            '-ar', str(profile['audio_sample_rate']), '-ac', str(profile['audio_channels'])]
+
+
+def encoder_args(profile, source=None):
+    """ffmpeg output options for a profile. With a probed source, audio that already meets the profile is
+    stream-copied rather than decoded and re-encoded, and a source without audio gets no audio track."""
+    return [*video_args(profile), *audio_args(profile, source), '-shortest', '-movflags', '+faststart']
@@ -0,0 +1,165 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+# Checked in order after an explicit FFMPEG_PATH; anything else is looked up on PATH
+CANDIDATE_PATHS = ('/opt/homebrew/bin/ffmpeg',)
+
+# Bump when the record layout changes so cached records written by older code are re-probed
+RECORD_VERSION = 3
+
+
+def _run(binary, *args):
+    process = subprocess.run([binary, '-hide_banner', *args], capture_output=True, text=True, errors='replace', timeout=10)
+    return process.stdout + process.stderr
+
+
+def _listed_names(output):
+    # `-encoders` / `-decoders` / `-filters` rows are "<flags> <name> <description>"; legend lines have "=" as the name
+    names = set()
+    for line in output.splitlines():
+        match = re.match(r"\s*[A-Z.|]{3,6}\s+(\S+)\s", line)
+        if match and match.group(1) != '=':
+            names.add(match.group(1))
+    return sorted(names)
+
+
+def _decodable_codecs(output):
+    # `-codecs` rows are "<flags> <codec> <description> (decoders: ...)"; a leading D means some decoder handles
+    # the codec. These are the names `ffmpeg -i` prints for a stream (av1), not decoder names (libdav1d)
+    codecs = set()
+    for line in output.splitlines():
+        match = re.match(r"\s*([D.])[E.][VASDT.][I.][L.][S.]\s+(\S+)\s", line)
+        if match and match.group(1) == 'D' and match.group(2) != '=':
+            codecs.add(match.group(2))
+    return sorted(codecs)
+
+
+def probe(binary):
+    """Runs the binary once for its version, build configuration, encoders, decoders, decodable codecs and filters."""
+    version_output = _run(binary, '-version')
+    version_match = re.search(r"ffmpeg version (\S+)", version_output)
+    if not version_match:
+        raise RuntimeError(f"{binary} -version did not identify itself as ffmpeg")
+    configuration = re.search(r"configuration: (.*)", version_output)
+    configuration = configuration.group(1).split() if configuration else []
+    encoders = _listed_names(_run(binary, '-encoders'))
+    decoders = _listed_names(_run(binary, '-decoders'))
+    decodable_codecs = _decodable_codecs(_run(binary, '-codecs'))
+    filters = _listed_names(_run(binary, '-filters'))
+    return {
+        'version': version_match.group(1),
+        'configuration': configuration,
+        'encoders': encoders,
+        'decoders': decoders,
+        'decodable_codecs': decodable_codecs,
+        'filters': filters,
+        'features': {
+            'libx264': 'libx264' in encoders,
+            'aac': 'aac' in encoders,
+            'drawtext': 'drawtext' in filters,
+            'overlay': 'overlay' in filters,
+            'fontconfig': any(flag in configuration for flag in ('--enable-fontconfig', '--enable-libfontconfig')),
+            'freetype': '--enable-libfreetype' in configuration,
+        },
+    }
+
+
+class FfmpegCapabilities:
+    """Finds and validates the ffmpeg binary once and remembers what it can do.
+
+    The record is kept in memory and in a JSON file, keyed by the binary's path, size and mtime, so an
+    upgraded ffmpeg is re-probed while every other lookup costs a stat() instead of a subprocess.
+    """
+
+    def __init__(self, cache_path, configured_path=None, retry_seconds=60):
+        self.cache_path = cache_path
+        self.configured_path = configured_path
+        self.retry_seconds = retry_seconds
+        self._record = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def resolve_binary(self):
+        candidates = [self.configured_path] if self.configured_path else []
+        candidates += list(CANDIDATE_PATHS)
+        for candidate in candidates:
+            if candidate and os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                return os.path.realpath(candidate)
+        found = shutil.which('ffmpeg')
+        return os.path.realpath(found) if found else None
+
+    def _identity(self, binary):
+        stat = os.stat(binary)
+        return {'path': binary, 'size': stat.st_size, 'mtime': stat.st_mtime, 'record_version': RECORD_VERSION}
+
+    def _matches(self, record, binary):
+        try:
+            identity = self._identity(binary)
+        except OSError:
+            return False
+        return all(record.get(key) == value for key, value in identity.items())
+
+    def _load_cached(self, binary):
+        try:
+            with open(self.cache_path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return record if self._matches(record, binary) else None
+
+    def _save(self, record):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(record, f, indent=2)
+        os.replace(temp_path, self.cache_path)
+
+    def get(self):
+        """Returns the capability record, or None if no working ffmpeg was found (retried after retry_seconds)."""
+        with self._lock:
+            if self._record is not None and self._matches(self._record, self._record['path']):
+                return self._record
+            if self._failed_at is not None and time.time() - self._failed_at < self.retry_seconds:
+                return None
+
+            binary = self.resolve_binary()
+            if binary is None:
+                return self._fail("ffmpeg not found. Install it, put it on PATH or set FFMPEG_PATH.")
+            record = self._load_cached(binary)
+            if record is None:
+                try:
+                    started = time.perf_counter()
+                    record = dict(self._identity(binary), **probe(binary))
+                    record['probe_seconds'] = round(time.perf_counter() - started, 3)
+                except (OSError, subprocess.TimeoutExpired, RuntimeError) as e:
+                    return self._fail(f"ffmpeg at {binary} could not be validated: {e}")
+                record['probed_at'] = time.time()
+                try:
+                    self._save(record)
+                except OSError as e:
+                    print(f"[FFMPEG CAPABILITIES] Could not write {self.cache_path}: {e}", flush=True)
+                print(f"[FFMPEG CAPABILITIES] Probed {binary}: ffmpeg {record['version']}, {record['features']}", flush=True)
+            self._record = record
+            self._failed_at = None
+            return record
+
+    def _fail(self, message):
+        print(f"[FFMPEG CAPABILITIES] {message}", flush=True)
+        self._record = None
+        self._failed_at = time.time()
+        return None
+
+    def describe(self):
+        # Introspection view: the cached record plus facts about this host that aren't tied to the binary
+        record = self.get()
+        return {
+            'ffmpeg': record,
+            'available': record is not None,
+            'cpu_count': os.cpu_count(),
+            'cache_path': self.cache_path,
+        }
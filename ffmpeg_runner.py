@@ -0,0 +1,77 @@
+import subprocess
+import threading
+import time
+from collections import deque
+
+from instrumentation import FfmpegProgress
+
+# Lines of stderr kept in memory for error reports; the full output only goes to the log file
+STDERR_TAIL_LINES = 200
+
+
+def progress_args():
+    # Machine-readable progress on stdout instead of the human status line on stderr
+    return ['-progress', 'pipe:1', '-nostats']
+
+
+def run_ffmpeg(command, log_filepath, timeout_seconds, duration_seconds=None, on_progress=None, progress_interval=1.0):
+    """Runs an ffmpeg command that includes progress_args() and streams its output as it runs.
+
+    stderr is written straight to log_filepath (only a short tail is kept in memory) and stdout is parsed
+    into progress snapshots: frame, fps, speed, out_time and percent (when duration_seconds is known).
+    on_progress(snapshot) is called at most every progress_interval seconds, and always for the final one.
+    Returns a dict with returncode, timed_out, elapsed, progress (last snapshot) and stderr_tail.
+    """
+    parser = FfmpegProgress(duration_seconds)
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    started = time.perf_counter()
+
+    with open(log_filepath, 'w') as log_file:
+        log_file.write(f"FFMPEG COMMAND: {subprocess.list2cmdline(command)}\n")
+        log_file.flush()
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                                   text=True, errors='replace', bufsize=1)
+
+        def pump_stderr():
+            for line in process.stderr:
+                log_file.write(line)
+                stderr_tail.append(line)
+
+        def pump_progress():
+            last_reported = 0.0
+            for line in process.stdout:
+                snapshot = parser.feed(line)
+                if snapshot is None or on_progress is None:
+                    continue
+                now = time.monotonic()
+                if snapshot['done'] or now - last_reported >= progress_interval:
+                    last_reported = now
+                    try:
+                        on_progress(snapshot)
+                    except Exception as e:
+                        print(f"[FFMPEG] Progress callback failed: {e}", flush=True)
+
+        readers = [threading.Thread(target=pump_stderr, daemon=True), threading.Thread(target=pump_progress, daemon=True)]
+        for reader in readers:
+            reader.start()
+        timed_out = False
+        try:
+            process.wait(timeout=timeout_seconds)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            process.kill()
+            process.wait()
+        for reader in readers:
+            reader.join()
+        elapsed = time.perf_counter() - started
+        if timed_out:
+            log_file.write(f"\n--- TIMEOUT OCCURRED after {timeout_seconds} seconds ---\n")
+        log_file.write(f"FFMPEG process.returncode: {process.returncode}\n")
+
+    return {
+        'returncode': process.returncode,
+        'timed_out': timed_out,
+        'elapsed': round(elapsed, 3),
+        'progress': parser.latest,
+        'stderr_tail': ''.join(stderr_tail),
+    }
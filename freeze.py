@@ -1,10 +1,14 @@
-from flask_frozen import Freezer
+from flask_frozen import Freezer, MissingURLGeneratorWarning
 from app import app
 import os
 import shutil
 import sys
+import warnings
 
-freezer = Freezer(app)
+# Only the pages registered below are published. Frozen-Flask would otherwise freeze every argument-less GET
+# route, including the capability, metrics and stats endpoints that describe the build machine
+freezer = Freezer(app, with_no_argument_rules=False)
+warnings.simplefilter('ignore', MissingURLGeneratorWarning)
 app.config['FREEZER_DESTINATION'] = 'build'
 app.config['FREEZER_RELATIVE_URLS'] = True
 app.config['FREEZER_BASE_URL'] = 'https://tggorton.github.io/vast-to-ctv/'
@@ -0,0 +1,160 @@
+from contextlib import closing, contextmanager
+import sqlite3
+import time
+
+import sqlite_store
+
+# Upper bounds (seconds) of the stage duration histogram buckets; +Inf is implied
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_buckets (
+    stage TEXT NOT NULL,
+    le REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (stage, le)
+);
+CREATE TABLE IF NOT EXISTS stage_totals (
+    stage TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL
+);
+"""
+
+
+class StageTimer:
+    """Collects wall-clock seconds per pipeline stage for one job and reports each one to `observer`."""
+
+    def __init__(self, observer=None):
+        self.observer = observer
+        self.timings = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        # A stage can run more than once per job (e.g. a retried fetch); its time accumulates
+        self.timings[name] = round(self.timings.get(name, 0.0) + seconds, 4)
+        if self.observer:
+            try:
+                self.observer(name, seconds)
+            except sqlite3.Error as e:
+                print(f"[METRICS] Could not record {name} timing: {e}", flush=True)
+
+    def summary(self):
+        return dict(self.timings, total=round(time.perf_counter() - self._started, 4))
+
+
+class StageMetrics:
+    """Stage duration histograms kept in SQLite so every worker process and batch child adds to the same series."""
+
+    def __init__(self, db_path, buckets=DEFAULT_BUCKETS):
+        self.db_path = db_path
+        self.buckets = tuple(sorted(buckets))
+        sqlite_store.initialize(db_path, _SCHEMA)
+
+    def _connect(self):
+        return sqlite_store.connect(self.db_path)
+
+    def observe(self, stage, seconds):
+        # Only the first bucket the value fits in is stored; render() turns them into cumulative counts
+        le = next((bound for bound in self.buckets if seconds <= bound), float('inf'))
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "INSERT INTO stage_buckets (stage, le, count) VALUES (?, ?, 1) "
+                "ON CONFLICT(stage, le) DO UPDATE SET count = count + 1", (stage, le)
+            )
+            conn.execute(
+                "INSERT INTO stage_totals (stage, count, sum) VALUES (?, 1, ?) "
+                "ON CONFLICT(stage) DO UPDATE SET count = count + 1, sum = sum + excluded.sum", (stage, seconds)
+            )
+            conn.execute('COMMIT')
+
+    def snapshot(self):
+        with closing(self._connect()) as conn:
+            buckets = conn.execute("SELECT stage, le, count FROM stage_buckets").fetchall()
+            totals = conn.execute("SELECT stage, count, sum FROM stage_totals ORDER BY stage").fetchall()
+        per_stage = {stage: {'count': count, 'sum': total, 'buckets': {}} for stage, count, total in totals}
+        for stage, le, count in buckets:
+            if stage in per_stage:
+                per_stage[stage]['buckets'][le] = count
+        return per_stage
+
+    def render(self, prefix='vast2ctv'):
+        name = f"{prefix}_stage_duration_seconds"
+        lines = [f"# HELP {name} Wall-clock time spent in each conversion stage.", f"# TYPE {name} histogram"]
+        for stage, data in self.snapshot().items():
+            cumulative = 0
+            for bound in self.buckets + (float('inf'),):
+                cumulative += data['buckets'].get(bound, 0)
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{format_bound(bound)}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {data["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {data["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else f"{bound:g}"
+
+
+def prometheus_metric(name, metric_type, help_text, samples):
+    # samples: [(labels_dict, value)] -> one text-format metric family
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class FfmpegProgress:
+    """Incremental parser for `ffmpeg -progress` output (blocks of key=value lines ending in progress=...)."""
+
+    def __init__(self, duration_seconds=None):
+        self.duration_seconds = duration_seconds
+        self._block = {}
+        self.latest = {}
+
+    def feed(self, line):
+        # Returns a snapshot dict each time a block completes, otherwise None
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        self._block[key] = value.strip()
+        if key != 'progress':
+            return None
+        block, self._block = self._block, {}
+        snapshot = {'done': value.strip() == 'end'}
+        snapshot['frame'] = _number(block.get('frame'), int)
+        snapshot['fps'] = _number(block.get('fps'), float)
+        speed = block.get('speed', '').rstrip('x')
+        snapshot['speed'] = _number(speed, float)
+        # out_time_ms is misnamed and holds microseconds too; prefer out_time_us where available
+        out_time_us = _number(block.get('out_time_us') or block.get('out_time_ms'), int)
+        snapshot['out_time'] = round(out_time_us / 1000000, 3) if out_time_us is not None and out_time_us >= 0 else None
+        if snapshot['out_time'] is None:
+            # ffmpeg reports N/A for a while when one output stream ends early (e.g. -shortest); keep the last value
+            snapshot['out_time'] = self.latest.get('out_time')
+        percent = None
+        if snapshot['done']:
+            percent = 100.0
+        elif self.duration_seconds and snapshot['out_time'] is not None:
+            percent = round(min(100.0, 100.0 * snapshot['out_time'] / self.duration_seconds), 1)
+        snapshot['percent'] = percent
+        self.latest = snapshot
+        return snapshot
+
+
+def _number(value, cast):
+    if value in (None, '', 'N/A'):
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        return None
@@ -0,0 +1,302 @@
+from contextlib import closing
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+import sqlite_store
+
+# Job states stored in the queue table
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    details TEXT,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+"""
+
+
+class JobQueue:
+    """SQLite-backed job queue shared by every process that points at the same db file.
+
+    A finished job keeps its status and result, but not its payload, and is deleted retention_seconds
+    after it finished (see prune()); 0 keeps finished jobs forever.
+    """
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3, retention_seconds=7 * 24 * 3600):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        sqlite_store.initialize(db_path, _SCHEMA)
+        with closing(self._connect()) as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'details' not in columns:
+                # Queues created before live encode details were tracked
+                conn.execute("ALTER TABLE jobs ADD COLUMN details TEXT")
+
+    def _connect(self):
+        return sqlite_store.connect(self.db_path, rows=True)
+
+    def enqueue(self, payload, kind='convert'):
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, stage, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, STATUS_QUEUED, STATUS_QUEUED, json.dumps(payload), time.time())
+            )
+        print(f"[JOBS] Enqueued {kind} job {job_id}", flush=True)
+        return job_id
+
+    def claim(self, worker_id):
+        # BEGIN IMMEDIATE takes the write lock up front so two processes can never claim the same row
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (STATUS_QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, worker = ?, attempts = attempts + 1, "
+                "started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (STATUS_RUNNING, 'starting', worker_id, now, now, row['id'])
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            # A BEGIN IMMEDIATE that timed out on the lock never opened a transaction
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        job = self.get(row['id'])
+        return job
+
+    def update_progress(self, job_id, stage, progress, details=None):
+        # details is stage-specific live data, e.g. fps/speed/percent while ffmpeg encodes
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET stage = ?, progress = ?, details = ?, heartbeat_at = ? WHERE id = ? AND status = ?",
+                (stage, max(0.0, min(1.0, float(progress))), json.dumps(details) if details else None, time.time(),
+                 job_id, STATUS_RUNNING)
+            )
+
+    def heartbeat(self, job_ids):
+        if not job_ids:
+            return
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = ?",
+                [(now, job_id, STATUS_RUNNING) for job_id in job_ids]
+            )
+
+    def complete(self, job_id, result):
+        self._finish(job_id, STATUS_DONE, result, None)
+
+    def fail(self, job_id, error, result=None):
+        self._finish(job_id, STATUS_FAILED, result, error)
+
+    def _finish(self, job_id, status, result, error):
+        # Failed jobs keep the progress they reached so the status endpoint shows where they stopped. The
+        # payload (up to a 30 MB VAST document) is only needed to run the job, so it is dropped here.
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, progress = CASE WHEN ? THEN 1.0 ELSE progress END, "
+                "result = ?, error = ?, finished_at = ?, payload = '{}', details = NULL WHERE id = ?",
+                (status, status, status == STATUS_DONE, json.dumps(result) if result is not None else None,
+                 error, time.time(), job_id)
+            )
+
+    def requeue_stale(self):
+        # Jobs whose worker stopped heartbeating (process restart, OOM kill) go back on the queue
+        cutoff = time.time() - self.lease_seconds
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = 'Exceeded retry limit after worker restarts.', finished_at = ?, payload = '{}' "
+                "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (STATUS_FAILED, time.time(), STATUS_RUNNING, cutoff, self.max_attempts)
+            )
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, progress = 0, worker = NULL WHERE status = ? AND heartbeat_at < ?",
+                (STATUS_QUEUED, STATUS_QUEUED, STATUS_RUNNING, cutoff)
+            )
+            if cursor.rowcount:
+                print(f"[JOBS] Requeued {cursor.rowcount} stale job(s)", flush=True)
+            return cursor.rowcount
+
+    def prune(self):
+        # Deletes jobs that finished more than retention_seconds ago; their outputs are collected by storage GC
+        if not self.retention_seconds:
+            return 0
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                                  (STATUS_DONE, STATUS_FAILED, time.time() - self.retention_seconds))
+        if cursor.rowcount:
+            print(f"[JOBS] Pruned {cursor.rowcount} finished job(s)", flush=True)
+        return cursor.rowcount
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['details'] = json.loads(job['details']) if job['details'] else None
+        return job
+
+    def counts(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+
+def job_status(job):
+    # Public view of a job row, without the (possibly 30 MB) payload
+    return {
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'progress': job['progress'],
+        'details': job['details'],
+        'error': job['error'],
+        'attempts': job['attempts'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+    }
+
+
+def default_worker_count(per_core=0.5, max_workers=None):
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, int(cpu_count * per_core))
+    if max_workers:
+        workers = min(workers, max_workers)
+    return workers
+
+
+class RenderWorkerPool:
+    """Fixed-size pool of threads that claim jobs from a JobQueue and run them through `handler`.
+
+    `handler(job, report_progress)` returns a result dict; a result containing an 'error' key marks the
+    job failed. `report_progress(stage, progress, details=None)` records live status on the job row.
+    The threads mostly wait on ffmpeg subprocesses, so threads (not processes) are enough here.
+    """
+
+    def __init__(self, queue, handler, workers, poll_interval=1.0, heartbeat_interval=30.0):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._started_pid = None
+
+    def start(self):
+        with self._lock:
+            # Threads do not survive fork(), so a pool created before gunicorn forks is restarted per worker
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._threads = []
+            self.queue.requeue_stale()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(f"{os.getpid()}-{index}",),
+                                          name=f"render-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            heartbeat_thread = threading.Thread(target=self._heartbeat, name='render-heartbeat', daemon=True)
+            heartbeat_thread.start()
+            self._threads.append(heartbeat_thread)
+        print(f"[JOBS] Started {self.workers} render worker(s) in pid {os.getpid()}", flush=True)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            with self._lock:
+                in_flight = list(self._in_flight)
+            try:
+                self.queue.heartbeat(in_flight)
+                self.queue.requeue_stale()
+                self.queue.prune()
+            except sqlite3.Error as e:
+                print(f"[JOBS] Heartbeat failed: {e}", flush=True)
+
+    def _run(self, worker_id):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(worker_id)
+            except sqlite3.Error as e:
+                print(f"[JOBS] Worker {worker_id} could not claim a job: {e}", flush=True)
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._process(worker_id, job)
+
+    def _process(self, worker_id, job):
+        job_id = job['id']
+        with self._lock:
+            self._in_flight.add(job_id)
+        print(f"[JOBS] Worker {worker_id} running job {job_id}", flush=True)
+
+        def report_progress(stage, progress, details=None):
+            try:
+                self.queue.update_progress(job_id, stage, progress, details)
+            except sqlite3.Error as e:
+                print(f"[JOBS] Could not record progress for {job_id}: {e}", flush=True)
+
+        try:
+            result = self.handler(job, report_progress)
+            if result and result.get('error'):
+                self.queue.fail(job_id, result['error'], result)
+            else:
+                self.queue.complete(job_id, result or {})
+            print(f"[JOBS] Job {job_id} finished", flush=True)
+        except Exception as e:
+            tb_str = traceback.format_exc()
+            print(tb_str, flush=True)
+            self.queue.fail(job_id, f"An unexpected error occurred: {e}", {'error': f"An unexpected error occurred: {e}"})
+        finally:
+            with self._lock:
+                self._in_flight.discard(job_id)
@@ -0,0 +1,254 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+
+# Layout templates: JSON files describing the frame, its background, the video and QR slots and the text
+# boxes. Relative paths inside a layout (the background image) are resolved against the layout's directory.
+LAYOUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layouts')
+DEFAULT_LAYOUT = 'lbar'
+
+# Fonts tried in order when a layout doesn't list its own
+DEFAULT_FONTS = ('Arial.ttf', 'arial.ttf', 'LiberationSans-Regular.ttf', 'Helvetica.ttc', 'DejaVuSans.ttf')
+
+_COLOR = re.compile(r"^#([0-9a-fA-F]{6})([0-9a-fA-F]{2})?$")
+_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+# Pillow text anchors: horizontal l/m/r, vertical a(scender)/t/m/s/b/d
+_ANCHOR = re.compile(r"^[lmr][atmsbd]$")
+
+
+class LayoutError(Exception):
+    pass
+
+
+class UnknownLayoutError(Exception):
+    pass
+
+
+def _color(value, where):
+    match = _COLOR.match(value) if isinstance(value, str) else None
+    if not match:
+        raise LayoutError(f"{where}: color must be '#RRGGBB' or '#RRGGBBAA', got {value!r}")
+    rgb, alpha = match.groups()
+    return tuple(int(rgb[index:index + 2], 16) for index in (0, 2, 4)) + (int(alpha, 16) if alpha else 255,)
+
+
+def _int(spec, key, where, minimum=0):
+    value = spec.get(key)
+    if not isinstance(value, int) or isinstance(value, bool) or value < minimum:
+        raise LayoutError(f"{where}: '{key}' must be an integer >= {minimum}, got {value!r}")
+    return value
+
+
+def _inside(box, frame, where):
+    x, y, width, height = box
+    if x + width > frame[0] or y + height > frame[1]:
+        raise LayoutError(f"{where}: box {width}x{height} at {x},{y} doesn't fit the {frame[0]}x{frame[1]} frame")
+
+
+class Layout:
+    """A validated layout template. Equal (and hashable) by content, so compiled graphs can be memoized per template."""
+
+    def __init__(self, spec, directory, name=None):
+        if not isinstance(spec, dict):
+            raise LayoutError("Layout must be a JSON object")
+        self.name = spec.get('name') or name
+        if not isinstance(self.name, str) or not _NAME.match(self.name):
+            raise LayoutError(f"Layout name must be letters, digits, '-' or '_', got {self.name!r}")
+        where = f"Layout '{self.name}'"
+        self.description = spec.get('description', '')
+
+        frame = spec.get('frame') or {}
+        self.frame_size = (_int(frame, 'width', f"{where} frame", 2), _int(frame, 'height', f"{where} frame", 2))
+        if self.frame_size[0] % 2 or self.frame_size[1] % 2:
+            # yuv420p output needs even dimensions
+            raise LayoutError(f"{where} frame: width and height must be even, got {self.frame_size[0]}x{self.frame_size[1]}")
+
+        background = spec.get('background') or {}
+        self.background_color = _color(background.get('color', '#000000'), f"{where} background")
+        self.background_image = None
+        if background.get('image'):
+            self.background_image = os.path.normpath(os.path.join(directory, background['image']))
+            if not os.path.isfile(self.background_image):
+                raise LayoutError(f"{where} background: image {self.background_image} not found")
+
+        video = spec.get('video') or {}
+        self.video_box = tuple(_int(video, key, f"{where} video", 1 if key in ('width', 'height') else 0)
+                               for key in ('x', 'y', 'width', 'height'))
+        _inside(self.video_box, self.frame_size, f"{where} video")
+
+        qr = spec.get('qr') or {}
+        self.qr_box = (_int(qr, 'x', f"{where} qr"), _int(qr, 'y', f"{where} qr"), _int(qr, 'size', f"{where} qr", 21))
+        _inside(self.qr_box + (self.qr_box[2],), self.frame_size, f"{where} qr")
+
+        fonts = spec.get('font') or DEFAULT_FONTS
+        self.fonts = tuple([fonts] if isinstance(fonts, str) else fonts)
+
+        self.text_boxes = []
+        for index, box in enumerate(spec.get('text') or []):
+            box_where = f"{where} text[{index}]"
+            if not isinstance(box, dict) or not isinstance(box.get('name'), str) or not _NAME.match(box['name']):
+                raise LayoutError(f"{box_where}: needs a 'name' of letters, digits, '-' or '_'")
+            if any(existing['name'] == box['name'] for existing in self.text_boxes):
+                raise LayoutError(f"{box_where}: duplicate text box name '{box['name']}'")
+            position = (_int(box, 'x', box_where), _int(box, 'y', box_where))
+            if position[0] >= self.frame_size[0] or position[1] >= self.frame_size[1]:
+                raise LayoutError(f"{box_where}: position {position[0]},{position[1]} is outside the frame")
+            anchor = box.get('anchor', 'la')
+            if not isinstance(anchor, str) or not _ANCHOR.match(anchor):
+                raise LayoutError(f"{box_where}: anchor must be a Pillow text anchor such as 'la', got {anchor!r}")
+            max_chars = box.get('max_chars')
+            if max_chars is not None:
+                max_chars = _int(box, 'max_chars', box_where, 4)
+            box_fonts = box.get('font') or self.fonts
+            self.text_boxes.append({
+                'name': box['name'],
+                'position': position,
+                'size': _int(box, 'size', box_where, 1),
+                'color': _color(box.get('color', '#FFFFFF'), box_where),
+                'anchor': anchor,
+                'max_chars': max_chars,
+                'text': box.get('text'),
+                'fonts': tuple([box_fonts] if isinstance(box_fonts, str) else box_fonts),
+            })
+
+        # Canonical form of the template; background changes on disk are picked up by the plate key
+        self.digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def __eq__(self, other):
+        return isinstance(other, Layout) and other.digest == self.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __repr__(self):
+        return f"Layout({self.name!r}, {self.digest[:12]})"
+
+    def scaled_video_box(self, output_size):
+        # The video slot scaled from the layout's frame to another output frame size. Every edge lands on an
+        # even pixel: pad moves yuv420p video to even offsets, and the plate's window has to match it exactly
+        scale_x, scale_y = output_size[0] / self.frame_size[0], output_size[1] / self.frame_size[1]
+        x, y, width, height = self.video_box
+        return tuple(2 * round(value * scale / 2)
+                     for value, scale in ((x, scale_x), (y, scale_y), (width, scale_x), (height, scale_y)))
+
+    def texts(self, values):
+        """Returns [(text_box, text)] for drawing: per-render values by box name, else the box's static text.
+
+        Text longer than a box's max_chars is cut to fit with a trailing '...'.
+        """
+        resolved = []
+        for box in self.text_boxes:
+            text = values.get(box['name'])
+            if text is None:
+                text = box['text']
+            if text is None:
+                raise LayoutError(f"Layout '{self.name}': no text given for the '{box['name']}' box")
+            if box['max_chars'] and len(text) > box['max_chars']:
+                text = text[:box['max_chars'] - 3] + "..."
+            resolved.append((box, text))
+        return resolved
+
+
+def load_layout(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+    except json.JSONDecodeError as e:
+        raise LayoutError(f"{path}: invalid JSON: {e}")
+    return Layout(spec, os.path.dirname(os.path.abspath(path)), name=os.path.splitext(os.path.basename(path))[0])
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def available_layouts(directory=LAYOUTS_DIR):
+    return sorted(os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(directory, '*.json')))
+
+
+def get_layout(name=None, directory=LAYOUTS_DIR):
+    """Returns the Layout for a template name: <directory>/<name>.json.
+
+    Layouts are parsed and validated once and reused until the file's mtime changes. Names never contain
+    path separators, so a name taken from a request can't point outside `directory`.
+    """
+    name = name or DEFAULT_LAYOUT
+    path = os.path.join(directory, f"{name}.json")
+    try:
+        if not _NAME.match(name):
+            raise FileNotFoundError(path)
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        raise UnknownLayoutError(f"Unknown layout '{name}'. Available layouts: {', '.join(available_layouts(directory))}")
+    with _cache_lock:
+        cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    layout = load_layout(path)
+    with _cache_lock:
+        _cache[path] = (mtime, layout)
+    return layout
+
+
+def _video_chain(layout, output_size, scale_video, fps=None):
+    # [fps ->] scale -> pad -> setsar filters that put the ad video into the layout's slot on an output-size frame
+    output_size = tuple(output_size)
+    if len(output_size) != 2 or any(not isinstance(value, int) or value <= 0 or value % 2 for value in output_size):
+        raise LayoutError(f"Output size must be two positive even integers, got {output_size!r}")
+    video_x, video_y, video_width, video_height = layout.scaled_video_box(output_size)
+    if video_width < 2 or video_height < 2:
+        raise LayoutError(f"Layout '{layout.name}': the video slot vanishes at {output_size[0]}x{output_size[1]}")
+    if video_x + video_width > output_size[0] or video_y + video_height > output_size[1]:
+        # Rounding while scaling can push the slot a pixel past the edge, which pad rejects at encode time
+        raise LayoutError(f"Layout '{layout.name}': the video slot doesn't fit a {output_size[0]}x{output_size[1]} frame")
+    scale = f"scale={video_width}:{video_height}," if scale_video else ""
+    frame_rate = f"fps={fps}," if fps else ""
+    return f"{frame_rate}{scale}pad={output_size[0]}:{output_size[1]}:{video_x}:{video_y},setsar=1"
+
+
+@lru_cache(maxsize=256)
+def compile_filter_graph(layout, output_size, scale_video=True, video_input=0, plate_input=1, fps=None):
+    """Compiles a layout into the ffmpeg filter graph for one output size.
+
+    Everything static (background, QR, text) is pre-drawn into the plate image, so the graph only scales
+    the ad into its slot, pads it to the full frame and overlays the plate. scale_video=False skips the
+    scaler when the source already has the slot's exact size. setsar=1 keeps square pixels: the slot isn't
+    exactly 16:9, and scale would otherwise adjust the SAR to preserve the DAR. `fps` drops a faster source
+    to the output rate before anything else runs. The result is memoized per (layout, size, inputs), so
+    renders of the same template never rebuild it, and it is passed to ffmpeg inline rather than through a
+    script file.
+    """
+    return (
+        f"[{video_input}:v]{_video_chain(layout, output_size, scale_video, fps)}[padded_ad_video];"
+        f"[padded_ad_video][{plate_input}:v]overlay=x=0:y=0[final_output]"
+    )
+
+
+@lru_cache(maxsize=256)
+def compile_variant_graph(branches, video_input=0, first_plate_input=1):
+    """Compiles several (layout, output_size, scale_video, fps) outputs into one graph over a single decode.
+
+    The ad video is decoded once and split per distinct slot; variants that only differ in their plate
+    (CTA text, QR code) also share the scale and pad, and split again just before their overlays. Variant
+    i overlays plate input first_plate_input + i and ends in [variant_<i>].
+    """
+    groups = {}
+    for index, (layout, output_size, scale_video, fps) in enumerate(branches):
+        chain = _video_chain(layout, output_size, scale_video, fps)
+        groups.setdefault(chain, []).append(index)
+
+    graph = []
+    if len(groups) > 1:
+        graph.append(f"[{video_input}:v]split={len(groups)}" + ''.join(f"[slot_{g}]" for g in range(len(groups))))
+    for g, (chain, indexes) in enumerate(groups.items()):
+        source = f"[slot_{g}]" if len(groups) > 1 else f"[{video_input}:v]"
+        if len(indexes) > 1:
+            chain += f",split={len(indexes)}"
+        graph.append(source + chain + ''.join(f"[padded_{index}]" for index in indexes))
+    for index in range(len(branches)):
+        graph.append(f"[padded_{index}][{first_plate_input + index}:v]overlay=x=0:y=0[variant_{index}]")
+    return ';'.join(graph)
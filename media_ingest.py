@@ -0,0 +1,284 @@
+from contextlib import closing, contextmanager
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import sqlite_store
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+# ISO BMFF box types that can open an MP4/MOV file
+_MP4_LEADING_BOXES = {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    etag TEXT,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+class MediaIngestError(Exception):
+    pass
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    """Downloads MediaFiles into a content-addressed local cache so ffmpeg reads them from disk.
+
+    Downloads stream in chunks to a .part file and resume with a Range request (guarded by If-Range)
+    after an interruption. Finished files are checked against Content-Length / Content-MD5 and the MP4
+    box header, then stored under their SHA-256. The cache is bounded by total size with LRU eviction;
+    files fetched within grace_seconds are never evicted, since another render may be about to read them.
+    """
+
+    def __init__(self, directory, db_path, max_bytes, session=None, chunk_size=1024 * 1024, timeout_seconds=30,
+                 grace_seconds=3600):
+        self.directory = directory
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.chunk_size = chunk_size
+        self.timeout_seconds = timeout_seconds
+        self.session = session or requests.Session()
+        if session is None:
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(os.path.join(directory, 'partial'), exist_ok=True)
+        sqlite_store.initialize(db_path, _SCHEMA)
+
+    def _connect(self):
+        return sqlite_store.connect(self.db_path)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], f"{sha256}.mp4")
+
+    @contextmanager
+    def _url_lock(self, url_key):
+        # Threads in this process share a lock object; other processes are kept out with flock
+        with self._locks_guard:
+            lock = self._locks.setdefault(url_key, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, 'partial', f"{url_key}.lock"), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _lookup(self, url):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT sha256 FROM urls WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(self.blob_path(row[0])):
+                conn.execute("DELETE FROM urls WHERE url = ?", (url,))
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (row[0],))
+                return None
+            conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), row[0]))
+        return row[0]
+
+    def cached(self, url):
+        # True when fetch() won't download anything: a local path, or a URL whose file is already in the cache
+        return not url.startswith(('http://', 'https://')) or self._lookup(url) is not None
+
+    def fetch(self, url, progress=None):
+        """Returns (local_path, sha256) for a MediaFile URL, downloading it if it isn't cached yet.
+
+        Local paths are passed through (and hashed) unchanged. `progress(bytes_done, total_bytes)` is
+        called while downloading; total_bytes is None when the server doesn't send a length.
+        """
+        if not url.startswith(('http://', 'https://')):
+            if not os.path.isfile(url):
+                raise MediaIngestError(f"MediaFile not found: {url}")
+            return url, file_sha256(url)
+
+        sha256 = self._lookup(url)
+        if sha256:
+            print(f"[MEDIA] Cache hit for {url} -> {sha256[:12]}", flush=True)
+            return self.blob_path(sha256), sha256
+
+        url_key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+        with self._url_lock(url_key):
+            # Another worker may have finished the same download while we waited for the lock
+            sha256 = self._lookup(url)
+            if sha256:
+                return self.blob_path(sha256), sha256
+            sha256, etag = self._download(url, url_key, progress)
+            self._store(url, sha256, etag)
+        self.evict(keep=sha256)
+        return self.blob_path(sha256), sha256
+
+    def _download(self, url, url_key, progress):
+        part_path = os.path.join(self.directory, 'partial', f"{url_key}.part")
+        meta_path = os.path.join(self.directory, 'partial', f"{url_key}.json")
+        meta = {}
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) and meta.get('url') == url else 0
+
+        headers = {}
+        if offset and meta.get('validator'):
+            # If-Range makes the server send the whole file again if it changed since the partial download
+            headers['Range'] = f"bytes={offset}-"
+            headers['If-Range'] = meta['validator']
+        else:
+            offset = 0
+
+        started = time.time()
+        try:
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout_seconds) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    offset = 0
+                else:
+                    print(f"[MEDIA] Resuming {url} at byte {offset}", flush=True)
+                total = self._expected_size(response, offset)
+                validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                with open(meta_path, 'w') as f:
+                    json.dump({'url': url, 'validator': validator}, f)
+
+                digest = hashlib.sha256()
+                if offset:
+                    with open(part_path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                            digest.update(chunk)
+                done = offset
+                with open(part_path, 'ab' if offset else 'wb') as out:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        if not chunk:
+                            continue
+                        out.write(chunk)
+                        digest.update(chunk)
+                        done += len(chunk)
+                        if progress:
+                            progress(done, total)
+                content_md5 = response.headers.get('Content-MD5') if response.status_code == 200 else None
+                etag = response.headers.get('ETag')
+        except requests.RequestException as e:
+            # The .part file and its validator stay behind so the next attempt can resume
+            raise MediaIngestError(f"Error downloading MediaFile {url}: {e}")
+
+        self._verify(part_path, done, total, content_md5)
+        sha256 = digest.hexdigest()
+        blob_path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(part_path, blob_path)
+        os.remove(meta_path)
+        elapsed = time.time() - started
+        print(f"[MEDIA] Downloaded {url} ({done} bytes in {elapsed:.2f}s) -> {sha256[:12]}", flush=True)
+        return sha256, etag
+
+    def _expected_size(self, response, offset):
+        if response.status_code == 206:
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            return int(total) if total.isdigit() else None
+        length = response.headers.get('Content-Length')
+        # requests transparently decompresses gzip, so a Content-Length of the encoded body can't be checked
+        if length and length.isdigit() and not response.headers.get('Content-Encoding'):
+            return int(length)
+        return None
+
+    def _verify(self, part_path, size, expected_size, content_md5):
+        def reject(reason):
+            os.remove(part_path)
+            raise MediaIngestError(reason)
+
+        if expected_size is not None and size != expected_size:
+            # A short read keeps the partial file for a resume; anything else is corrupt
+            if size < expected_size:
+                raise MediaIngestError(f"MediaFile download incomplete: got {size} of {expected_size} bytes")
+            reject(f"MediaFile download is larger than announced: {size} > {expected_size} bytes")
+        if size < 8:
+            reject("MediaFile download is empty")
+        with open(part_path, 'rb') as f:
+            header = f.read(8)
+        if header[4:8] not in _MP4_LEADING_BOXES:
+            reject("MediaFile is not an MP4 container")
+        if content_md5:
+            digest = hashlib.md5()
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    digest.update(chunk)
+            if base64.b64encode(digest.digest()).decode('ascii') != content_md5:
+                reject("MediaFile failed its Content-MD5 check")
+
+    def _store(self, url, sha256, etag):
+        size = os.path.getsize(self.blob_path(sha256))
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO blobs (sha256, size, created_at, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(sha256) DO UPDATE SET last_access = excluded.last_access",
+                (sha256, size, now, now)
+            )
+            conn.execute("INSERT OR REPLACE INTO urls (url, sha256, etag, fetched_at) VALUES (?, ?, ?, ?)",
+                         (url, sha256, etag, now))
+
+    def evict(self, keep=None):
+        removed = 0
+        with closing(self._connect()) as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            for sha256, size in conn.execute("SELECT sha256, size FROM blobs WHERE last_access < ? ORDER BY last_access",
+                                             (time.time() - self.grace_seconds,)).fetchall():
+                if total <= self.max_bytes:
+                    break
+                if sha256 == keep:
+                    continue
+                try:
+                    os.remove(self.blob_path(sha256))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"[MEDIA] Error removing cached media {sha256}: {e}", flush=True)
+                    continue
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                conn.execute("DELETE FROM urls WHERE sha256 = ?", (sha256,))
+                total -= size
+                removed += 1
+        if removed:
+            print(f"[MEDIA] Evicted {removed} cached media file(s) to stay under {self.max_bytes} bytes", flush=True)
+        return removed
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {'entries': entries, 'bytes': total, 'max_bytes': self.max_bytes}
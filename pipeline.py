@@ -0,0 +1,888 @@
+"""The VAST -> L-Bar conversion pipeline, usable without the web app.
+
+    import pipeline
+    ad = pipeline.parse_vast_ad(pipeline.load_vast(source))   # parse
+    final_url = pipeline.get_final_destination(ad['raw_clickthrough_url'])   # resolve
+    result = pipeline.render_ad(ad, final_resolved_url=final_url)   # compose + encode
+    result = pipeline.convert(source)   # all of the above for one VAST URL, file or XML string
+
+Results are the dicts the web app renders: a dict with an 'error' key is a failed conversion, otherwise
+'output_filename' names the MP4 relative to GENERATED_FOLDER (artifacts.path() gives the full path).
+Settings come from the environment (see README) and are read once, on import, into `config`. Flask is
+never imported; qrcode and Pillow are imported only when a QR image or plate is actually drawn.
+"""
+import contextlib
+import functools
+import os
+import re
+import shlex
+import shutil
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote, urlparse, parse_qs
+
+from werkzeug.utils import secure_filename
+
+import batch
+import compositor
+import encoder_profiles
+import ffmpeg_runner
+import instrumentation
+import jobs
+import render_cache
+import segmented_encode
+import vast_parser
+from click_resolver import ClickResolver
+from ffmpeg_capabilities import FfmpegCapabilities
+from layout import LayoutError, UnknownLayoutError, compile_filter_graph, compile_variant_graph, get_layout
+from media_ingest import MediaCache, MediaIngestError
+from preflight import Preflight, PreflightError
+from render_cache import RenderCache
+from qr_codes import QrCodeCache
+from storage import ArtifactStore
+from vast_resolver import VastResolver, VastResolutionError, TagCache
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATED_FOLDER = os.environ.get('GENERATED_FOLDER', os.path.join(APP_DIR, 'generated'))
+
+config = {'GENERATED_FOLDER': GENERATED_FOLDER}
+
+# Render workers are sized per CPU core, and FFmpeg threads are split across the workers
+config['RENDER_WORKERS_PER_CORE'] = float(os.environ.get('RENDER_WORKERS_PER_CORE', 0.5))
+config['MAX_RENDER_WORKERS'] = int(os.environ.get('MAX_RENDER_WORKERS', 0)) or None
+config['RENDER_WORKERS'] = jobs.default_worker_count(config['RENDER_WORKERS_PER_CORE'], config['MAX_RENDER_WORKERS'])
+config['FFMPEG_THREADS'] = max(1, (os.cpu_count() or 1) // config['RENDER_WORKERS'])
+# ffmpeg is located and probed once; the record is cached on disk until the binary changes
+config['FFMPEG_PATH'] = os.environ.get('FFMPEG_PATH')
+config['FFMPEG_CAPABILITIES_PATH'] = os.environ.get('FFMPEG_CAPABILITIES_PATH', os.path.join(GENERATED_FOLDER, 'ffmpeg_capabilities.json'))
+config['FFMPEG_TIMEOUT'] = float(os.environ.get('FFMPEG_TIMEOUT', 120))
+config['FFMPEG_LOGLEVEL'] = os.environ.get('FFMPEG_LOGLEVEL', 'info')
+
+# Sources at least this long are split into GOP-aligned segments encoded by parallel ffmpeg processes, one
+# per core available to the render worker (single-threaded filter graphs otherwise leave cores idle)
+config['SEGMENTED_ENCODE_MIN_DURATION'] = float(os.environ.get('SEGMENTED_ENCODE_MIN_DURATION', 20))
+config['SEGMENT_WORKERS'] = int(os.environ.get('SEGMENT_WORKERS', 0)) or config['FFMPEG_THREADS']
+
+# Per-stage wall-clock timings are aggregated into histograms for GET /metrics (Prometheus text format)
+config['METRICS_DB_PATH'] = os.environ.get('METRICS_DB_PATH', os.path.join(GENERATED_FOLDER, 'metrics.sqlite3'))
+
+# Batch conversions fan renders out across a process pool of this size
+config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', 0)) or config['RENDER_WORKERS']
+
+# VAST wrapper resolution: chains are followed up to this depth with a pooled session and a tag cache
+config['VAST_WRAPPER_MAX_DEPTH'] = int(os.environ.get('VAST_WRAPPER_MAX_DEPTH', 5))
+config['VAST_FETCH_TIMEOUT'] = float(os.environ.get('VAST_FETCH_TIMEOUT', 10))
+config['VAST_FETCH_WORKERS'] = int(os.environ.get('VAST_FETCH_WORKERS', 8))
+config['VAST_TAG_CACHE_ENTRIES'] = int(os.environ.get('VAST_TAG_CACHE_ENTRIES', 512))
+
+# Click-through resolution: intermediate -> final URL mappings are cached in memory and on disk
+config['CLICK_CACHE_DB_PATH'] = os.environ.get('CLICK_CACHE_DB_PATH', os.path.join(GENERATED_FOLDER, 'click_cache.sqlite3'))
+config['CLICK_CACHE_TTL'] = int(os.environ.get('CLICK_CACHE_TTL', 6 * 3600))
+config['CLICK_RESOLVE_TIMEOUT'] = float(os.environ.get('CLICK_RESOLVE_TIMEOUT', 10))
+
+# Render cache: finished MP4s are indexed by a hash of media + click URL + brand + filter graph/encoder settings
+config['RENDER_CACHE_ENABLED'] = os.environ.get('RENDER_CACHE_ENABLED', '1') != '0'
+config['RENDER_CACHE_DB_PATH'] = os.environ.get('RENDER_CACHE_DB_PATH', os.path.join(GENERATED_FOLDER, 'render_cache.sqlite3'))
+config['RENDER_CACHE_MAX_BYTES'] = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+
+# Encoder profile used when a request doesn't name one (see encoder_profiles.PROFILES)
+config['ENCODER_PROFILE'] = os.environ.get('ENCODER_PROFILE', encoder_profiles.DEFAULT_PROFILE)
+
+# Variant sets: one decode of the creative feeds up to this many outputs in a single ffmpeg process
+config['MAX_VARIANTS'] = int(os.environ.get('MAX_VARIANTS', 8))
+
+# Layout template used when a request doesn't name one: <LAYOUTS_DIR>/<LAYOUT>.json (see layout.py)
+config['LAYOUTS_DIR'] = os.environ.get('LAYOUTS_DIR', os.path.join(APP_DIR, 'layouts'))
+config['LAYOUT'] = os.environ.get('LAYOUT', 'lbar')
+
+# Media ingest: MediaFiles are downloaded once into a content-addressed cache and ffmpeg reads them from disk
+config['MEDIA_CACHE_DIR'] = os.environ.get('MEDIA_CACHE_DIR', os.path.join(GENERATED_FOLDER, 'media'))
+config['MEDIA_CACHE_DB_PATH'] = os.environ.get('MEDIA_CACHE_DB_PATH', os.path.join(GENERATED_FOLDER, 'media_cache.sqlite3'))
+config['MEDIA_CACHE_MAX_BYTES'] = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+config['MEDIA_DOWNLOAD_TIMEOUT'] = float(os.environ.get('MEDIA_DOWNLOAD_TIMEOUT', 30))
+
+# Preflight: creatives are probed once per content hash and rejected before encoding when they can't make a usable ad
+config['PREFLIGHT_DB_PATH'] = os.environ.get('PREFLIGHT_DB_PATH', os.path.join(GENERATED_FOLDER, 'preflight.sqlite3'))
+config['PREFLIGHT_MIN_DURATION'] = float(os.environ.get('PREFLIGHT_MIN_DURATION', 0.5))
+config['PREFLIGHT_MAX_DURATION'] = float(os.environ.get('PREFLIGHT_MAX_DURATION', 300))
+config['PREFLIGHT_REQUIRE_AUDIO'] = os.environ.get('PREFLIGHT_REQUIRE_AUDIO', '0') != '0'
+# Seconds ffmpeg may spend reading a MediaFile's header over HTTP before the download starts
+config['PREFLIGHT_PROBE_TIMEOUT'] = float(os.environ.get('PREFLIGHT_PROBE_TIMEOUT', 10))
+
+# Plates (the pre-drawn static layers) are cached by their inputs in an LRU bounded by total size
+config['PLATE_CACHE_DIR'] = os.environ.get('PLATE_CACHE_DIR', os.path.join(GENERATED_FOLDER, 'plates'))
+config['PLATE_CACHE_DB_PATH'] = os.environ.get('PLATE_CACHE_DB_PATH', os.path.join(GENERATED_FOLDER, 'plate_cache.sqlite3'))
+config['PLATE_CACHE_MAX_BYTES'] = int(os.environ.get('PLATE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Artifact storage: each job writes into its own workspace; idle workspaces are garbage collected
+config['STORAGE_DB_PATH'] = os.environ.get('STORAGE_DB_PATH', os.path.join(GENERATED_FOLDER, 'storage.sqlite3'))
+config['STORAGE_MAX_BYTES'] = int(os.environ.get('STORAGE_MAX_BYTES', 20 * 1024 * 1024 * 1024))
+config['STORAGE_MAX_AGE'] = int(os.environ.get('STORAGE_MAX_AGE', 7 * 24 * 3600))
+config['STORAGE_GRACE_SECONDS'] = int(os.environ.get('STORAGE_GRACE_SECONDS', 3600))
+config['STORAGE_GC_INTERVAL'] = int(os.environ.get('STORAGE_GC_INTERVAL', 600))
+
+# QR codes: rendered at the default layout's QR box size so they are pasted without resampling
+config['QR_CACHE_DIR'] = os.environ.get('QR_CACHE_DIR', os.path.join(GENERATED_FOLDER, 'qr'))
+config['QR_CACHE_DB_PATH'] = os.environ.get('QR_CACHE_DB_PATH', os.path.join(GENERATED_FOLDER, 'qr_cache.sqlite3'))
+config['QR_SIZE'] = int(os.environ.get('QR_SIZE', 0)) or get_layout(config['LAYOUT'], config['LAYOUTS_DIR']).qr_box[2]
+config['QR_ERROR_CORRECTION'] = os.environ.get('QR_ERROR_CORRECTION', 'M').upper()
+config['QR_BORDER'] = int(os.environ.get('QR_BORDER', 4))
+config['QR_CACHE_MEMORY_ENTRIES'] = int(os.environ.get('QR_CACHE_MEMORY_ENTRIES', 256))
+config['QR_CACHE_MAX_ENTRIES'] = int(os.environ.get('QR_CACHE_MAX_ENTRIES', 10000))
+
+os.makedirs(GENERATED_FOLDER, exist_ok=True)
+
+# What a variant may change relative to the ad: output profile, layout, CTA text and click destination (with its QR code)
+VARIANT_OPTIONS = ('name', 'profile', 'layout', 'cta', 'click_url')
+
+
+class VariantError(Exception):
+    pass
+
+
+ffmpeg_tools = FfmpegCapabilities(config['FFMPEG_CAPABILITIES_PATH'], config['FFMPEG_PATH'])
+vast_tags = VastResolver(cache=TagCache(config['VAST_TAG_CACHE_ENTRIES']), max_depth=config['VAST_WRAPPER_MAX_DEPTH'],
+                         timeout_seconds=config['VAST_FETCH_TIMEOUT'], max_workers=config['VAST_FETCH_WORKERS'])
+click_urls = ClickResolver(config['CLICK_CACHE_DB_PATH'], ttl_seconds=config['CLICK_CACHE_TTL'],
+                           timeout_seconds=config['CLICK_RESOLVE_TIMEOUT'])
+stage_metrics = instrumentation.StageMetrics(config['METRICS_DB_PATH'])
+media_files = MediaCache(config['MEDIA_CACHE_DIR'], config['MEDIA_CACHE_DB_PATH'], config['MEDIA_CACHE_MAX_BYTES'],
+                         timeout_seconds=config['MEDIA_DOWNLOAD_TIMEOUT'], grace_seconds=config['STORAGE_GRACE_SECONDS'])
+media_preflight = Preflight(config['PREFLIGHT_DB_PATH'], min_duration=config['PREFLIGHT_MIN_DURATION'],
+                            max_duration=config['PREFLIGHT_MAX_DURATION'], require_audio=config['PREFLIGHT_REQUIRE_AUDIO'])
+artifacts = ArtifactStore(GENERATED_FOLDER, config['STORAGE_DB_PATH'], config['STORAGE_MAX_BYTES'],
+                          config['STORAGE_MAX_AGE'], grace_seconds=config['STORAGE_GRACE_SECONDS'],
+                          gc_interval=config['STORAGE_GC_INTERVAL'])
+qr_images = QrCodeCache(config['QR_CACHE_DIR'], config['QR_CACHE_DB_PATH'], size=config['QR_SIZE'],
+                        error_correction=config['QR_ERROR_CORRECTION'], border=config['QR_BORDER'],
+                        memory_entries=config['QR_CACHE_MEMORY_ENTRIES'], max_entries=config['QR_CACHE_MAX_ENTRIES'])
+plate_images = compositor.PlateCache(config['PLATE_CACHE_DIR'], config['PLATE_CACHE_DB_PATH'], config['PLATE_CACHE_MAX_BYTES'],
+                                     grace_seconds=config['STORAGE_GRACE_SECONDS'])
+render_outputs = RenderCache(config['RENDER_CACHE_DB_PATH'], GENERATED_FOLDER, config['RENDER_CACHE_MAX_BYTES'],
+                             on_evict=artifacts.discard)
+
+
+def get_ffmpeg_path():
+    # Served from the capability record, so a conversion costs a stat() of the binary rather than a subprocess
+    capabilities = ffmpeg_tools.get()
+    return capabilities['path'] if capabilities else None
+
+def extract_brand_name(ad_title):
+    if not ad_title:
+        return "Default Brand"
+    match_omd = re.search(r"_OMD_([^_]+)_", ad_title, re.IGNORECASE)
+    if match_omd:
+        return match_omd.group(1)
+    parts = ad_title.split('_')
+    if len(parts) > 1:
+        if len(parts[1]) > 2:
+            return parts[1]
+    potential_brands = [p for p in parts if len(p) > 3 and p[0].isupper()]
+    if potential_brands:
+        return potential_brands[0]
+    return ad_title.split('(')[0].strip()
+
+def extract_click_url(clickthrough_url):
+    if not clickthrough_url: return None
+    try:
+        parsed = urlparse(clickthrough_url)
+        query_params = parse_qs(parsed.query)
+        click_url_list = query_params.get('click', [])
+        if click_url_list:
+            click_url = click_url_list[0]
+            return unquote(click_url)
+        for key in ['u', 'url', 'redirect_url', 'destination_url', 'finalUrl', 'targetUrl', 'goto']:
+            dest_url_list = query_params.get(key, [])
+            if dest_url_list:
+                return unquote(dest_url_list[0])
+    except Exception as e:
+        print(f"Error parsing or extracting click URL from {clickthrough_url}: {e}", flush=True)
+    return None
+
+def resolve_final_url(url):
+    return click_urls.resolve(url)
+
+def get_final_destination(clickthrough_url):
+    if not clickthrough_url:
+        return clickthrough_url
+    print(f"Original ClickThrough: {clickthrough_url}", flush=True)
+    intermediate_url = extract_click_url(clickthrough_url)
+
+    if intermediate_url:
+        print(f"Extracted intermediate URL: {intermediate_url}", flush=True)
+        final_url = resolve_final_url(intermediate_url)
+        if final_url and final_url != intermediate_url:
+            print(f"Resolved final URL: {final_url}", flush=True)
+            return final_url
+        else:
+            print(f"Failed to resolve intermediate URL or no change, returning intermediate: {intermediate_url}", flush=True)
+            return intermediate_url
+    else:
+        print(f"No intermediate URL extracted, trying to resolve original: {clickthrough_url}", flush=True)
+        final_url = resolve_final_url(clickthrough_url)
+        if final_url and final_url != clickthrough_url:
+            print(f"Resolved original to final URL: {final_url}", flush=True)
+            return final_url
+        else:
+            print(f"Failed to resolve or no change from original, returning original: {clickthrough_url}", flush=True)
+            return clickthrough_url
+
+def get_final_destinations(clickthrough_urls):
+    # Batch form of get_final_destination: every distinct redirect is resolved once, concurrently
+    targets = {url: extract_click_url(url) or url for url in clickthrough_urls if url}
+    resolved = click_urls.resolve_many(targets.values())
+    return {url: resolved.get(target) or target for url, target in targets.items()}
+
+def fetch_vast_content(payload, report_progress):
+    # Returns (vast_content, error_context) for a job payload holding either raw XML or a VAST URL.
+    # Wrappers are left in place: the parse finds them, and only then is the chain followed (resolve_vast_wrappers).
+    vast_content = payload.get('vast_content') or ""
+    vast_input = payload.get('vast_input', '').strip()
+
+    if not vast_content and vast_input:
+        if vast_input.startswith(('http://', 'https://')):
+            report_progress('fetching_vast', 0.05)
+            try:
+                return vast_tags.fetch_document(vast_input), None
+            except VastResolutionError as e:
+                return None, {'error': str(e)}
+        vast_content = vast_input
+
+    if not vast_content:
+        return None, {'error': "No VAST content provided or file type not allowed."}
+    return vast_content, None
+
+def resolve_vast_wrappers(vast_content):
+    # Returns (vast_content, error_context) with every wrapper chain in the document followed to its InLine ad
+    try:
+        return vast_tags.resolve_document(vast_content), None
+    except VastResolutionError as e:
+        return None, {'error': f"Error resolving VAST wrapper: {e}", 'vast_content_snippet': vast_content[:1000]}
+
+def load_layout(name=None):
+    # Layouts are validated once and cached until their file changes, so this is cheap per render
+    return get_layout(name or config['LAYOUT'], config['LAYOUTS_DIR'])
+
+def load_vast(source):
+    # A VAST URL, a path to a VAST file, or raw VAST XML, with any wrapper chain followed
+    source = source.strip()
+    if source.startswith(('http://', 'https://')):
+        return vast_tags.resolve_url(source)
+    return vast_tags.resolve_document(batch.load_source(source))
+
+def parse_vast_ad(vast_content, profile=None, layout=None):
+    # Extracts the fields the render needs from a single-ad VAST document. Raises ET.ParseError on bad XML;
+    # a returned dict with an 'error' key means the document parsed but can't be converted.
+    if profile is None:
+        profile = encoder_profiles.get_profile(config['ENCODER_PROFILE'])
+    if layout is None:
+        layout = load_layout()
+    document = vast_parser.parse_vast(vast_content, max_ads=1)
+    vast_ad = document.ads[0] if document.ads else vast_parser.VastAd({}, document.version)
+    if vast_ad.kind == 'wrapper':
+        # The caller follows the chain (resolve_vast_wrappers) and parses the resolved document again
+        return {'error': "The VAST ad is a wrapper that hasn't been resolved to an InLine ad.",
+                'wrapper_uri': vast_ad.wrapper_uri, 'vast_content_snippet': vast_content[:1000]}
+    ad_title = vast_ad.ad_title or "Untitled Ad"
+    brand_name = extract_brand_name(ad_title)
+
+    # Prefer the smallest rendition that still fills the video slot at the profile's output size
+    media_file = encoder_profiles.select_media_file(encoder_profiles.media_file_candidates(vast_ad.media_files),
+                                                    layout.scaled_video_box(profile['size'])[2:])
+    media_file_url = media_file['url'] if media_file else None
+    if not media_file_url:
+        return {'error': "Could not find a suitable MP4 MediaFile in VAST.", 'vast_content_snippet': vast_content[:1000]}
+
+    raw_clickthrough_url = vast_ad.click_through
+    if not raw_clickthrough_url and vast_ad.click_trackings:
+        raw_clickthrough_url = vast_ad.click_trackings[0]
+        print(f"Found ClickTracking as fallback: {raw_clickthrough_url}", flush=True)
+
+    if not raw_clickthrough_url:
+        return {'error': "Could not find ClickThrough or ClickTracking URL in VAST.", 'ad_title': ad_title, 'brand_name': brand_name,
+                'media_file_url': media_file_url, 'vast_content_snippet': vast_content[:1000]}
+
+    return {
+        'ad_title': ad_title,
+        'brand_name': brand_name,
+        'media_file_url': media_file_url,
+        'raw_clickthrough_url': raw_clickthrough_url,
+        'vast_content_snippet': vast_content[:1000],
+    }
+
+def generate_qr_code(url, qr_filename="qrcode.png", workspace=None):
+    # Returns the QR image's path relative to GENERATED_FOLDER, inside the given (or a new) workspace
+    qr_filename = f"{workspace or artifacts.workspace()}/{qr_filename}"
+    cached_path = qr_images.get(url)
+    qr_filepath = artifacts.path(qr_filename)
+    # A hard link gives the job its own copy (it survives QR cache eviction) without writing the bytes again
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(qr_filepath)
+    try:
+        os.link(cached_path, qr_filepath)
+    except OSError:
+        shutil.copyfile(cached_path, qr_filepath)
+    return artifacts.add(qr_filename, 'qr')
+
+def display_url(raw_clickthrough_url, final_resolved_url):
+    # The URL shown under the brand: the resolved destination when there is one, without the scheme
+    url_for_display_text = final_resolved_url if final_resolved_url and final_resolved_url != raw_clickthrough_url else raw_clickthrough_url
+    return unquote(url_for_display_text).replace('https://','').replace('http://','')
+
+def cached_render(cache_key, context):
+    # The render cache's result for cache_key as a finished render context, or None to encode it.
+    # Renders from before per-job workspaces aren't indexed and can't be served; those are rendered again.
+    cached_filename = render_outputs.lookup(cache_key)
+    if not cached_filename or not artifacts.lookup(cached_filename):
+        return None
+    artifacts.touch(cached_filename)
+    context = dict(context, output_filename=cached_filename, render_cache='hit')
+    cached_log_filepath = os.path.join(GENERATED_FOLDER, f"{cached_filename}.log")
+    if os.path.exists(cached_log_filepath):
+        context['ffmpeg_log_filename'] = f"{cached_filename}.log"
+        with open(cached_log_filepath, 'r') as log_f_cached:
+            context['ffmpeg_log_content'] = log_f_cached.read()
+    return context
+
+def encode_progress_reporter(report_progress):
+    def report_encode_progress(snapshot):
+        # Encoding covers 40-95% of the job; fps/speed/percent ride along as live details
+        percent = snapshot['percent'] or 0.0
+        report_progress('encoding', 0.4 + 0.55 * percent / 100, {
+            'fps': snapshot['fps'], 'speed': snapshot['speed'], 'percent': snapshot['percent'],
+            'frame': snapshot['frame'], 'out_time': snapshot['out_time'],
+        })
+    return report_encode_progress
+
+def check_encoders(profiles):
+    # The cheapest rejections, made before any network or media work: no ffmpeg, or no encoder for a profile
+    ffmpeg_path = get_ffmpeg_path()
+    if not ffmpeg_path:
+        raise PreflightError('ffmpeg_unavailable', "FFmpeg not found or not validated. Please ensure it is installed and accessible via /opt/homebrew/bin/ffmpeg or your system PATH.")
+    for profile in profiles:
+        if profile['video_codec'] not in ffmpeg_tools.get()['encoders']:
+            raise PreflightError('encoder_unavailable', f"This FFmpeg build has no {profile['video_codec']} encoder, which the '{profile['name']}' profile needs.",
+                                 {'encoder': profile['video_codec'], 'profile': profile['name']})
+    return ffmpeg_path
+
+def preflight_media(ffmpeg_path, media_file_url, timer, report_progress):
+    # Checks the creative's streams and downloads (or finds) it; returns (path, sha256, probe info) or raises
+    # PreflightError. A MediaFile that isn't cached yet is checked from its header over HTTP first, so a rejected
+    # creative is never downloaded. The encode still reads a local copy, so network stalls don't count against
+    # ffmpeg's timeout.
+    codecs = ffmpeg_tools.get()['decodable_codecs']
+    url_info = None
+    if not media_files.cached(media_file_url):
+        report_progress('preflight', 0.15)
+        with timer.stage('preflight'):
+            url_info = media_preflight.check_url(ffmpeg_path, media_file_url, codecs=codecs,
+                                                 timeout_seconds=config['PREFLIGHT_PROBE_TIMEOUT'])
+    report_progress('downloading_media', 0.2)
+    try:
+        with timer.stage('download_media'):
+            media_filepath, media_sha256 = media_files.fetch(media_file_url)
+    except MediaIngestError as e_media:
+        raise PreflightError('media_unavailable', str(e_media), {'url': media_file_url})
+    if url_info is not None:
+        # Same bytes, so the header probe stands in for probing the downloaded file
+        media_preflight.remember(media_sha256, url_info)
+    with timer.stage('preflight'):
+        source_info = media_preflight.check(ffmpeg_path, media_filepath, media_sha256, codecs=codecs)
+    return media_filepath, media_sha256, source_info
+
+def check_media_source(ffmpeg_path, media_file_url):
+    # The part of preflight_media that needs no download: a cached creative is checked from its probe, any other
+    # from its header over HTTP. Returns the probe info, or None when only the download can tell; raises PreflightError
+    codecs = ffmpeg_tools.get()['decodable_codecs']
+    if not media_files.cached(media_file_url):
+        return media_preflight.check_url(ffmpeg_path, media_file_url, codecs=codecs,
+                                         timeout_seconds=config['PREFLIGHT_PROBE_TIMEOUT'])
+    try:
+        media_filepath, media_sha256 = media_files.fetch(media_file_url)
+    except MediaIngestError:
+        return None
+    return media_preflight.check(ffmpeg_path, media_filepath, media_sha256, codecs=codecs)
+
+def batch_preflight(media_file_url, profile=None):
+    # Batch mode checks each creative before click URLs are resolved and QR codes drawn; returns the rejection
+    # context, or None to go ahead (the render still runs the full preflight_media)
+    try:
+        ffmpeg_path = check_encoders([profile or encoder_profiles.get_profile(config['ENCODER_PROFILE'])])
+        check_media_source(ffmpeg_path, media_file_url)
+    except PreflightError as e_preflight:
+        return rejected_context(e_preflight, {'media_file_url': media_file_url})
+    return None
+
+def rejected_context(e_preflight, context):
+    print(f"[PREFLIGHT] Rejected {context.get('media_file_url')}: {e_preflight.reason}: {e_preflight}", flush=True)
+    return dict(context, **e_preflight.context())
+
+def unexpected_error_context(e_main, context):
+    import traceback
+    tb_str = traceback.format_exc()
+    print(tb_str, flush=True)
+    # Pass along any VAST related data that was extracted before the error
+    return dict(context, error=f"An unexpected error occurred: {e_main} traceback: {tb_str[:1000]}")
+
+def render_ad(ad, report_progress=None, final_resolved_url=None, qr_filename=None, profile=None, timer=None, workspace=None,
+              layout=None):
+    # Preflight -> resolve -> QR -> compose -> encode for one parsed ad. Callers that already resolved the click URL
+    # or generated the QR image (batch mode shares that work between duplicate ads) pass them in.
+    if timer is None:
+        timer = instrumentation.StageTimer(stage_metrics.observe)
+    result = _render_ad(ad, report_progress, final_resolved_url, qr_filename, profile, timer, workspace or artifacts.workspace(),
+                        layout)
+    return dict(result, timings=timer.summary())
+
+def _render_ad(ad, report_progress, final_resolved_url, qr_filename, profile, timer, workspace, layout):
+    if report_progress is None:
+        report_progress = lambda stage, progress, details=None: None
+    if profile is None:
+        profile = encoder_profiles.get_profile(config['ENCODER_PROFILE'])
+    if layout is None:
+        layout = load_layout()
+    ad_title = ad['ad_title']
+    brand_name = ad['brand_name']
+    media_file_url = ad['media_file_url']
+    raw_clickthrough_url = ad['raw_clickthrough_url']
+    vast_content_snippet = ad.get('vast_content_snippet')
+
+    try:
+        # A creative that can't be rendered is rejected before any click resolution or QR work is spent on it
+        ad_context = {
+            'ad_title': ad_title, 'brand_name': brand_name, 'media_file_url': media_file_url,
+            'raw_clickthrough_url': raw_clickthrough_url, 'encoder_profile': profile['name'], 'layout': layout.name,
+            'vast_content_snippet': vast_content_snippet,
+        }
+        try:
+            ffmpeg_path = check_encoders([profile])
+            media_filepath, media_sha256, source_info = preflight_media(ffmpeg_path, media_file_url, timer, report_progress)
+        except PreflightError as e_preflight:
+            return rejected_context(e_preflight, ad_context)
+
+        if final_resolved_url is None:
+            report_progress('resolving_click_url', 0.25)
+            with timer.stage('resolve_click_url'):
+                final_resolved_url = get_final_destination(raw_clickthrough_url)
+
+        if qr_filename is None:
+            report_progress('generating_qr', 0.35)
+            with timer.stage('generate_qr'):
+                qr_filename = generate_qr_code(raw_clickthrough_url, workspace=workspace)
+        qr_filepath = artifacts.path(qr_filename)
+
+        # The random suffix keeps the name unique even when a retried job reuses its workspace
+        output_filename = f"{workspace}/output_{secure_filename(brand_name)}_{os.urandom(4).hex()}.mp4"
+        output_filepath = artifacts.path(output_filename)
+        ffmpeg_log_filepath = f"{output_filepath}.log"
+
+        # Per-render text for the layout's text boxes; the layout cuts each to its box's max_chars, and
+        # boxes with static text (the call to action) come from the template
+        layout_texts = {'brand': brand_name, 'url': display_url(raw_clickthrough_url, final_resolved_url)}
+
+        base_context = dict(ad_context, final_resolved_url=final_resolved_url, qr_filename=qr_filename)
+
+        # Skip work the source doesn't need: audio that already meets the profile is stream-copied, a video
+        # that already has the slot's exact size isn't run through the scaler, and a faster source is dropped
+        # to the output frame rate before it is composited
+        slot_size = layout.scaled_video_box(profile['size'])[2:]
+        encoder_settings = encoder_profiles.encoder_args(profile, source_info)
+        base_context['audio_passthrough'] = encoder_profiles.audio_matches(profile, source_info)
+
+        # Background, QR and text never change during the ad, so they are drawn once into a plate image
+        # and ffmpeg only scales the ad video and overlays the plate on each frame
+        try:
+            plate_key = compositor.plate_key(layout, qr_filepath, layout_texts, profile['size'])
+            filter_complex_str = compile_filter_graph(layout, tuple(profile['size']),
+                                                      scale_video=not encoder_profiles.video_matches(slot_size, source_info),
+                                                      fps=encoder_profiles.frame_rate_filter(profile, source_info))
+        except LayoutError as e_layout:
+            return dict(base_context, error=str(e_layout))
+
+        # Identical creative + click URL + layout renders to identical output, so reuse it when we can
+        cache_key = None
+        if config['RENDER_CACHE_ENABLED']:
+            report_progress('checking_render_cache', 0.38)
+            media_fp = f"sha256:{media_sha256}"
+            cache_key = render_cache.render_key(media_fp, raw_clickthrough_url, final_resolved_url, brand_name,
+                                                filter_complex_str, encoder_settings, [plate_key])
+            cached_context = cached_render(cache_key, base_context)
+            if cached_context:
+                return cached_context
+
+        with timer.stage('render_plate'):
+            plate_filepath = plate_images.get(layout, qr_filepath, layout_texts, profile['size'])
+        print(f"Static layer plate: {plate_filepath}", flush=True)
+        print(f"Filter graph ({layout.name}): {filter_complex_str}", flush=True)
+
+        ffmpeg_command = [
+            ffmpeg_path, '-y',
+            '-loglevel', config['FFMPEG_LOGLEVEL'],
+            *ffmpeg_runner.progress_args(),
+            '-i', media_filepath,
+            '-i', plate_filepath,
+            '-filter_complex', filter_complex_str,
+            '-map', '[final_output]',
+            *encoder_profiles.audio_map(source_info),
+            *encoder_settings,
+            '-threads', str(config['FFMPEG_THREADS']),
+            output_filepath
+        ]
+        source_duration = (source_info or {}).get('duration')
+        segments = 1
+        if source_duration and source_duration >= config['SEGMENTED_ENCODE_MIN_DURATION']:
+            segments = len(segmented_encode.plan_segments(source_duration, profile, config['SEGMENT_WORKERS']))
+        if segments == 1:
+            # A segmented encode never runs this command; its own commands are recorded once they have run
+            ffmpeg_command_str = ' '.join(shlex.quote(str(arg)) for arg in ffmpeg_command)
+            print(f"FFMPEG Command: {ffmpeg_command_str}", flush=True)
+            base_context['ffmpeg_command_str'] = ffmpeg_command_str
+
+        os.makedirs(os.path.dirname(ffmpeg_log_filepath), exist_ok=True)
+        ffmpeg_timeout = config['FFMPEG_TIMEOUT']
+
+        report_encode_progress = encode_progress_reporter(report_progress)
+
+        report_progress('encoding', 0.4)
+        try:
+            with timer.stage('encode'):
+                if segments > 1:
+                    run = segmented_encode.run_segmented(
+                        ffmpeg_path, media_filepath, plate_filepath, filter_complex_str, profile, source_info,
+                        output_filepath, ffmpeg_log_filepath, segments,
+                        threads_per_segment=max(1, config['FFMPEG_THREADS'] // segments),
+                        timeout_seconds=ffmpeg_timeout, loglevel=config['FFMPEG_LOGLEVEL'],
+                        on_progress=report_encode_progress)
+                    ffmpeg_command_str = '\n'.join(' '.join(shlex.quote(str(arg)) for arg in command)
+                                                   for command in run['commands'] if command)
+                    print(f"FFMPEG Commands ({segments} segments + mux):\n{ffmpeg_command_str}", flush=True)
+                    base_context['ffmpeg_command_str'] = ffmpeg_command_str
+                else:
+                    run = ffmpeg_runner.run_ffmpeg(ffmpeg_command, ffmpeg_log_filepath, ffmpeg_timeout,
+                                                   duration_seconds=source_duration, on_progress=report_encode_progress)
+            base_context['encode_stats'] = dict(run['progress'], elapsed=run['elapsed'], segments=segments)
+            base_context['ffmpeg_log_filename'] = artifacts.add(f"{output_filename}.log", 'log')
+            with open(ffmpeg_log_filepath, 'r') as log_f_display:
+                base_context['ffmpeg_log_content'] = log_f_display.read()
+
+            if run['timed_out']:
+                error_message = f"FFmpeg processing timed out after {ffmpeg_timeout:g} seconds."
+                return dict(base_context, error=error_message, ffmpeg_stderr=run['stderr_tail'])
+            if run['returncode'] == 0:
+                artifacts.add(output_filename, 'render')
+                if cache_key:
+                    render_outputs.store(cache_key, output_filename)
+                return dict(base_context, output_filename=output_filename, render_cache='miss' if cache_key else 'bypass')
+            else:
+                detailed_error = f"FFmpeg processing failed. RC: {run['returncode']}."
+                # The full stderr is in ffmpeg_log_content; ffmpeg_stderr carries the tail with the actual error
+                return dict(base_context, error=detailed_error, ffmpeg_stderr=run['stderr_tail'])
+        except Exception as e_ffmpeg:
+            error_message = f"An unexpected error occurred during FFmpeg subprocess: {str(e_ffmpeg)}"
+            # Re-read log content if it exists
+            if os.path.exists(ffmpeg_log_filepath):
+                with open(ffmpeg_log_filepath, 'r') as log_f_ex_display:
+                    ffmpeg_log_content = log_f_ex_display.read()
+            else:
+                ffmpeg_log_content = "FFmpeg log file not found or not created before exception."
+            return dict(base_context, error=error_message, ffmpeg_stderr=str(e_ffmpeg), ffmpeg_log_content=ffmpeg_log_content)
+    except Exception as e_main:
+        return unexpected_error_context(e_main, {
+            'ad_title': ad_title, 'brand_name': brand_name, 'media_file_url': media_file_url,
+            'raw_clickthrough_url': raw_clickthrough_url, 'final_resolved_url': final_resolved_url,
+            'qr_filename': qr_filename, 'vast_content_snippet': vast_content_snippet
+        })
+
+def plan_variants(specs, profile=None, layout=None):
+    # Validates a list of variant options (see VARIANT_OPTIONS) into render plans. Unset options fall back
+    # to the given profile and layout. Raises VariantError, UnknownProfileError or UnknownLayoutError.
+    if not isinstance(specs, list) or not specs:
+        raise VariantError("'variants' must be a non-empty list of variant objects.")
+    if len(specs) > config['MAX_VARIANTS']:
+        raise VariantError(f"At most {config['MAX_VARIANTS']} variants can be rendered together, got {len(specs)}.")
+    plans = []
+    for index, spec in enumerate(specs):
+        if not isinstance(spec, dict):
+            raise VariantError(f"Variant {index} must be an object with any of: {', '.join(VARIANT_OPTIONS)}.")
+        unknown = sorted(set(spec) - set(VARIANT_OPTIONS))
+        if unknown:
+            raise VariantError(f"Variant {index}: unknown option(s) {', '.join(unknown)}. Allowed: {', '.join(VARIANT_OPTIONS)}.")
+        for option in VARIANT_OPTIONS:
+            if spec.get(option) is not None and not isinstance(spec[option], str):
+                raise VariantError(f"Variant {index}: '{option}' must be a string.")
+        if spec.get('click_url') and not spec['click_url'].startswith(('http://', 'https://')):
+            raise VariantError(f"Variant {index}: 'click_url' must be an http(s) URL.")
+        variant_layout = load_layout(spec['layout']) if spec.get('layout') else layout or load_layout()
+        if spec.get('cta') is not None and not any(box['name'] == 'cta' for box in variant_layout.text_boxes):
+            raise VariantError(f"Variant {index}: layout '{variant_layout.name}' has no 'cta' text box.")
+        plans.append({
+            'name': spec.get('name') or f"variant_{index}",
+            'profile': encoder_profiles.get_profile(spec['profile']) if spec.get('profile') else profile or encoder_profiles.get_profile(config['ENCODER_PROFILE']),
+            'layout': variant_layout,
+            'cta': spec.get('cta'),
+            'click_url': spec.get('click_url'),
+        })
+    if len({plan['name'] for plan in plans}) != len(plans):
+        raise VariantError("Variant names must be unique.")
+    return plans
+
+def largest_variant(plans):
+    # The variant with the biggest video slot decides which MediaFile is downloaded for the whole set
+    def slot_area(plan):
+        _, _, width, height = plan['layout'].scaled_video_box(plan['profile']['size'])
+        return width * height
+    return max(plans, key=slot_area)
+
+def render_variants(ad, variants, report_progress=None, timer=None, workspace=None):
+    """Renders several variants of one parsed ad (see plan_variants) from a single decode of its creative.
+
+    Variants already in the render cache are served from it; the rest are composited and encoded together
+    by one ffmpeg process that splits the decoded video between them (layout.compile_variant_graph), so
+    the source is decoded and scaled once per distinct slot rather than once per output. Returns the ad's
+    fields plus 'variants', one render context per variant in order. The set has an 'error' only when no
+    variant could be rendered. Variant sets are always encoded in one process, never in segments.
+    """
+    if timer is None:
+        timer = instrumentation.StageTimer(stage_metrics.observe)
+    result = _render_variants(ad, variants, report_progress, timer, workspace or artifacts.workspace())
+    return dict(result, timings=timer.summary())
+
+def _render_variants(ad, variants, report_progress, timer, workspace):
+    if report_progress is None:
+        report_progress = lambda stage, progress, details=None: None
+    brand_name = ad['brand_name']
+    base_context = {
+        'ad_title': ad['ad_title'],
+        'brand_name': brand_name,
+        'media_file_url': ad['media_file_url'],
+        'raw_clickthrough_url': ad['raw_clickthrough_url'],
+        'vast_content_snippet': ad.get('vast_content_snippet'),
+    }
+
+    try:
+        try:
+            ffmpeg_path = check_encoders([variant['profile'] for variant in variants])
+            media_filepath, media_sha256, source_info = preflight_media(ffmpeg_path, ad['media_file_url'], timer, report_progress)
+        except PreflightError as e_preflight:
+            return rejected_context(e_preflight, base_context)
+
+        click_targets = [variant['click_url'] or ad['raw_clickthrough_url'] for variant in variants]
+        report_progress('resolving_click_url', 0.25)
+        with timer.stage('resolve_click_url'):
+            final_urls = get_final_destinations(click_targets)
+
+        # One QR image per distinct click URL, shared by the variants that use it
+        report_progress('generating_qr', 0.35)
+        qr_filenames = {}
+        with timer.stage('generate_qr'):
+            for url in dict.fromkeys(click_targets):
+                qr_filenames[url] = generate_qr_code(url, f"qrcode_{len(qr_filenames)}.png", workspace=workspace)
+        if ad['raw_clickthrough_url'] in qr_filenames:
+            base_context['qr_filename'] = qr_filenames[ad['raw_clickthrough_url']]
+
+        # Each variant gets the same render cache key a single render of it would, so either can serve the other
+        report_progress('checking_render_cache', 0.38)
+        results, pending = [], []
+        for variant, click_url in zip(variants, click_targets):
+            profile, layout = variant['profile'], variant['layout']
+            final_url = final_urls.get(click_url) or click_url
+            context = {
+                'variant': variant['name'],
+                'encoder_profile': profile['name'],
+                'layout': layout.name,
+                'raw_clickthrough_url': click_url,
+                'final_resolved_url': final_url,
+                'qr_filename': qr_filenames[click_url],
+                'audio_passthrough': encoder_profiles.audio_matches(profile, source_info),
+            }
+            results.append(context)
+            texts = {'brand': brand_name, 'url': display_url(click_url, final_url)}
+            if variant['cta'] is not None:
+                texts['cta'] = variant['cta']
+            scale_video = not encoder_profiles.video_matches(layout.scaled_video_box(profile['size'])[2:], source_info)
+            fps = encoder_profiles.frame_rate_filter(profile, source_info)
+            encoder_settings = encoder_profiles.encoder_args(profile, source_info)
+            try:
+                plate_key = compositor.plate_key(layout, artifacts.path(qr_filenames[click_url]), texts, profile['size'])
+                filter_complex_str = compile_filter_graph(layout, tuple(profile['size']), scale_video=scale_video, fps=fps)
+            except LayoutError as e_layout:
+                context['error'] = str(e_layout)
+                continue
+
+            cache_key = None
+            if config['RENDER_CACHE_ENABLED']:
+                cache_key = render_cache.render_key(f"sha256:{media_sha256}", click_url, final_url, brand_name,
+                                                    filter_complex_str, encoder_settings, [plate_key])
+                cached_context = cached_render(cache_key, context)
+                if cached_context:
+                    context.update(cached_context)
+                    continue
+            pending.append({'context': context, 'variant': variant, 'texts': texts, 'scale_video': scale_video, 'fps': fps,
+                            'encoder_settings': encoder_settings, 'cache_key': cache_key})
+
+        if pending:
+            with timer.stage('render_plate'):
+                plate_filepaths = [plate_images.get(item['variant']['layout'], artifacts.path(item['context']['qr_filename']),
+                                                    item['texts'], item['variant']['profile']['size'])
+                                   for item in pending]
+            filter_complex_str = compile_variant_graph(tuple(
+                (item['variant']['layout'], tuple(item['variant']['profile']['size']), item['scale_video'], item['fps'])
+                for item in pending))
+            print(f"Variant filter graph: {filter_complex_str}", flush=True)
+
+            # One input per plate after the creative, then one output (video branch + source audio) per variant
+            ffmpeg_command = [ffmpeg_path, '-y', '-loglevel', config['FFMPEG_LOGLEVEL'], *ffmpeg_runner.progress_args(),
+                              '-i', media_filepath]
+            for plate_filepath in plate_filepaths:
+                ffmpeg_command += ['-i', plate_filepath]
+            ffmpeg_command += ['-filter_complex', filter_complex_str]
+            for index, item in enumerate(pending):
+                output_filename = f"{workspace}/output_{secure_filename(brand_name)}_{secure_filename(item['variant']['name'])}_{os.urandom(4).hex()}.mp4"
+                item['output_filename'] = output_filename
+                ffmpeg_command += ['-map', f"[variant_{index}]", *encoder_profiles.audio_map(source_info), *item['encoder_settings'],
+                                   '-threads', str(config['FFMPEG_THREADS']), artifacts.path(output_filename)]
+            ffmpeg_command_str = ' '.join(shlex.quote(str(arg)) for arg in ffmpeg_command)
+            print(f"FFMPEG Command: {ffmpeg_command_str}", flush=True)
+            base_context['ffmpeg_command_str'] = ffmpeg_command_str
+
+            log_filename = f"{workspace}/variants_{os.urandom(4).hex()}.log"
+            ffmpeg_log_filepath = artifacts.path(log_filename)
+            os.makedirs(os.path.dirname(ffmpeg_log_filepath), exist_ok=True)
+            # Every output is encoded in this one process, so the time limit scales with their number
+            ffmpeg_timeout = config['FFMPEG_TIMEOUT'] * len(pending)
+            report_progress('encoding', 0.4)
+            with timer.stage('encode'):
+                run = ffmpeg_runner.run_ffmpeg(ffmpeg_command, ffmpeg_log_filepath, ffmpeg_timeout,
+                                               duration_seconds=(source_info or {}).get('duration'),
+                                               on_progress=encode_progress_reporter(report_progress))
+            base_context['encode_stats'] = dict(run['progress'], elapsed=run['elapsed'], outputs=len(pending))
+            base_context['ffmpeg_log_filename'] = artifacts.add(log_filename, 'log')
+            with open(ffmpeg_log_filepath, 'r') as log_f_display:
+                base_context['ffmpeg_log_content'] = log_f_display.read()
+
+            if run['timed_out']:
+                error_message = f"FFmpeg processing timed out after {ffmpeg_timeout:g} seconds."
+            elif run['returncode'] != 0:
+                error_message = f"FFmpeg processing failed. RC: {run['returncode']}."
+            else:
+                error_message = None
+            for item in pending:
+                context, output_filename = item['context'], item['output_filename']
+                if error_message:
+                    context.update(error=error_message, ffmpeg_stderr=run['stderr_tail'])
+                    continue
+                # Each render keeps the shared log under its own name, like a single render's
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(artifacts.path(f"{output_filename}.log"))
+                try:
+                    os.link(ffmpeg_log_filepath, artifacts.path(f"{output_filename}.log"))
+                except OSError:
+                    shutil.copyfile(ffmpeg_log_filepath, artifacts.path(f"{output_filename}.log"))
+                artifacts.add(f"{output_filename}.log", 'log')
+                artifacts.add(output_filename, 'render')
+                if item['cache_key']:
+                    render_outputs.store(item['cache_key'], output_filename)
+                context.update(output_filename=output_filename, render_cache='miss' if item['cache_key'] else 'bypass')
+
+        for context in results:
+            # The set carries the shared log once
+            context.pop('ffmpeg_log_content', None)
+        done = sum(1 for context in results if not context.get('error'))
+        base_context['summary'] = {
+            'variants': len(results), 'done': done, 'failed': len(results) - done,
+            'encoded': sum(1 for item in pending if not item['context'].get('error')),
+            'cached': sum(1 for context in results if context.get('render_cache') == 'hit'),
+        }
+        if not done:
+            base_context['error'] = next(context['error'] for context in results)
+        return dict(base_context, variants=results)
+    except Exception as e_main:
+        return unexpected_error_context(e_main, base_context)
+
+def run_conversion(payload, report_progress=None, workspace=None):
+    # Runs the whole VAST -> L-Bar pipeline for one job and returns the template context for its result.
+    # A context with an 'error' key is a failed conversion; the keys mirror what index.html renders.
+    timer = instrumentation.StageTimer(stage_metrics.observe)
+    result = _run_conversion(payload, report_progress, timer, workspace)
+    return dict(result, timings=timer.summary())
+
+def _run_conversion(payload, report_progress, timer, workspace):
+    if report_progress is None:
+        report_progress = lambda stage, progress, details=None: None
+    try:
+        profile = encoder_profiles.get_profile(payload.get('profile') or config['ENCODER_PROFILE'])
+    except encoder_profiles.UnknownProfileError as e:
+        return {'error': str(e)}
+    try:
+        layout = load_layout(payload.get('layout'))
+        variants = plan_variants(payload['variants'], profile, layout) if 'variants' in payload else None
+    except (UnknownLayoutError, LayoutError, VariantError, encoder_profiles.UnknownProfileError) as e:
+        return {'error': str(e)}
+    with timer.stage('fetch_vast'):
+        vast_content, error_context = fetch_vast_content(payload, report_progress)
+    if error_context:
+        return error_context
+
+    ad = {}
+    try:
+        # With variants, the MediaFile is picked for the variant with the largest video slot
+        parse_profile, parse_layout = profile, layout
+        if variants:
+            largest = largest_variant(variants)
+            parse_profile, parse_layout = largest['profile'], largest['layout']
+        report_progress('parsing_vast', 0.1)
+        with timer.stage('parse_vast'):
+            ad = parse_vast_ad(vast_content, parse_profile, parse_layout)
+        if 'wrapper_uri' in ad:
+            # Only a wrapper pays for resolution (a tree build and rewrite of the document) and a second parse
+            report_progress('resolving_wrappers', 0.12)
+            with timer.stage('fetch_vast'):
+                vast_content, error_context = resolve_vast_wrappers(vast_content)
+            if error_context:
+                return error_context
+            with timer.stage('parse_vast'):
+                ad = parse_vast_ad(vast_content, parse_profile, parse_layout)
+        if ad.get('error'):
+            return ad
+        if variants:
+            return render_variants(ad, variants, report_progress, timer=timer, workspace=workspace)
+        return render_ad(ad, report_progress, profile=profile, timer=timer, workspace=workspace, layout=layout)
+    except ET.ParseError as e_xml:
+        return {'error': f"Invalid XML content in VAST tag: {e_xml}", 'vast_content_snippet': vast_content[:1000]}
+    except Exception as e_main:
+        return unexpected_error_context(e_main, dict(ad, vast_content_snippet=vast_content[:1000]))
+
+def convert(source, profile_name=None, report_progress=None, layout_name=None, variants=None):
+    # One VAST URL, file path or XML string -> one render result (a variant set when `variants` is given,
+    # see plan_variants). The first ad of a pod is converted; use run_batch_conversion() for every ad.
+    source = source.strip()
+    if source.startswith(('http://', 'https://', '<')):
+        payload = {'vast_input': source}
+    else:
+        try:
+            with open(source, 'r', encoding='utf-8') as f:
+                payload = {'vast_content': f.read()}
+        except OSError as e:
+            return {'error': f"Error loading VAST source: {e}"}
+    if profile_name:
+        payload['profile'] = profile_name
+    if layout_name:
+        payload['layout'] = layout_name
+    if variants is not None:
+        payload['variants'] = variants
+    return run_conversion(payload, report_progress)
+
+def run_batch_conversion(sources, workers=None, profile_name=None, layout_name=None):
+    # Yields batch.run_batch() events for every ad in `sources`; see batch.run_batch
+    profile = encoder_profiles.get_profile(profile_name or config['ENCODER_PROFILE'])
+    layout = load_layout(layout_name)
+    # Shared QR codes and the manifest go in the batch's workspace; each render gets its own
+    workspace = artifacts.workspace()
+    # partial() keeps the render function picklable for the batch process pool
+    events = batch.run_batch(sources, functools.partial(parse_vast_ad, profile=profile, layout=layout), get_final_destinations,
+                             functools.partial(generate_qr_code, workspace=workspace), functools.partial(render_ad, profile=profile, layout=layout),
+                             workers=workers or config['BATCH_WORKERS'], manifest_dir=artifacts.path(workspace),
+                             load_fn=load_vast, preflight_fn=functools.partial(batch_preflight, profile=profile))
+    for event in events:
+        if event.get('manifest_filename'):
+            event['manifest_filename'] = artifacts.add(f"{workspace}/{event['manifest_filename']}", 'manifest')
+        yield event
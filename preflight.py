@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from contextlib import closing
+import json
+import threading
+import time
+
+import encoder_profiles
+import sqlite_store
+
+# Bump when the probe parser changes so previously cached stream layouts are probed again
+PROBE_VERSION = 1
+
+# Frame sizes outside this range are either broken files or nothing a CTV encoder should be fed
+MIN_DIMENSION = 32
+MAX_DIMENSION = 8192
+MAX_FPS = 240.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    sha256 TEXT PRIMARY KEY,
+    info TEXT NOT NULL,
+    probed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probes_probed_at ON probes (probed_at);
+"""
+
+
+class PreflightError(Exception):
+    """A creative rejected before encoding. `reason` is a stable code for clients, `details`
+    the probe facts that triggered it."""
+
+    def __init__(self, reason, message, details=None):
+        super().__init__(message)
+        self.reason = reason
+        self.details = details or {}
+
+    def context(self):
+        return {'error': str(self), 'preflight': {'reason': self.reason, 'details': self.details}}
+
+
+class Preflight:
+    """Checks a creative's stream layout before a render commits a download or an ffmpeg process to it.
+
+    The layout comes from encoder_profiles' `ffmpeg -i` probe and is cached by the media's SHA-256, in
+    memory and in SQLite, so a creative seen before (by any worker or process) is checked without
+    starting ffmpeg at all. check_url() probes a MediaFile that isn't downloaded yet from its container
+    header. check() returns the probe info, which the render feeds to the encoder decisions (audio map,
+    frame-rate filter, segmenting), or raises PreflightError.
+    """
+
+    def __init__(self, db_path, min_duration=0.5, max_duration=300, require_audio=False, memory_entries=256, max_entries=10000):
+        self.db_path = db_path
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.require_audio = require_audio
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        sqlite_store.initialize(db_path, _SCHEMA)
+
+    def _connect(self):
+        return sqlite_store.connect(self.db_path)
+
+    def _key(self, sha256):
+        return f"{PROBE_VERSION}:{sha256}"
+
+    def _remember(self, key, info):
+        with self._lock:
+            self._memory[key] = info
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def probe(self, ffmpeg_path, media_path, sha256):
+        """Returns the stream layout of a media file (see encoder_profiles.probe_media), or None if ffmpeg
+        couldn't be run on it. Layouts are cached by content hash, never by path."""
+        key = self._key(sha256)
+        with self._lock:
+            info = self._memory.get(key)
+        if info is not None:
+            return info
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT info FROM probes WHERE sha256 = ?", (key,)).fetchone()
+        if row is not None:
+            info = json.loads(row[0])
+            self._remember(key, info)
+            return info
+
+        info = encoder_profiles.probe_media(ffmpeg_path, media_path)
+        if info is None:
+            return None
+        self.remember(sha256, info)
+        return info
+
+    def remember(self, sha256, info):
+        # Caches a layout for a content hash, e.g. one read from the MediaFile's URL before it was downloaded
+        key = self._key(sha256)
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO probes (sha256, info, probed_at) VALUES (?, ?, ?)",
+                         (key, json.dumps(info), time.time()))
+            # Rows are tiny, so the table is only trimmed once it is well past its bound
+            if conn.execute("SELECT COUNT(*) FROM probes").fetchone()[0] > self.max_entries * 1.1:
+                conn.execute("DELETE FROM probes WHERE sha256 IN (SELECT sha256 FROM probes ORDER BY probed_at LIMIT ?)",
+                             (int(self.max_entries * 0.1),))
+        self._remember(key, info)
+        return info
+
+    def check(self, ffmpeg_path, media_path, sha256, codecs=None):
+        info = self.probe(ffmpeg_path, media_path, sha256)
+        if info is None:
+            raise PreflightError('probe_failed', "The MediaFile could not be probed with ffmpeg.")
+        return self.validate(info, codecs)
+
+    def check_url(self, ffmpeg_path, url, codecs=None, timeout_seconds=10):
+        """Checks a remote MediaFile from its container header, before it is downloaded. Returns the probe
+        info, or None when the header couldn't be read (the download and check() decide then)."""
+        info = encoder_profiles.probe_url(ffmpeg_path, url, timeout_seconds)
+        if info is None or (info['video'] is None and info['audio'] is None and info['duration'] is None):
+            return None
+        return self.validate(info, codecs)
+
+    def validate(self, info, codecs=None):
+        # `codecs` are the codec names the ffmpeg build can decode (ffmpeg -codecs); a video codec outside them is rejected
+        video, duration = info.get('video'), info.get('duration')
+        if video is None and info.get('audio') is None and duration is None:
+            raise PreflightError('unreadable_media', "The MediaFile is not a media file ffmpeg can read.")
+        if video is None:
+            raise PreflightError('no_video_stream', "The MediaFile has no video stream.", {'audio': info.get('audio')})
+        if codecs is not None and video['codec'] not in codecs:
+            raise PreflightError('unsupported_codec', f"This FFmpeg build can't decode {video['codec']} video.",
+                                 {'codec': video['codec']})
+        if not duration or duration < self.min_duration:
+            raise PreflightError('zero_duration', f"The MediaFile is {duration or 0:g} seconds long; at least {self.min_duration:g} are needed.",
+                                 {'duration': duration})
+        if duration > self.max_duration:
+            raise PreflightError('too_long', f"The MediaFile is {duration:g} seconds long; at most {self.max_duration:g} are allowed.",
+                                 {'duration': duration})
+        width, height = video['width'], video['height']
+        if not (MIN_DIMENSION <= width <= MAX_DIMENSION and MIN_DIMENSION <= height <= MAX_DIMENSION):
+            raise PreflightError('unsupported_resolution', f"The MediaFile's {width}x{height} video is outside {MIN_DIMENSION}-{MAX_DIMENSION} pixels per side.",
+                                 {'width': width, 'height': height})
+        if video.get('fps') is not None and not 0 < video['fps'] <= MAX_FPS:
+            raise PreflightError('unsupported_frame_rate', f"The MediaFile's frame rate of {video['fps']:g} fps is not usable.",
+                                 {'fps': video['fps']})
+        if self.require_audio and not info.get('audio'):
+            raise PreflightError('no_audio_stream', "The MediaFile has no audio stream, and PREFLIGHT_REQUIRE_AUDIO is set.")
+        return info
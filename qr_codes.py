@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from contextlib import closing
+import hashlib
+import io
+import os
+import threading
+import time
+
+import sqlite_store
+
+# qrcode and Pillow are only imported when an image has to be drawn; cache hits never need them
+ERROR_CORRECTION_LEVELS = ('L', 'M', 'Q', 'H')
+
+# Bump when the drawing code changes so previously cached images are not reused
+QR_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS qr_codes (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS qr_codes_last_access ON qr_codes (last_access);
+"""
+
+
+def render_qr_png(data, size, error_correction='M', border=4):
+    """Encodes data as a size x size PNG with whole-pixel modules, so no scaler ever touches it.
+
+    Each module gets the largest integer pixel width that fits; the few leftover pixels widen the
+    white quiet zone evenly instead of stretching some modules.
+    """
+    import qrcode
+    from PIL import Image
+    qr = qrcode.QRCode(error_correction=getattr(qrcode.constants, f"ERROR_CORRECT_{error_correction}"), box_size=1, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    modules = len(matrix)
+    if modules > size:
+        raise ValueError(f"QR code needs {modules} modules, more than fit in {size}px")
+    code = Image.new('1', (modules, modules), 1)
+    code.putdata([0 if dark else 1 for row in matrix for dark in row])
+    box = size // modules
+    code = code.resize((modules * box, modules * box), Image.NEAREST)
+    image = Image.new('L', (size, size), 255)
+    offset = (size - modules * box) // 2
+    image.paste(code, (offset, offset))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class QrCodeCache:
+    """Content-addressed QR images, cached in memory and on disk.
+
+    Images are keyed by the encoded text plus size, error-correction level and border, and written once
+    to <directory>/<key[:2]>/qr_<key>.png with an atomic rename, so concurrent jobs (threads or processes)
+    can share them. The most recent images are also kept in memory as PNG bytes. The disk cache is an
+    LRU bounded by entry count; callers that need a file to outlive eviction should link or copy it.
+    """
+
+    def __init__(self, directory, db_path, size=530, error_correction='M', border=4, memory_entries=256, max_entries=10000):
+        if error_correction not in ERROR_CORRECTION_LEVELS:
+            raise ValueError(f"Unknown QR error correction level {error_correction!r}; expected one of L, M, Q, H")
+        self.directory = directory
+        self.db_path = db_path
+        self.size = size
+        self.error_correction = error_correction
+        self.border = border
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0, 'miss': 0}
+        os.makedirs(directory, exist_ok=True)
+        sqlite_store.initialize(db_path, _SCHEMA)
+
+    def _connect(self):
+        return sqlite_store.connect(self.db_path)
+
+    def key(self, data):
+        material = f"{QR_VERSION}\0{self.size}\0{self.error_correction}\0{self.border}\0{data}"
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def image_path(self, key):
+        return os.path.join(self.directory, key[:2], f"qr_{key}.png")
+
+    def _remember(self, key, png):
+        with self._lock:
+            self._memory[key] = png
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _write(self, key, png):
+        path = self.image_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(png)
+        os.replace(temp_path, path)
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO qr_codes (key, size, created_at, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET last_access = excluded.last_access",
+                (key, len(png), now, now)
+            )
+        return path
+
+    def _touch(self, key):
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE qr_codes SET last_access = ? WHERE key = ?", (time.time(), key))
+
+    def get(self, data):
+        """Returns the path of the QR image for data, generating it on a miss."""
+        key = self.key(data)
+        path = self.image_path(key)
+        with self._lock:
+            png = self._memory.get(key)
+            if png is not None:
+                self._memory.move_to_end(key)
+        if png is not None and os.path.exists(path):
+            self.hits['memory'] += 1
+            return path
+
+        with self._key_lock(key):
+            if os.path.exists(path):
+                self.hits['disk'] += 1
+                self._touch(key)
+                if png is None:
+                    with open(path, 'rb') as f:
+                        self._remember(key, f.read())
+                return path
+            if png is None:
+                self.hits['miss'] += 1
+                png = render_qr_png(data, self.size, self.error_correction, self.border)
+                self._remember(key, png)
+            path = self._write(key, png)
+        self.evict(keep=key)
+        return path
+
+    def evict(self, keep=None):
+        removed = 0
+        with closing(self._connect()) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM qr_codes").fetchone()[0]
+            if count <= self.max_entries:
+                return 0
+            for (key,) in conn.execute("SELECT key FROM qr_codes ORDER BY last_access LIMIT ?",
+                                       (count - self.max_entries + 1,)).fetchall():
+                if key == keep:
+                    continue
+                try:
+                    os.remove(self.image_path(key))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM qr_codes WHERE key = ?", (key,))
+                removed += 1
+                if count - removed <= self.max_entries:
+                    break
+        return removed
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM qr_codes").fetchone()
+        with self._lock:
+            memory_entries = len(self._memory)
+        return {
+            'entries': entries,
+            'bytes': total,
+            'max_entries': self.max_entries,
+            'memory_entries': memory_entries,
+            'size': self.size,
+            'error_correction': self.error_correction,
+            'hits': dict(self.hits),
+        }
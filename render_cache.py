@@ -0,0 +1,113 @@
+from contextlib import closing
+import hashlib
+import json
+import os
+import time
+
+import sqlite_store
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS renders (
+    key TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS renders_last_access ON renders (last_access);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def render_key(media_fp, raw_clickthrough_url, final_resolved_url, brand_name, filter_complex_str, encoder_settings, static_inputs=()):
+    material = json.dumps([media_fp, raw_clickthrough_url, final_resolved_url, brand_name, filter_complex_str,
+                           list(encoder_settings), list(static_inputs)])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """Size-bounded LRU index of finished renders in the generated folder, keyed by render_key()."""
+
+    def __init__(self, db_path, directory, max_bytes, on_evict=None):
+        self.db_path = db_path
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Called with each evicted render's filename (and its log's) after the file is deleted
+        self.on_evict = on_evict
+        sqlite_store.initialize(db_path, _SCHEMA)
+
+    def _connect(self):
+        return sqlite_store.connect(self.db_path, rows=True)
+
+    def lookup(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT filename FROM renders WHERE key = ?", (key,)).fetchone()
+            if row is not None and os.path.exists(os.path.join(self.directory, row['filename'])):
+                conn.execute("UPDATE renders SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+                sqlite_store.count(conn, 'hits')
+                print(f"[RENDER CACHE] Hit {key[:12]} -> {row['filename']}", flush=True)
+                return row['filename']
+            if row is not None:
+                # The file was removed behind our back; forget the entry
+                conn.execute("DELETE FROM renders WHERE key = ?", (key,))
+            sqlite_store.count(conn, 'misses')
+        return None
+
+    def store(self, key, filename):
+        size = os.path.getsize(os.path.join(self.directory, filename))
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO renders (key, filename, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, filename, size, now, now)
+            )
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        removed = 0
+        with closing(self._connect()) as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM renders").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            for row in conn.execute("SELECT key, filename, size FROM renders ORDER BY last_access").fetchall():
+                if total <= self.max_bytes:
+                    break
+                if row['key'] == keep:
+                    continue
+                for path in (row['filename'], f"{row['filename']}.log"):
+                    try:
+                        os.remove(os.path.join(self.directory, path))
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        print(f"[RENDER CACHE] Error removing {path}: {e}", flush=True)
+                    if self.on_evict is not None:
+                        self.on_evict(path)
+                conn.execute("DELETE FROM renders WHERE key = ?", (row['key'],))
+                total -= row['size']
+                removed += 1
+            if removed:
+                sqlite_store.count(conn, 'evictions', removed)
+        if removed:
+            print(f"[RENDER CACHE] Evicted {removed} render(s) to stay under {self.max_bytes} bytes", flush=True)
+        return removed
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM renders").fetchone()
+            counters = sqlite_store.counters(conn)
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        return {
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('evictions', 0),
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+        }
@@ -0,0 +1,124 @@
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import encoder_profiles
+import ffmpeg_runner
+
+
+def plan_segments(duration_seconds, profile, segment_count, min_segment_seconds=10):
+    """Splits the output timeline into up to segment_count ranges of whole GOPs.
+
+    Every cut lands on a keyframe of the single-pass output (profiles use a fixed GOP), so the
+    concatenated result has the same keyframe cadence. Returns [(start_frame, frame_count or None)];
+    the last segment has no frame limit and runs to the end of the source.
+    """
+    fps = float(profile['fps'])
+    gop = encoder_profiles.gop_frames(profile)
+    total_gops = max(1, math.ceil(duration_seconds * fps / gop))
+    count = max(1, min(segment_count, total_gops, int(duration_seconds // min_segment_seconds) or 1))
+    starts = [round(index * total_gops / count) * gop for index in range(count)]
+    return [(start, (starts[index + 1] - start) if index + 1 < count else None) for index, start in enumerate(starts)]
+
+
+def _segment_command(ffmpeg_path, loglevel, start_frame, frame_count, fps, media_path, plate_path, filter_graph,
+                     profile, threads, segment_path):
+    # -ss before -i seeks to the nearest earlier keyframe and decodes up to the exact start, so the cut
+    # is frame-accurate without the source needing keyframes in the right places
+    command = [ffmpeg_path, '-y', '-loglevel', loglevel, *ffmpeg_runner.progress_args()]
+    if start_frame:
+        command += ['-ss', f"{start_frame / fps:.6f}"]
+    command += ['-i', media_path, '-i', plate_path, '-filter_complex', filter_graph,
+                '-map', '[final_output]', '-an', *encoder_profiles.video_args(profile)]
+    if frame_count:
+        command += ['-frames:v', str(frame_count)]
+    return command + ['-threads', str(threads), segment_path]
+
+
+def run_segmented(ffmpeg_path, media_path, plate_path, filter_graph, profile, source_info, output_path,
+                  log_filepath, segments, threads_per_segment=1, timeout_seconds=120, loglevel='info', on_progress=None,
+                  work_dir=None, min_segment_seconds=10):
+    """Encodes the video in parallel segments, then concatenates them losslessly and muxes the audio once.
+
+    Audio is not segmented: AAC frames don't line up with video cuts and each segment would get its own
+    encoder priming, so it comes straight from the source in the final mux, mapped from the probe like a
+    single-process encode (encoder_profiles.audio_map). Returns the same dict as
+    ffmpeg_runner.run_ffmpeg, plus the number of segments used and `commands`, the argument lists of the
+    segment encodes and the final mux that were run.
+    """
+    fps = float(profile['fps'])
+    duration = (source_info or {}).get('duration')
+    plan = plan_segments(duration, profile, segments, min_segment_seconds)
+    work_dir = tempfile.mkdtemp(prefix='segments_', dir=work_dir or os.path.dirname(output_path))
+    started = time.perf_counter()
+    out_times = [0.0] * len(plan)
+    commands = [None] * len(plan)
+    lock = threading.Lock()
+
+    def segment_progress(index):
+        def report(snapshot):
+            if on_progress is None:
+                return
+            with lock:
+                out_times[index] = snapshot['out_time'] or out_times[index]
+                encoded = sum(out_times)
+            on_progress({
+                'done': False, 'frame': None, 'fps': None, 'speed': None, 'out_time': round(encoded, 3),
+                'percent': round(min(100.0, 100.0 * encoded / duration), 1) if duration else None,
+                'segments': len(plan),
+            })
+        return report
+
+    def encode(index):
+        start_frame, frame_count = plan[index]
+        segment_path = os.path.join(work_dir, f"segment_{index:03d}.mp4")
+        command = _segment_command(ffmpeg_path, loglevel, start_frame, frame_count, fps, media_path, plate_path,
+                                   filter_graph, profile, threads_per_segment, segment_path)
+        commands[index] = command
+        run = ffmpeg_runner.run_ffmpeg(command, os.path.join(work_dir, f"segment_{index:03d}.log"), timeout_seconds,
+                                       duration_seconds=frame_count / fps if frame_count else None,
+                                       on_progress=segment_progress(index))
+        return segment_path, run
+
+    try:
+        print(f"[SEGMENTED] Encoding {len(plan)} segment(s) of {output_path} with {threads_per_segment} thread(s) each", flush=True)
+        with ThreadPoolExecutor(max_workers=len(plan), thread_name_prefix='segment-encode') as pool:
+            results = list(pool.map(encode, range(len(plan))))
+
+        with open(log_filepath, 'w') as log_file:
+            for index in range(len(plan)):
+                log_file.write(f"===== SEGMENT {index} =====\n")
+                with open(os.path.join(work_dir, f"segment_{index:03d}.log")) as segment_log:
+                    shutil.copyfileobj(segment_log, log_file)
+        for segment_path, run in results:
+            if run['timed_out'] or run['returncode'] != 0:
+                return dict(run, elapsed=round(time.perf_counter() - started, 3), segments=len(plan), commands=commands)
+
+        concat_list = os.path.join(work_dir, 'segments.txt')
+        with open(concat_list, 'w') as f:
+            for segment_path, run in results:
+                f.write(f"file '{segment_path}'\n")
+        command = [
+            ffmpeg_path, '-y', '-loglevel', loglevel, *ffmpeg_runner.progress_args(),
+            '-f', 'concat', '-safe', '0', '-i', concat_list, '-i', media_path,
+            '-map', '0:v', *encoder_profiles.audio_map(source_info, input_index=1), '-c:v', 'copy', *encoder_profiles.audio_args(profile, source_info),
+            '-shortest', '-movflags', '+faststart', output_path,
+        ]
+        commands.append(command)
+        concat_log = os.path.join(work_dir, 'concat.log')
+        run = ffmpeg_runner.run_ffmpeg(command, concat_log, timeout_seconds)
+        with open(log_filepath, 'a') as log_file, open(concat_log) as f:
+            log_file.write("===== CONCAT =====\n")
+            shutil.copyfileobj(f, log_file)
+        frames = sum((segment_run['progress'] or {}).get('frame') or 0 for _, segment_run in results)
+        elapsed = time.perf_counter() - started
+        progress = {'done': True, 'frame': frames, 'fps': round(frames / elapsed, 2) if elapsed else None,
+                    'speed': round(duration / elapsed, 3) if duration and elapsed else None,
+                    'out_time': duration, 'percent': 100.0}
+        return dict(run, elapsed=round(elapsed, 3), progress=progress, segments=len(plan), commands=commands)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
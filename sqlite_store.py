@@ -0,0 +1,46 @@
+from contextlib import closing
+import os
+import sqlite3
+
+# Every cache, index and queue keeps its state in its own small SQLite file. Connections are opened per
+# call with closing(connect(...)), so threads and worker processes never share one; WAL lets readers
+# run alongside the single writer.
+
+
+def connect(db_path, rows=False):
+    # Autocommit connection; pass rows=True for sqlite3.Row results
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    if rows:
+        conn.row_factory = sqlite3.Row
+    return conn
+
+
+def initialize(db_path, schema):
+    # Creates the database (and its directory) with the given schema, in WAL mode
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    with closing(connect(db_path)) as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(schema)
+
+
+def count(conn, name, amount=1):
+    # Adds to a row of the store's `counters (name TEXT PRIMARY KEY, value INTEGER)` table
+    conn.execute(
+        "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        (name, amount)
+    )
+
+
+def counters(conn):
+    return {row[0]: row[1] for row in conn.execute("SELECT name, value FROM counters")}
+
+
+def disk_usage(db_path):
+    # Bytes used by the database file and its WAL and shared-memory files
+    total = 0
+    for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
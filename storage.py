@@ -0,0 +1,201 @@
+from contextlib import closing
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+
+from werkzeug.security import safe_join
+
+import sqlite_store
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workspaces (
+    name TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS workspaces_last_access ON workspaces (last_access);
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    workspace TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_workspace ON artifacts (workspace);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class ArtifactStore:
+    """Per-job working directories under one root, with an index of the files in them and age/size quotas.
+
+    Each job writes into its own workspace (<root>/jobs/<name>/) and registers what it produced with add(),
+    so serving and accounting read the index instead of listing directories. Workspaces are the unit of
+    garbage collection: collect() removes whole workspaces idle for longer than max_age_seconds, then the
+    least recently accessed ones until the total is under max_bytes. Workspaces touched within
+    grace_seconds are never collected, which protects renders that are still running.
+    """
+
+    def __init__(self, root, db_path, max_bytes, max_age_seconds, grace_seconds=3600, gc_interval=600,
+                 touch_interval=60, subdir='jobs'):
+        self.root = os.path.abspath(root)
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.grace_seconds = grace_seconds
+        self.gc_interval = gc_interval
+        self.touch_interval = touch_interval
+        self.subdir = subdir
+        self._lock = threading.Lock()
+        self._started_pid = None
+        self._stop = threading.Event()
+        os.makedirs(os.path.join(self.root, subdir), exist_ok=True)
+        sqlite_store.initialize(db_path, _SCHEMA)
+
+    def _connect(self):
+        return sqlite_store.connect(self.db_path, rows=True)
+
+    def path(self, relpath):
+        # Absolute path of a workspace or artifact; None if relpath would escape the root
+        return safe_join(self.root, relpath)
+
+    def workspace(self, name=None):
+        """Creates (or reuses) a workspace and returns its path relative to the root, e.g. 'jobs/<name>'."""
+        name = f"{self.subdir}/{name or uuid.uuid4().hex}"
+        directory = self.path(name)
+        if directory is None:
+            raise ValueError(f"Invalid workspace name {name!r}")
+        os.makedirs(directory, exist_ok=True)
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO workspaces (name, created_at, last_access) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET last_access = excluded.last_access",
+                (name, now, now)
+            )
+        return name
+
+    def add(self, relpath, kind):
+        """Indexes a finished file inside a workspace; returns relpath for convenience."""
+        workspace = os.path.dirname(relpath)
+        size = os.path.getsize(self.path(relpath))
+        now = time.time()
+        with closing(self._connect()) as conn:
+            previous = conn.execute("SELECT size FROM artifacts WHERE path = ?", (relpath,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (path, workspace, kind, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                (relpath, workspace, kind, size, now)
+            )
+            conn.execute(
+                "INSERT INTO workspaces (name, bytes, created_at, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET bytes = bytes + excluded.bytes, last_access = excluded.last_access",
+                (workspace, size - (previous['size'] if previous else 0), now, now)
+            )
+        return relpath
+
+    def discard(self, relpath):
+        # Forget a file that was removed by someone else (e.g. render cache eviction)
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT workspace, size FROM artifacts WHERE path = ?", (relpath,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM artifacts WHERE path = ?", (relpath,))
+                conn.execute("UPDATE workspaces SET bytes = MAX(0, bytes - ?) WHERE name = ?", (row['size'], row['workspace']))
+
+    def lookup(self, relpath):
+        """Returns the index row of an artifact as a dict, or None if it isn't a known artifact."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT path, workspace, kind, size, created_at FROM artifacts WHERE path = ?",
+                               (relpath,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def touch(self, relpath):
+        # Marks the artifact's workspace as recently used; rate-limited so hot files don't write on every request
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE workspaces SET last_access = ? WHERE name = ? AND last_access < ?",
+                (now, os.path.dirname(relpath), now - self.touch_interval)
+            )
+
+    def _remove(self, conn, name):
+        shutil.rmtree(self.path(name), ignore_errors=True)
+        conn.execute("DELETE FROM artifacts WHERE workspace = ?", (name,))
+        conn.execute("DELETE FROM workspaces WHERE name = ?", (name,))
+
+    def collect(self):
+        """Removes expired workspaces, then LRU workspaces over the size quota. Returns what was removed."""
+        now = time.time()
+        removed = 0
+        freed = 0
+        with closing(self._connect()) as conn:
+            protected_after = now - self.grace_seconds
+            if self.max_age_seconds:
+                expired = conn.execute(
+                    "SELECT name, bytes FROM workspaces WHERE last_access < ? AND last_access < ?",
+                    (now - self.max_age_seconds, protected_after)
+                ).fetchall()
+                for row in expired:
+                    self._remove(conn, row['name'])
+                    removed += 1
+                    freed += row['bytes']
+
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM workspaces").fetchone()[0]
+            if self.max_bytes and total > self.max_bytes:
+                for row in conn.execute("SELECT name, bytes FROM workspaces WHERE last_access < ? ORDER BY last_access",
+                                        (protected_after,)).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._remove(conn, row['name'])
+                    total -= row['bytes']
+                    removed += 1
+                    freed += row['bytes']
+            if removed:
+                sqlite_store.count(conn, 'collected_workspaces', removed)
+                sqlite_store.count(conn, 'collected_bytes', freed)
+        if removed:
+            print(f"[STORAGE] Collected {removed} workspace(s), {freed} bytes from {self.root}", flush=True)
+        return {'workspaces': removed, 'bytes': freed}
+
+    def start(self):
+        with self._lock:
+            # Like the render pool, the collector thread is (re)started once per process
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            thread = threading.Thread(target=self._collect_forever, name='storage-gc', daemon=True)
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _collect_forever(self):
+        while True:
+            try:
+                self.collect()
+            except (OSError, sqlite3.Error) as e:
+                print(f"[STORAGE] Garbage collection of {self.root} failed: {e}", flush=True)
+            if self._stop.wait(self.gc_interval):
+                return
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            workspaces, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM workspaces").fetchone()
+            artifacts = conn.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+            counters = sqlite_store.counters(conn)
+        return {
+            'root': self.root,
+            'workspaces': workspaces,
+            'artifacts': artifacts,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'max_age_seconds': self.max_age_seconds,
+            'collected_workspaces': counters.get('collected_workspaces', 0),
+            'collected_bytes': counters.get('collected_bytes', 0),
+        }
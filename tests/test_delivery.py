@@ -0,0 +1,118 @@
+from flask import Flask, abort
+import pytest
+
+from delivery import IMMUTABLE_CACHE_CONTROL, OFFLOAD_X_ACCEL, REVALIDATE_CACHE_CONTROL, OutputDelivery
+from media_ingest import file_sha256
+from storage import ArtifactStore
+
+VIDEO = bytes(range(256)) * 16
+
+
+def make_client(delivery):
+    app = Flask(__name__)
+
+    @app.route('/generated/<path:filename>')
+    def generated(filename):
+        response = delivery.serve(filename)
+        if response is None:
+            abort(404)
+        return response
+
+    return app.test_client()
+
+
+@pytest.fixture
+def directory(tmp_path):
+    (tmp_path / 'output_abc.mp4').write_bytes(VIDEO)
+    (tmp_path / 'qr.png').write_bytes(b'png')
+    return tmp_path
+
+
+def test_serves_with_content_etag(directory):
+    client = make_client(OutputDelivery(str(directory)))
+
+    response = client.get('/generated/output_abc.mp4')
+    assert response.status_code == 200
+    assert response.data == VIDEO
+    assert response.headers['ETag'] == f'"{file_sha256(str(directory / "output_abc.mp4"))}"'
+    assert response.headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert client.get('/generated/qr.png').headers['Cache-Control'] == REVALIDATE_CACHE_CONTROL
+
+
+def test_if_none_match_returns_304(directory):
+    client = make_client(OutputDelivery(str(directory)))
+    etag = client.get('/generated/output_abc.mp4').headers['ETag']
+
+    response = client.get('/generated/output_abc.mp4', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert client.get('/generated/output_abc.mp4', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_range_returns_206(directory):
+    client = make_client(OutputDelivery(str(directory)))
+
+    response = client.get('/generated/output_abc.mp4', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == VIDEO[100:200]
+    assert response.headers['Content-Range'] == f"bytes 100-199/{len(VIDEO)}"
+
+
+def test_if_range_with_stale_etag_returns_whole_file(directory):
+    client = make_client(OutputDelivery(str(directory)))
+
+    response = client.get('/generated/output_abc.mp4', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == VIDEO
+
+
+def test_etag_follows_file_content(directory):
+    delivery = OutputDelivery(str(directory))
+    path = str(directory / 'qr.png')
+    before = delivery.etag(path)
+    (directory / 'qr.png').write_bytes(b'another png')
+
+    assert delivery.etag(path) != before
+    assert delivery.etag(path) == file_sha256(path)
+
+
+def test_rejects_names_outside_directory(directory):
+    client = make_client(OutputDelivery(str(directory)))
+
+    assert client.get('/generated/missing.mp4').status_code == 404
+    assert client.get('/generated/.hidden').status_code == 404
+    assert client.get('/generated/sub/output_abc.mp4').status_code == 404
+
+
+def test_x_accel_offload_keeps_conditional_requests(directory):
+    client = make_client(OutputDelivery(str(directory), offload=OFFLOAD_X_ACCEL, offload_min_bytes=1024))
+
+    response = client.get('/generated/output_abc.mp4')
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected-generated/output_abc.mp4'
+    assert response.data == b''
+    assert client.get('/generated/qr.png').data == b'png'
+    response = client.get('/generated/output_abc.mp4', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_unknown_offload_mode():
+    with pytest.raises(ValueError):
+        OutputDelivery('.', offload='sendfile')
+
+
+def test_index_limits_served_files(tmp_path):
+    store = ArtifactStore(str(tmp_path / 'root'), str(tmp_path / 'storage.sqlite3'), max_bytes=0, max_age_seconds=0)
+    workspace = store.workspace('job')
+    with open(store.path(f"{workspace}/output_abc.mp4"), 'wb') as f:
+        f.write(VIDEO)
+    with open(store.path(f"{workspace}/unindexed.mp4"), 'wb') as f:
+        f.write(VIDEO)
+    store.add(f"{workspace}/output_abc.mp4", 'video')
+    client = make_client(OutputDelivery(store.root, index=store))
+
+    response = client.get(f'/generated/{workspace}/output_abc.mp4')
+    assert response.status_code == 200
+    assert response.data == VIDEO
+    assert client.get(f'/generated/{workspace}/unindexed.mp4').status_code == 404
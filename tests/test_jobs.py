@@ -0,0 +1,137 @@
+import sqlite3
+
+import pytest
+
+import jobs
+from jobs import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs.sqlite3'), lease_seconds=300, max_attempts=2, retention_seconds=3600)
+
+
+def test_claim_takes_oldest_queued_job(queue):
+    first = queue.enqueue({'n': 1})
+    second = queue.enqueue({'n': 2})
+
+    job = queue.claim('worker-a')
+    assert job['id'] == first
+    assert job['payload'] == {'n': 1}
+    assert job['status'] == jobs.STATUS_RUNNING
+    assert job['worker'] == 'worker-a'
+    assert job['attempts'] == 1
+    assert queue.claim('worker-b')['id'] == second
+    assert queue.claim('worker-c') is None
+    assert queue.counts() == {jobs.STATUS_RUNNING: 2}
+
+
+def test_claim_on_empty_queue(queue):
+    assert queue.claim('worker-a') is None
+
+
+def test_claim_reports_lock_timeout(queue, monkeypatch):
+    queue.enqueue({})
+    holder = sqlite3.connect(queue.db_path, isolation_level=None)
+    holder.execute('BEGIN IMMEDIATE')
+
+    def connect():
+        conn = sqlite3.connect(queue.db_path, timeout=0.05, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    monkeypatch.setattr(queue, '_connect', connect)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='locked'):
+            queue.claim('worker-a')
+    finally:
+        holder.execute('ROLLBACK')
+        holder.close()
+    assert queue.claim('worker-a') is not None
+
+
+def test_complete_drops_payload(queue):
+    job_id = queue.enqueue({'vast_input': 'x' * 1000})
+    queue.claim('worker-a')
+    queue.update_progress(job_id, 'encoding', 0.5, {'fps': 30})
+    queue.complete(job_id, {'video_url': '/generated/output.mp4'})
+
+    job = queue.get(job_id)
+    assert job['status'] == jobs.STATUS_DONE
+    assert job['progress'] == 1.0
+    assert job['payload'] == {}
+    assert job['details'] is None
+    assert job['result'] == {'video_url': '/generated/output.mp4'}
+
+
+def test_fail_keeps_progress(queue):
+    job_id = queue.enqueue({})
+    queue.claim('worker-a')
+    queue.update_progress(job_id, 'encoding', 0.4)
+    queue.fail(job_id, 'ffmpeg failed')
+
+    job = queue.get(job_id)
+    assert job['status'] == jobs.STATUS_FAILED
+    assert job['error'] == 'ffmpeg failed'
+    assert job['progress'] == pytest.approx(0.4)
+
+
+def test_requeue_stale_returns_job_to_queue(queue):
+    job_id = queue.enqueue({'n': 1})
+    queue.claim('worker-a')
+    queue.lease_seconds = 0
+
+    assert queue.requeue_stale() == 1
+    job = queue.get(job_id)
+    assert job['status'] == jobs.STATUS_QUEUED
+    assert job['worker'] is None
+    assert job['payload'] == {'n': 1}
+    assert queue.claim('worker-b')['attempts'] == 2
+
+
+def test_requeue_stale_fails_after_max_attempts(queue):
+    job_id = queue.enqueue({'n': 1})
+    queue.lease_seconds = 0
+    for _ in range(queue.max_attempts):
+        queue.claim('worker-a')
+        queue.requeue_stale()
+
+    job = queue.get(job_id)
+    assert job['status'] == jobs.STATUS_FAILED
+    assert job['error'] == 'Exceeded retry limit after worker restarts.'
+    assert job['payload'] == {}
+    assert queue.claim('worker-b') is None
+
+
+def test_requeue_stale_leaves_live_jobs(queue):
+    job_id = queue.enqueue({})
+    queue.claim('worker-a')
+
+    assert queue.requeue_stale() == 0
+    assert queue.get(job_id)['status'] == jobs.STATUS_RUNNING
+
+
+def test_prune_removes_only_expired_finished_jobs(queue, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(jobs.time, 'time', lambda: now[0])
+    done = queue.enqueue({})
+    queue.claim('worker-a')
+    queue.complete(done, {})
+    queued = queue.enqueue({})
+
+    now[0] += 3599
+    assert queue.prune() == 0
+    now[0] += 2
+    assert queue.prune() == 1
+    assert queue.get(done) is None
+    assert queue.get(queued)['status'] == jobs.STATUS_QUEUED
+
+
+def test_prune_disabled(queue):
+    queue.retention_seconds = 0
+    job_id = queue.enqueue({})
+    queue.claim('worker-a')
+    queue.complete(job_id, {})
+
+    assert queue.prune() == 0
+    assert queue.get(job_id) is not None
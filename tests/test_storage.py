@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+import storage
+from storage import ArtifactStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(storage.time, 'time', lambda: now[0])
+    return now
+
+
+def make_store(tmp_path, **kwargs):
+    options = dict(max_bytes=0, max_age_seconds=0, grace_seconds=60, touch_interval=0)
+    options.update(kwargs)
+    return ArtifactStore(str(tmp_path / 'root'), str(tmp_path / 'storage.sqlite3'), **options)
+
+
+def add_file(store, name, size, filename='output.mp4'):
+    workspace = store.workspace(name)
+    relpath = f"{workspace}/{filename}"
+    with open(store.path(relpath), 'wb') as f:
+        f.write(b'\0' * size)
+    return store.add(relpath, 'video')
+
+
+def test_add_and_lookup(tmp_path, clock):
+    store = make_store(tmp_path)
+    relpath = add_file(store, 'a', 100)
+    add_file(store, 'a', 50, filename='qr.png')
+
+    assert store.lookup(relpath)['size'] == 100
+    assert store.lookup('jobs/a/missing.mp4') is None
+    stats = store.stats()
+    assert (stats['workspaces'], stats['artifacts'], stats['bytes']) == (1, 2, 150)
+
+
+def test_collect_expired_workspaces(tmp_path, clock):
+    store = make_store(tmp_path, max_age_seconds=600)
+    old = add_file(store, 'old', 100)
+    clock[0] += 500
+    fresh = add_file(store, 'fresh', 100)
+    clock[0] += 200
+
+    assert store.collect() == {'workspaces': 1, 'bytes': 100}
+    assert store.lookup(old) is None
+    assert not os.path.exists(store.path('jobs/old'))
+    assert store.lookup(fresh) is not None
+    assert store.stats()['collected_workspaces'] == 1
+
+
+def test_collect_lru_over_quota(tmp_path, clock):
+    store = make_store(tmp_path, max_bytes=250)
+    first = add_file(store, 'first', 100)
+    clock[0] += 10
+    second = add_file(store, 'second', 100)
+    clock[0] += 10
+    third = add_file(store, 'third', 100)
+    clock[0] += 10
+    # Reading the oldest workspace makes the second one least recently used
+    store.touch(first)
+    clock[0] += 100
+
+    assert store.collect() == {'workspaces': 1, 'bytes': 100}
+    assert store.lookup(second) is None
+    assert store.lookup(first) is not None and store.lookup(third) is not None
+    assert store.stats()['bytes'] == 200
+
+
+def test_collect_spares_workspaces_in_grace_period(tmp_path, clock):
+    store = make_store(tmp_path, max_bytes=50, max_age_seconds=1)
+    relpath = add_file(store, 'rendering', 100)
+    clock[0] += 30
+
+    assert store.collect() == {'workspaces': 0, 'bytes': 0}
+    assert store.lookup(relpath) is not None
+    clock[0] += 60
+    assert store.collect() == {'workspaces': 1, 'bytes': 100}
+
+
+def test_discard_updates_workspace_size(tmp_path, clock):
+    store = make_store(tmp_path)
+    relpath = add_file(store, 'a', 100)
+    add_file(store, 'a', 40, filename='qr.png')
+    store.discard(relpath)
+
+    assert store.lookup(relpath) is None
+    assert store.stats()['bytes'] == 40
+
+
+def test_path_rejects_escape(tmp_path):
+    store = make_store(tmp_path)
+    assert store.path('../outside') is None
+    with pytest.raises(ValueError):
+        store.workspace('../../outside')
@@ -0,0 +1,183 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import vast_resolver
+from vast_resolver import TagCache, VastResolutionError, VastResolver, cache_ttl
+
+INLINE = """<VAST version="3.0">
+  <Ad id="inner">
+    <InLine>
+      <AdSystem>Stub</AdSystem>
+      <Impression>http://tracker.example/inline</Impression>
+      <Creatives><Creative><Linear>
+        <Duration>00:00:10</Duration>
+        <MediaFiles><MediaFile type="video/mp4" width="1280" height="720">http://media.example/ad.mp4</MediaFile></MediaFiles>
+      </Linear></Creative></Creatives>
+    </InLine>
+  </Ad>
+</VAST>"""
+
+
+def wrapper(ad_id, tag_uri, impression, namespace=''):
+    xmlns = f' xmlns="{namespace}"' if namespace else ''
+    return f"""<VAST version="4.0"{xmlns}>
+  <Ad id="{ad_id}">
+    <Wrapper>
+      <AdSystem>Stub</AdSystem>
+      <Impression>{impression}</Impression>
+      <VASTAdTagURI>{tag_uri}</VASTAdTagURI>
+    </Wrapper>
+  </Ad>
+</VAST>"""
+
+
+class StubServer:
+    """Serves canned VAST documents by path and counts how often each one was requested."""
+
+    def __init__(self):
+        self.routes = {}
+        self.hits = {}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.hits[self.path] = stub.hits.get(self.path, 0) + 1
+                if self.path not in stub.routes:
+                    self.send_error(404)
+                    return
+                body, headers = stub.routes[self.path]
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+
+    def add(self, path, body, **headers):
+        self.routes[path] = (body, {name.replace('_', '-'): value for name, value in headers.items()})
+        return self.url(path)
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    server.thread.start()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def texts(root, tag):
+    return [element.text.strip() for element in root.iter() if element.tag.rpartition('}')[2] == tag]
+
+
+def test_wrapper_chain_resolves_to_inline(stub):
+    inline_url = stub.add('/inline', INLINE)
+    middle_url = stub.add('/middle', wrapper('middle', inline_url, 'http://tracker.example/middle'))
+    outer = wrapper('outer', middle_url, 'http://tracker.example/outer')
+
+    root = ET.fromstring(VastResolver(max_depth=5).resolve_document(outer))
+
+    ads = root.findall('Ad')
+    assert len(ads) == 1
+    assert ads[0].get('id') == 'outer'
+    assert ads[0].find('InLine') is not None and ads[0].find('Wrapper') is None
+    assert sorted(texts(root, 'Impression')) == [
+        'http://tracker.example/inline', 'http://tracker.example/middle', 'http://tracker.example/outer']
+    assert texts(root, 'MediaFile') == ['http://media.example/ad.mp4']
+
+
+def test_namespaced_wrapper_resolves(stub):
+    inline_url = stub.add('/inline', INLINE)
+    outer = wrapper('outer', inline_url, 'http://tracker.example/outer', namespace='http://www.iab.com/VAST')
+
+    root = ET.fromstring(VastResolver().resolve_document(outer))
+
+    ad = root.find('{http://www.iab.com/VAST}Ad')
+    assert ad.find('{http://www.iab.com/VAST}InLine/{http://www.iab.com/VAST}Creatives') is not None
+    assert sorted(texts(root, 'Impression')) == ['http://tracker.example/inline', 'http://tracker.example/outer']
+
+
+def test_wrapper_limit(stub):
+    # /loop wraps itself, so only max_depth stops it
+    loop_url = stub.url('/loop')
+    stub.add('/loop', wrapper('loop', loop_url, 'http://tracker.example/loop'))
+
+    with pytest.raises(VastResolutionError, match='Wrapper limit of 3 reached'):
+        VastResolver(max_depth=3).resolve_url(loop_url)
+    assert stub.hits['/loop'] == 4
+
+
+def test_unresolvable_ad_reports_error(stub):
+    outer = wrapper('outer', stub.url('/missing'), 'http://tracker.example/outer')
+
+    with pytest.raises(VastResolutionError, match='Ad outer: Error fetching wrapped VAST'):
+        VastResolver().resolve_document(outer)
+
+
+def test_fetch_honors_max_age(stub):
+    url = stub.add('/cached', INLINE, Cache_Control='public, max-age=60')
+    resolver = VastResolver()
+
+    assert resolver.fetch(url) == INLINE
+    assert resolver.fetch(url) == INLINE
+    assert stub.hits['/cached'] == 1
+
+
+def test_fetch_does_not_cache_no_store(stub):
+    url = stub.add('/fresh', INLINE, Cache_Control='no-store, max-age=60')
+    resolver = VastResolver()
+
+    resolver.fetch(url)
+    resolver.fetch(url)
+    assert stub.hits['/fresh'] == 2
+
+
+def test_tag_cache_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(vast_resolver.time, 'time', lambda: now[0])
+    cache = TagCache()
+    cache.put('http://a', 'A', ttl=30)
+    cache.put('http://b', 'B', ttl=0)
+
+    assert cache.get('http://a') == 'A'
+    assert cache.get('http://b') is None
+    now[0] += 30
+    assert cache.get('http://a') is None
+
+
+def test_tag_cache_is_bounded():
+    cache = TagCache(max_entries=2)
+    for url in ('http://a', 'http://b', 'http://c'):
+        cache.put(url, url, ttl=60)
+
+    assert cache.get('http://a') is None
+    assert cache.get('http://c') == 'http://c'
+
+
+@pytest.mark.parametrize('headers, expected', [
+    ({}, 0),
+    ({'Cache-Control': 'max-age=120'}, 120),
+    ({'Cache-Control': 'max-age="120"', 'Age': '20'}, 100),
+    ({'Cache-Control': 'max-age=10', 'Age': '30'}, 0),
+    ({'Cache-Control': 'no-cache, max-age=120'}, 0),
+    ({'Cache-Control': 'max-age=soon'}, 0),
+    ({'Expires': 'Thu, 01 Jan 2026 00:05:00 GMT', 'Date': 'Thu, 01 Jan 2026 00:00:00 GMT'}, 300),
+    ({'Expires': '0'}, 0),
+])
+def test_cache_ttl(headers, expected):
+    assert cache_ttl(headers) == expected
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""vast2ctv: convert VAST tags to CTV L-Bar videos without the web app.
+
+    python vast2ctv.py https://ads.example.com/vast.xml tag.xml
+    python vast2ctv.py --jobs 4 --list tags.txt > results.jsonl
+    curl -s https://ads.example.com/vast.xml | python vast2ctv.py -
+
+Each source is a VAST URL, a path to a VAST file, or "-" for VAST XML on stdin. Every ad found (ad pods
+are split) is rendered, and one JSON object per ad is printed to stdout as its render finishes, followed
+by the batch manifest. Pipeline logging goes to stderr. Exits with 1 when any ad failed.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+# encoder_profiles needs only the standard library. The pipeline, with requests and its caches, is imported
+# once the arguments check out, and Pillow and qrcode only when something is drawn
+import encoder_profiles
+
+
+def read_sources(args):
+    sources = list(args.sources)
+    if args.list:
+        with (contextlib.nullcontext(sys.stdin) if args.list == '-' else open(args.list, 'r', encoding='utf-8')) as f:
+            sources += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if sources.count('-') > 1 or ('-' in sources and args.list == '-'):
+        raise SystemExit("vast2ctv: stdin can only be read once")
+    # Raw XML is itself a valid batch source, so stdin is passed through as the document
+    return [sys.stdin.read() if source == '-' else source for source in sources]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='vast2ctv', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='*', help='VAST URLs, VAST files, or "-" for stdin.')
+    parser.add_argument('--list', metavar='FILE', help='File with one VAST URL or path per line ("-" for stdin).')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Renders to run in parallel (default: BATCH_WORKERS).')
+    parser.add_argument('--profile', choices=sorted(encoder_profiles.PROFILES), default=None, help='Encoder profile (default: ENCODER_PROFILE).')
+    parser.add_argument('--layout', default=None, help='Layout template name from LAYOUTS_DIR (default: LAYOUT).')
+    parser.add_argument('--output-dir', help='Where workspaces and caches are written (default: GENERATED_FOLDER).')
+    args = parser.parse_args(argv)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    sources = read_sources(args)
+    if not sources:
+        parser.error("no VAST sources given")
+    if args.output_dir:
+        # Read by pipeline on import
+        os.environ['GENERATED_FOLDER'] = os.path.abspath(args.output_dir)
+
+    real_stdout = sys.stdout
+    failed = False
+    # Everything the pipeline prints is logging; stdout carries only the JSON lines
+    with contextlib.redirect_stdout(sys.stderr):
+        import pipeline
+        try:
+            pipeline.load_layout(args.layout)
+        except (pipeline.UnknownLayoutError, pipeline.LayoutError) as e:
+            parser.error(str(e))
+        for event in pipeline.run_batch_conversion(sources, workers=args.jobs, profile_name=args.profile,
+                                                  layout_name=args.layout):
+            if event.get('output_filename') and event.get('status') == 'done':
+                event['output_path'] = pipeline.artifacts.path(event['output_filename'])
+            if event.get('manifest_filename'):
+                event['manifest_path'] = pipeline.artifacts.path(event['manifest_filename'])
+            if event['type'] == 'manifest':
+                failed = event['summary']['failed'] > 0
+            print(json.dumps(event), file=real_stdout, flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+import re
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+
+# Bytes (or characters) handed to the pull parser at a time
+CHUNK_SIZE = 64 * 1024
+
+_DURATION = re.compile(r"^\s*(\d+):(\d{1,2}):(\d{1,2}(?:\.\d+)?)\s*$")
+
+
+def parse_duration(text):
+    # VAST durations are HH:MM:SS or HH:MM:SS.mmm; returns seconds, or None when missing or malformed
+    match = _DURATION.match(text or '')
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _int(value):
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _bool(value):
+    return None if value is None else value.strip().lower() in ('true', '1')
+
+
+class _Model:
+    __slots__ = ()
+
+    def to_dict(self):
+        result = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, _Model) else item for item in value]
+            result[name] = value
+        return result
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__[:3])
+        return f"{type(self).__name__}({fields}, ...)"
+
+
+class MediaFile(_Model):
+    __slots__ = ('url', 'type', 'delivery', 'width', 'height', 'bitrate', 'min_bitrate', 'max_bitrate', 'codec',
+                 'id', 'scalable', 'maintain_aspect_ratio', 'api_framework', 'index')
+
+    def __init__(self, attrib, url, index):
+        self.url = url
+        self.type = attrib.get('type')
+        self.delivery = attrib.get('delivery')
+        self.width = _int(attrib.get('width'))
+        self.height = _int(attrib.get('height'))
+        self.bitrate = _int(attrib.get('bitrate'))
+        self.min_bitrate = _int(attrib.get('minBitrate'))
+        self.max_bitrate = _int(attrib.get('maxBitrate'))
+        self.codec = attrib.get('codec')
+        self.id = attrib.get('id')
+        self.scalable = _bool(attrib.get('scalable'))
+        self.maintain_aspect_ratio = _bool(attrib.get('maintainAspectRatio'))
+        self.api_framework = attrib.get('apiFramework')
+        # Position among the ad's MediaFiles, so callers can fall back to document order
+        self.index = index
+
+
+class TrackingEvent(_Model):
+    __slots__ = ('event', 'url', 'offset')
+
+    def __init__(self, event, url, offset=None):
+        self.event = event
+        self.url = url
+        self.offset = offset
+
+
+class VastAd(_Model):
+    """One <Ad>: what the converter needs for rendering plus the trackers, for reporting and wrappers."""
+
+    __slots__ = ('id', 'sequence', 'ad_type', 'kind', 'version', 'ad_system', 'ad_title', 'description', 'advertiser',
+                 'ad_serving_id', 'universal_ad_id', 'duration', 'skip_offset', 'media_files', 'mezzanine',
+                 'click_through', 'click_trackings', 'custom_clicks', 'impressions', 'errors', 'tracking_events',
+                 'wrapper_uri')
+
+    def __init__(self, attrib, version):
+        self.id = attrib.get('id')
+        self.sequence = attrib.get('sequence')
+        self.ad_type = attrib.get('adType')
+        self.kind = None  # 'inline' or 'wrapper'
+        self.version = version
+        self.ad_system = None
+        self.ad_title = None
+        self.description = None
+        self.advertiser = None
+        self.ad_serving_id = None
+        self.universal_ad_id = None
+        self.duration = None
+        self.skip_offset = None
+        self.media_files = []
+        self.mezzanine = None
+        self.click_through = None
+        self.click_trackings = []
+        self.custom_clicks = []
+        self.impressions = []
+        self.errors = []
+        self.tracking_events = []
+        self.wrapper_uri = None
+
+    def mp4_media_files(self):
+        return [media_file for media_file in self.media_files if media_file.type == 'video/mp4' and media_file.url]
+
+
+class VastDocument(_Model):
+    __slots__ = ('version', 'ads', 'errors')
+
+    def __init__(self, version=None):
+        self.version = version
+        self.ads = []
+        # Document-level <Error> URLs (a VAST with no ads, VAST 3+)
+        self.errors = []
+
+
+def _events(source, chunk_size):
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    if isinstance(source, (str, bytes)):
+        for offset in range(0, len(source), chunk_size):
+            parser.feed(source[offset:offset + chunk_size])
+            yield from parser.read_events()
+    else:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def _text(element):
+    return element.text.strip() if element is not None and element.text else ''
+
+
+def _texts(parent, tag):
+    return [text for text in map(_text, parent.findall(tag)) if text]
+
+
+@lru_cache(maxsize=8)
+def _tags(ns):
+    # Qualified tag names for a namespace. Lookups only ever use single tags (never 'a/b' paths or
+    # './/'), which Element.find/findall resolve in C without going through ElementPath.
+    return {name: f"{ns}{name}" for name in (
+        'Ad', 'InLine', 'Wrapper', 'AdSystem', 'AdTitle', 'Description', 'Advertiser', 'AdServingId', 'VASTAdTagURI',
+        'Impression', 'Error', 'Creatives', 'Creative', 'UniversalAdId', 'Linear', 'Duration', 'MediaFiles', 'MediaFile',
+        'Mezzanine', 'VideoClicks', 'ClickThrough', 'ClickTracking', 'CustomClick', 'TrackingEvents', 'Tracking',
+    )}
+
+
+def _read_ad(element, version, ns):
+    # Fills a VastAd from one complete <Ad> subtree, walking down child by child
+    tags = _tags(ns)
+    ad = VastAd(element.attrib, version)
+    body = element.find(tags['InLine'])
+    ad.kind = 'inline'
+    if body is None:
+        body = element.find(tags['Wrapper'])
+        ad.kind = 'wrapper' if body is not None else None
+    if body is None:
+        return ad
+
+    ad.ad_system = _text(body.find(tags['AdSystem'])) or None
+    ad.ad_title = _text(body.find(tags['AdTitle'])) or None
+    ad.description = _text(body.find(tags['Description'])) or None
+    ad.advertiser = _text(body.find(tags['Advertiser'])) or None
+    ad.ad_serving_id = _text(body.find(tags['AdServingId'])) or None
+    ad.wrapper_uri = _text(body.find(tags['VASTAdTagURI'])) or None
+    ad.impressions = _texts(body, tags['Impression'])
+    ad.errors = _texts(body, tags['Error'])
+
+    creatives = body.find(tags['Creatives'])
+    for creative in creatives.findall(tags['Creative']) if creatives is not None else ():
+        if ad.universal_ad_id is None:
+            ad.universal_ad_id = _text(creative.find(tags['UniversalAdId'])) or None
+        # Companions and non-linear creatives carry no MediaFiles or video clicks the converter can use
+        linear = creative.find(tags['Linear'])
+        if linear is None:
+            continue
+        ad.skip_offset = ad.skip_offset or linear.get('skipoffset')
+        if ad.duration is None:
+            ad.duration = parse_duration(_text(linear.find(tags['Duration'])))
+        media_files = linear.find(tags['MediaFiles'])
+        if media_files is not None:
+            for media_file in media_files.findall(tags['MediaFile']):
+                ad.media_files.append(MediaFile(media_file.attrib, _text(media_file) or None, len(ad.media_files)))
+            if ad.mezzanine is None:
+                ad.mezzanine = _text(media_files.find(tags['Mezzanine'])) or None
+        video_clicks = linear.find(tags['VideoClicks'])
+        if video_clicks is not None:
+            if ad.click_through is None:
+                ad.click_through = _text(video_clicks.find(tags['ClickThrough'])) or None
+            ad.click_trackings += _texts(video_clicks, tags['ClickTracking'])
+            ad.custom_clicks += _texts(video_clicks, tags['CustomClick'])
+        tracking_events = linear.find(tags['TrackingEvents'])
+        for tracking in tracking_events.findall(tags['Tracking']) if tracking_events is not None else ():
+            url = _text(tracking)
+            if url:
+                ad.tracking_events.append(TrackingEvent(tracking.get('event'), url, tracking.get('offset')))
+    return ad
+
+
+def _namespace(tag):
+    return tag[:tag.index('}') + 1] if tag[:1] == '{' else ''
+
+
+def parse_vast(source, chunk_size=CHUNK_SIZE, max_ads=None):
+    """Parses a VAST 2/3/4 document (str, bytes or a file object) in one pass.
+
+    Documents larger than chunk_size are fed to a pull parser in chunks. Each <Ad> is read as soon as its
+    end tag arrives and then emptied, so memory is bounded by the largest single ad rather than the whole
+    document, and with max_ads the rest of the document is never parsed at all. Smaller documents are
+    parsed in one call, which is faster and needs no more memory than a single chunk. Either way, fields
+    are read with direct child lookups, never `.//` scans. Only Linear creatives contribute MediaFiles
+    and clicks. Namespaced (VAST 4) documents are accepted. Raises xml.etree.ElementTree.ParseError on
+    malformed XML.
+    """
+    document = VastDocument()
+    if isinstance(source, (str, bytes)) and len(source) <= chunk_size:
+        root = ET.fromstring(source)
+        tags = _tags(_namespace(root.tag))
+        document.version = root.get('version')
+        document.ads = [_read_ad(element, document.version, _namespace(root.tag))
+                        for element in root.findall(tags['Ad'])[:max_ads]]
+        document.errors = _texts(root, tags['Error'])
+        return document
+
+    root = None
+    for event, element in _events(source, chunk_size):
+        if event == 'start':
+            if root is None:
+                root = element
+                ns = _namespace(element.tag)
+                ad_tag = _tags(ns)['Ad']
+                document.version = element.get('version')
+            continue
+        # <Ad> only ever appears as a direct child of <VAST>
+        if element.tag == ad_tag:
+            document.ads.append(_read_ad(element, document.version, ns))
+            element.clear()
+            if max_ads is not None and len(document.ads) >= max_ads:
+                return document
+    if root is not None:
+        # Document-level <Error>s (sent when there are no ads) are still attached to the finished root
+        document.errors = _texts(root, _tags(ns)['Error'])
+    return document
+
+
+def has_wrapper(source, chunk_size=CHUNK_SIZE):
+    """True if any <Ad> in the document is a <Wrapper>.
+
+    The document is streamed through the pull parser and each <Ad> is emptied as it ends, so memory stays
+    bounded like parse_vast(), and the scan stops at the first wrapper. Raises ParseError on malformed XML.
+    """
+    depth = 0
+    for event, element in _events(source, chunk_size):
+        if event == 'start':
+            depth += 1
+            # <VAST> is depth 1, <Ad> 2 and the ad's <InLine>/<Wrapper> body 3
+            if depth == 3 and element.tag.rpartition('}')[2] == 'Wrapper':
+                return True
+            continue
+        depth -= 1
+        if depth == 1:
+            element.clear()
+    return False
@@ -0,0 +1,240 @@
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import vast_parser
+
+# Elements a wrapper contributes to the ad it points at, per the VAST wrapper merge rules
+_WRAPPER_AD_LEVEL_TAGS = ('Impression', 'Error', 'ViewableImpression')
+
+
+class VastResolutionError(Exception):
+    pass
+
+
+def build_session(pool_size=16):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def cache_ttl(headers, default_ttl=0):
+    # Seconds a fetched tag may be reused, from Cache-Control (then Expires); 0 means don't cache
+    cache_control = headers.get('Cache-Control', '')
+    directives = {}
+    for part in cache_control.split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    age = 0
+    try:
+        age = int(headers.get('Age', 0))
+    except ValueError:
+        pass
+    if 'max-age' in directives:
+        try:
+            return max(0, int(directives['max-age']) - age)
+        except ValueError:
+            return 0
+    if headers.get('Expires'):
+        try:
+            expires = parsedate_to_datetime(headers['Expires'])
+            date = parsedate_to_datetime(headers['Date']) if headers.get('Date') else None
+            now = date.timestamp() if date else time.time()
+            return max(0, int(expires.timestamp() - now))
+        except (TypeError, ValueError):
+            return 0
+    return default_ttl
+
+
+class TagCache:
+    """Bounded in-memory cache of fetched VAST documents with per-entry expiry."""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            expires_at, text = entry
+            if expires_at <= time.time():
+                del self._entries[url]
+                return None
+            self._entries.move_to_end(url)
+            return text
+
+    def put(self, url, text, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[url] = (time.time() + ttl, text)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Lookups go through '{*}' so they match tags with or without a namespace (VAST 4 documents declare
+# xmlns="http://www.iab.com/VAST"); every element of an ad is moved into one namespace before merging
+def _path(*tags):
+    return '/'.join(f"{{*}}{tag}" for tag in tags)
+
+
+def _qualify(element, namespace):
+    # Puts element and its subtree into `namespace` ('' for none), so an ad fetched from a document in
+    # another namespace can be merged into or appended to this one
+    for child in element.iter():
+        if isinstance(child.tag, str):
+            local = child.tag.rpartition('}')[2]
+            child.tag = f"{{{namespace}}}{local}" if namespace else local
+    return element
+
+
+def _namespace(element):
+    return element.tag[1:element.tag.index('}')] if element.tag[:1] == '{' else ''
+
+
+def _child(parent, tag):
+    element = parent.find(_path(tag))
+    if element is None:
+        namespace = _namespace(parent)
+        element = ET.SubElement(parent, f"{{{namespace}}}{tag}" if namespace else tag)
+    return element
+
+
+def merge_wrapper(wrapper_ad, resolved_ad):
+    # Folds a wrapper's impressions, errors, tracking events and click tracking into the ad it wraps
+    wrapper = wrapper_ad.find(_path('Wrapper'))
+    body = resolved_ad.find(_path('InLine'))
+    if body is None:
+        body = resolved_ad.find(_path('Wrapper'))
+    if wrapper is None or body is None:
+        return resolved_ad
+
+    for tag in _WRAPPER_AD_LEVEL_TAGS:
+        for element in wrapper.findall(_path(tag)):
+            body.append(element)
+
+    wrapper_linear = wrapper.find(_path('Creatives', 'Creative', 'Linear'))
+    resolved_linear = body.find(_path('Creatives', 'Creative', 'Linear'))
+    if wrapper_linear is not None and resolved_linear is not None:
+        trackings = wrapper_linear.findall(_path('TrackingEvents', 'Tracking'))
+        if trackings:
+            tracking_events = _child(resolved_linear, 'TrackingEvents')
+            for tracking in trackings:
+                tracking_events.append(tracking)
+        wrapper_clicks = wrapper_linear.find(_path('VideoClicks'))
+        if wrapper_clicks is not None:
+            video_clicks = _child(resolved_linear, 'VideoClicks')
+            for click_tracking in wrapper_clicks.findall(_path('ClickTracking')):
+                video_clicks.append(click_tracking)
+            # Wrappers aren't supposed to carry a ClickThrough, but some do; the inline one still wins
+            wrapper_clickthrough = wrapper_clicks.find(_path('ClickThrough'))
+            if wrapper_clickthrough is not None and video_clicks.find(_path('ClickThrough')) is None:
+                video_clicks.insert(0, wrapper_clickthrough)
+    return resolved_ad
+
+
+class VastResolver:
+    """Follows <Wrapper>/<VASTAdTagURI> chains and returns fully resolved InLine VAST documents.
+
+    Fetches share one pooled HTTP session and a TTL cache that honors Cache-Control. Sibling ads in a pod
+    are resolved in parallel. The session and cache can be injected, e.g. to point at a stub server.
+    """
+
+    def __init__(self, session=None, cache=None, max_depth=5, timeout_seconds=10, max_workers=8):
+        self.session = session or build_session(max_workers * 2)
+        self.cache = cache if cache is not None else TagCache()
+        self.max_depth = max_depth
+        self.timeout_seconds = timeout_seconds
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='vast-fetch')
+
+    def fetch(self, url):
+        cached = self.cache.get(url)
+        if cached is not None:
+            print(f"[VAST RESOLVER] Cache hit for {url}", flush=True)
+            return cached
+        response = self.session.get(url, timeout=self.timeout_seconds)
+        response.raise_for_status()
+        text = response.text
+        self.cache.put(url, text, cache_ttl(response.headers))
+        return text
+
+    def fetch_document(self, url):
+        # fetch() with request failures reported as VastResolutionError
+        try:
+            return self.fetch(url)
+        except requests.RequestException as e:
+            raise VastResolutionError(f"Error fetching VAST URL: {e}")
+
+    def resolve_url(self, url):
+        return self.resolve_document(self.fetch_document(url))
+
+    def resolve_document(self, vast_content):
+        # Documents without wrappers are only streamed through, never built into a tree
+        if not vast_parser.has_wrapper(vast_content):
+            return vast_content
+        root = ET.fromstring(vast_content)
+        ads = root.findall(_path('Ad'))
+
+        resolved = list(self._executor.map(self._resolve_ad_safely, ads))
+        errors = [error for ad, error in resolved if error]
+        resolved_ads = [ad for ad, error in resolved if ad is not None]
+        if not resolved_ads:
+            raise VastResolutionError("; ".join(errors) or "VAST document has no resolvable ads.")
+        for error in errors:
+            print(f"[VAST RESOLVER] Dropped ad from pod: {error}", flush=True)
+
+        for ad in ads:
+            root.remove(ad)
+        for ad in resolved_ads:
+            root.append(_qualify(ad, _namespace(root)))
+        return ET.tostring(root, encoding='unicode')
+
+    def _resolve_ad_safely(self, ad):
+        try:
+            return self._resolve_ad(ad, depth=0), None
+        except VastResolutionError as e:
+            return None, f"Ad {ad.get('id') or '?'}: {e}"
+
+    def _resolve_ad(self, ad, depth):
+        wrapper = ad.find(_path('Wrapper'))
+        if wrapper is None:
+            return ad
+        if depth >= self.max_depth:
+            raise VastResolutionError(f"Wrapper limit of {self.max_depth} reached")
+        tag_uri_element = wrapper.find(_path('VASTAdTagURI'))
+        tag_uri = tag_uri_element.text.strip() if tag_uri_element is not None and tag_uri_element.text else None
+        if not tag_uri:
+            raise VastResolutionError("Wrapper has no VASTAdTagURI")
+        print(f"[VAST RESOLVER] Following wrapper (depth {depth + 1}): {tag_uri}", flush=True)
+        try:
+            inner_root = ET.fromstring(self.fetch(tag_uri))
+        except requests.RequestException as e:
+            raise VastResolutionError(f"Error fetching wrapped VAST {tag_uri}: {e}")
+        except ET.ParseError as e_xml:
+            raise VastResolutionError(f"Invalid XML in wrapped VAST {tag_uri}: {e_xml}")
+        inner_ads = inner_root.findall(_path('Ad'))
+        if not inner_ads:
+            raise VastResolutionError(f"Wrapped VAST {tag_uri} returned no ads")
+        inner_ad = _qualify(self._resolve_ad(inner_ads[0], depth + 1), _namespace(ad))
+        merged = merge_wrapper(ad, inner_ad)
+        # Keep the outer ad's identity so pod positions stay stable
+        for attribute in ('id', 'sequence'):
+            if ad.get(attribute) is not None:
+                merged.set(attribute, ad.get(attribute))
+        return merged